@@ -2,11 +2,24 @@ from flask import Flask, render_template, request, jsonify
 from flask_cors import CORS
 import json
 import os
-from datetime import datetime
-import pandas as pd
+import gzip
+from datetime import datetime, timezone
 # from strategy import run_backtest
 from backend.core.binance_symbols import binance_symbols_manager
 from backend.core.binance_data_loader import binance_data_loader
+from backend.core.ingestion_jobs import ingestion_job_manager
+from backend.core.backtest_jobs import backtest_job_manager, BACKTEST_RETRY_AFTER
+from backend.core.coverage_catalog import coverage_catalog
+from backend.core.db import db
+from backend.core.candle_payload import (
+    CANDLE_FORMATS, BINARY_MIMETYPE, PAGE_DIRECTIONS, CHART_MAX_PAGE_BARS,
+    bars_for_width, choose_bar_timeframe, fetch_candle_columns, next_cursor,
+    to_rows, to_columnar, to_binary
+)
+from backend.core.resampler import can_resample
+from backend.core.http_cache import http_cache
+from backend.core.backtest_results import backtest_results_manager
+from backend.core.backtest_memo import backtest_memo
 from auth import auth_manager
 
 
@@ -25,11 +38,53 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 
+# Сжатие ответов API (если клиент прислал Accept-Encoding: gzip)
+GZIP_MIN_BYTES = int(os.getenv('HTTP_GZIP_MIN_BYTES', 2048))
+GZIP_LEVEL = int(os.getenv('HTTP_GZIP_LEVEL', 5))
+GZIP_MIMETYPES = {'application/json', 'application/octet-stream'}
+
+# Запускать фоновые потоки при импорте. В режиме gunicorn preload_app приложение
+# импортируется в мастере, а потоки после fork не наследуются - их запускает post_fork
+APP_BACKGROUND_AUTOSTART = os.getenv('APP_BACKGROUND_AUTOSTART', '1') == '1'
+
+
+def start_background_services():
+    """Запускает фоновые потоки процесса (повторный вызов ничего не делает)"""
+    # Диспетчер очереди бэктестов (забирает задачи, оставшиеся в очереди после рестарта).
+    # Первым: он делает fork пула процессов, пока в процессе нет других потоков и подключений к БД
+    backtest_job_manager.start_dispatcher()
+    # Фоновая проверка брошенных задач загрузки (возобновление после рестарта)
+    ingestion_job_manager.start_watchdog()
+
+
+# Процессы пула forkserver заново импортируют главный модуль (python app.py) как __mp_main__
+if APP_BACKGROUND_AUTOSTART and __name__ != '__mp_main__':
+    start_background_services()
+
 @app.before_request
 def auth_middleware():
     """Проверка авторизации для всех запросов"""
     return auth_manager.require_auth()
     
+@app.after_request
+def compress_response(response):
+    """Сжимает gzip крупные JSON/бинарные ответы, если клиент это поддерживает"""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in GZIP_MIMETYPES
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+    
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    
+    response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+    
 @app.context_processor
 def inject_grafana():
     dashboards_str = os.getenv('DASHBOARDS', '{}')
@@ -56,13 +111,20 @@ def backtest_page():
 def get_strategies():
     """API для получения списка доступных стратегий"""
     try:
-        from strategies import get_strategies_list
-        strategies = get_strategies_list()
+        from strategies import get_strategies_list, get_strategies_version
         
-        return jsonify({
-            'success': True,
-            'strategies': strategies
-        })
+        # Список меняется только вместе с файлами strategies/str
+        version = get_strategies_version()
+        last_modified = datetime.fromtimestamp(max(mtime for _, mtime in version) / 1e9, tz=timezone.utc) if version else None
+        
+        return http_cache.respond(
+            ('strategies',), version,
+            lambda: jsonify({
+                'success': True,
+                'strategies': get_strategies_list()
+            }),
+            last_modified
+        )
     except Exception as e:
         return jsonify({
             'success': False,
@@ -71,53 +133,29 @@ def get_strategies():
     
 @app.route('/api/get_trades', methods=['GET'])
 def get_trades():
-    """Получение сделок из последнего бэктеста"""
+    """Получение сделок прогона бэктеста (run_id, по умолчанию - последний прогон)"""
     try:
-        import psycopg2
-        
-        DB_CONFIG = {
-            'host': os.getenv('POSTGRES_HOST', 'localhost'),
-            'port': int(os.getenv('POSTGRES_PORT', 5432)),
-            'database': os.getenv('POSTGRES_DATABASE', 'backtrader'),
-            'user': os.getenv('POSTGRES_USER'),
-            'password': os.getenv('POSTGRES_PASSWORD')
-        }
-        
-        conn = psycopg2.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                EXTRACT(EPOCH FROM entry_date) as entry_time,
-                EXTRACT(EPOCH FROM exit_date) as exit_time,
-                entry_price,
-                exit_price,
-                side,
-                pnl
-            FROM current_trades
-            ORDER BY entry_date ASC
-        """)
-        
-        rows = cursor.fetchall()
-        
-        trades = []
-        for row in rows:
-            trades.append({
-                'entry_time': int(row[0]),
-                'exit_time': int(row[1]),
-                'entry_price': float(row[2]),
-                'exit_price': float(row[3]),
-                'side': row[4],
-                'pnl': float(row[5])
-            })
-        
-        cursor.close()
-        conn.close()
+        run_id = request.args.get('run_id', type=int)
+        if run_id is None:
+            run_id = backtest_results_manager.latest_run_id()
+            if run_id is None:
+                return jsonify({
+                    'status': 'success',
+                    'run_id': None,
+                    'trades': []
+                })
+        
+        # Сделки прогона неизменны - версия нужна только, чтобы отличить удаленный прогон
+        version = backtest_results_manager.get_trades_version(run_id)
+        if version is None:
+            return jsonify({
+                'status': 'error',
+                'message': f'Прогон #{run_id} не найден'
+            }), 404
         
-        return jsonify({
-            'status': 'success',
-            'trades': trades
-        })
+        return http_cache.respond(
+            ('get_trades', run_id), version, lambda: build_trades_response(run_id)
+        )
         
     except Exception as e:
         return jsonify({
@@ -125,12 +163,31 @@ def get_trades():
             'message': str(e)
         }), 500
 
+def build_trades_response(run_id):
+    """Строит ответ get_trades по сделкам прогона"""
+    rows = backtest_results_manager.get_trades(run_id)
+    
+    trades = []
+    for row in rows:
+        trades.append({
+            'entry_time': int(row[0]),
+            'exit_time': int(row[1]),
+            'entry_price': float(row[2]),
+            'exit_price': float(row[3]),
+            'side': row[4],
+            'pnl': float(row[5])
+        })
+    
+    return jsonify({
+        'status': 'success',
+        'run_id': run_id,
+        'trades': trades
+    })
+
 @app.route('/api/backtest', methods=['POST'])
 def backtest():
-    """API для запуска бэктеста"""
+    """API постановки бэктеста в очередь (результат - через /api/backtest_jobs/<id>)"""
     try:
-        from backend.core.backtest_runner import backtest_runner
-        
         data = request.json
         
         # Получение параметров
@@ -154,20 +211,40 @@ def backtest():
                 'error': 'Не все обязательные поля заполнены'
             }), 400
         
-        # Запуск бэктеста
-        result = backtest_runner.run_backtest(
-            symbol=symbol,
-            timeframe=timeframe,
-            start_date=start_date,
-            end_date=end_date,
-            strategy_module=strategy_module,
-            strategy_class=strategy_class,
-            strategy_params=strategy_params,
-            initial_cash=initial_cash,
-            commission=commission
-        )
+        params = {
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'start_date': start_date,
+            'end_date': end_date,
+            'strategy_module': strategy_module,
+            'strategy_class': strategy_class,
+            'strategy_params': strategy_params,
+            'initial_cash': initial_cash,
+            'commission': commission
+        }
+        
+        # Такой же бэктест на тех же данных уже считали - отдаем результат сразу, без очереди
+        cached = backtest_memo.lookup(params)
+        if cached is not None:
+            return jsonify({**cached, 'cached': True})
+        
+        # Бэктест выполняется на пуле процессов, воркер Flask сразу освобождается
+        job_id, position = backtest_job_manager.submit(params)
         
-        return jsonify(result)
+        if job_id is None:
+            response = jsonify({
+                'success': False,
+                'error': 'Очередь бэктестов заполнена, повторите позже',
+                'queue_length': position
+            })
+            response.headers['Retry-After'] = str(BACKTEST_RETRY_AFTER)
+            return response, 429
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'queue_position': position
+        }), 202
     
     except Exception as e:
         import traceback
@@ -178,6 +255,155 @@ def backtest():
         }), 500
 
 
+@app.route('/api/backtest_jobs', methods=['GET'])
+def list_backtest_jobs():
+    """Список последних бэктестов и состояние очереди"""
+    try:
+        limit = min(int(request.args.get('limit', 20)), 200)
+        return jsonify({
+            'success': True,
+            'jobs': backtest_job_manager.list_jobs(limit),
+            'queue': backtest_job_manager.stats(),
+            'memo': backtest_memo.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/backtest_jobs/<int:job_id>', methods=['GET'])
+def get_backtest_job(job_id):
+    """Статус, позиция в очереди и результат бэктеста"""
+    try:
+        job = backtest_job_manager.get_job(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': f'Бэктест #{job_id} не найден'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/backtest_jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_backtest_job(job_id):
+    """Отмена бэктеста"""
+    try:
+        if not backtest_job_manager.cancel(job_id):
+            return jsonify({
+                'success': False,
+                'error': f'Бэктест #{job_id} не найден или уже завершен'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'message': f'Отмена бэктеста #{job_id} запрошена'
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/sweep', methods=['POST'])
+def sweep():
+    """API постановки перебора параметров в очередь бэктестов (результат - через /api/backtest_jobs/<id>)"""
+    try:
+        from backend.core.param_sweep import expand_grid, RANK_METRICS
+        
+        data = request.json
+        
+        symbol = data.get('symbol')
+        timeframe = data.get('timeframe')
+        start_date = data.get('start_date')
+        end_date = data.get('end_date')
+        strategy_module = data.get('strategy_module')
+        strategy_class = data.get('strategy_class')
+        grid = data.get('grid')
+        rank_by = data.get('rank_by', 'total_return')
+        
+        if not all([symbol, timeframe, start_date, end_date, strategy_module, strategy_class, grid]):
+            return jsonify({
+                'success': False,
+                'error': 'Не все обязательные поля заполнены'
+            }), 400
+        
+        # Ошибки сетки и метрики возвращаем сразу, а не через очередь
+        if rank_by not in RANK_METRICS:
+            return jsonify({
+                'success': False,
+                'error': f'Неизвестная метрика ранжирования: {rank_by}'
+            }), 400
+        try:
+            expand_grid(grid)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            return jsonify({
+                'success': False,
+                'error': f'Неверная сетка параметров: {e}'
+            }), 400
+        top = data.get('top')
+        if top is not None:
+            # Целое число или строка из цифр (2.5 и true не принимаются)
+            valid = not isinstance(top, bool) and isinstance(top, (int, str)) and str(top).strip().isdigit()
+            top = int(top) if valid else 0
+            if top <= 0:
+                return jsonify({
+                    'success': False,
+                    'error': f"Параметр top должен быть целым положительным числом: {data.get('top')}"
+                }), 400
+        
+        params = {
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'start_date': start_date,
+            'end_date': end_date,
+            'strategy_module': strategy_module,
+            'strategy_class': strategy_class,
+            'grid': grid,
+            'base_params': data.get('strategy_params', {}),
+            'initial_cash': float(data.get('initial_cash', 10000)),
+            'commission': float(data.get('commission', 0.001)) / 100,  # Переводим из % в доли
+            'rank_by': rank_by,
+            'top': top
+        }
+        
+        # Перебор выполняется в слоте очереди бэктестов - под тем же лимитом CPU и очереди
+        job_id, position = backtest_job_manager.submit(params, kind='sweep')
+        
+        if job_id is None:
+            response = jsonify({
+                'success': False,
+                'error': 'Очередь бэктестов заполнена, повторите позже',
+                'queue_length': position
+            })
+            response.headers['Retry-After'] = str(BACKTEST_RETRY_AFTER)
+            return response, 429
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'queue_position': position
+        }), 202
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
@@ -197,6 +423,7 @@ def upload_file():
             file.save(filepath)
             
             # Проверка формата файла
+            import pandas as pd
             df = pd.read_csv(filepath, nrows=5)
             required_columns = ['open', 'high', 'low', 'close', 'volume']
             
@@ -259,7 +486,7 @@ def download_historical_data():
         
         symbol = data.get('symbol')
         timeframe = data.get('timeframe')
-        period = data.get('period')  # 'daily' или 'monthly'
+        period = data.get('period')  # 'daily', 'monthly' или 'auto'
         start_date = data.get('start_date')
         end_date = data.get('end_date')
         
@@ -276,7 +503,11 @@ def download_historical_data():
             timeframe=timeframe,
             period=period,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            concurrency=data.get('concurrency'),
+            max_retries=data.get('max_retries'),
+            offline=data.get('offline'),
+            only_missing=bool(data.get('only_missing', False))
         )
         
         if success:
@@ -326,55 +557,147 @@ def download_historical_data():
             'message': f'Ошибка загрузки данных: {str(e)}'
         }), 500
 
-@app.route('/api/get_available_data', methods=['GET'])
-def get_available_data():
-    """Получение доступных символов, таймфреймов и диапазонов дат"""
+@app.route('/api/ingestion_jobs', methods=['POST'])
+def submit_ingestion_job():
+    """Постановка фоновой задачи загрузки исторических данных"""
     try:
-        import psycopg2
-        
-        DB_CONFIG = {
-            'host': os.getenv('POSTGRES_HOST', 'localhost'),
-            'port': int(os.getenv('POSTGRES_PORT', 5432)),
-            'database': os.getenv('POSTGRES_DATABASE', 'backtrader'),
-            'user': os.getenv('POSTGRES_USER'),
-            'password': os.getenv('POSTGRES_PASSWORD')
-        }
+        data = request.json
         
-        conn = psycopg2.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        
-        # Получаем уникальные комбинации символов и таймфреймов с датами
-        cursor.execute("""
-            SELECT 
-                symbol, 
-                timeframe,
-                MIN(time) as start_date,
-                MAX(time) as end_date,
-                COUNT(*) as candles_count
-            FROM candles
-            GROUP BY symbol, timeframe
-            ORDER BY symbol, timeframe
-        """)
-        
-        rows = cursor.fetchall()
-        
-        data = []
-        for row in rows:
-            data.append({
-                'symbol': row[0],
-                'timeframe': row[1],
-                'start_date': row[2].strftime('%Y-%m-%d'),
-                'end_date': row[3].strftime('%Y-%m-%d'),
-                'candles_count': row[4]
-            })
+        required = ['symbol', 'timeframe', 'period', 'start_date', 'end_date']
+        if not all(data.get(key) for key in required):
+            return jsonify({
+                'status': 'error',
+                'message': 'Все поля обязательны для заполнения'
+            }), 400
+        
+        job_id = ingestion_job_manager.submit(data)
+        
+        return jsonify({
+            'status': 'success',
+            'job_id': job_id,
+            'message': f'Задача загрузки #{job_id} поставлена в очередь'
+        }), 202
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Ошибка постановки задачи: {str(e)}'
+        }), 500
+
+
+@app.route('/api/batch_ingestion', methods=['POST'])
+def submit_batch_ingestion():
+    """Постановка пакетной загрузки по списку символов (или фильтру binance_symbols) и таймфреймов"""
+    try:
+        data = request.json
+        
+        if not data.get('symbols') and not data.get('symbol_pattern'):
+            return jsonify({
+                'status': 'error',
+                'message': 'Нужен список symbols или фильтр symbol_pattern'
+            }), 400
+        
+        required = ['timeframes', 'period', 'start_date', 'end_date']
+        if not all(data.get(key) for key in required):
+            return jsonify({
+                'status': 'error',
+                'message': 'Все поля обязательны для заполнения'
+            }), 400
+        
+        params = dict(data, kind='batch')
+        for key in ('symbols', 'timeframes'):
+            if isinstance(params.get(key), str):
+                params[key] = [item.strip() for item in params[key].split(',') if item.strip()]
+        
+        job_id = ingestion_job_manager.submit(params)
+        
+        return jsonify({
+            'status': 'success',
+            'job_id': job_id,
+            'message': f'Пакетная загрузка #{job_id} поставлена в очередь'
+        }), 202
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Ошибка постановки пакетной загрузки: {str(e)}'
+        }), 500
+
+
+@app.route('/api/ingestion_jobs', methods=['GET'])
+def list_ingestion_jobs():
+    """Список последних задач загрузки"""
+    try:
+        limit = min(int(request.args.get('limit', 20)), 200)
+        return jsonify({
+            'status': 'success',
+            'jobs': ingestion_job_manager.list_jobs(limit)
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Ошибка получения задач: {str(e)}'
+        }), 500
+
+
+@app.route('/api/ingestion_jobs/<int:job_id>', methods=['GET'])
+def get_ingestion_job(job_id):
+    """Статус и прогресс задачи загрузки"""
+    try:
+        job = ingestion_job_manager.get_job(job_id)
+        if job is None:
+            return jsonify({
+                'status': 'error',
+                'message': f'Задача #{job_id} не найдена'
+            }), 404
         
-        cursor.close()
-        conn.close()
+        return jsonify({
+            'status': 'success',
+            'job': job
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Ошибка получения задачи: {str(e)}'
+        }), 500
+
+
+@app.route('/api/ingestion_jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_ingestion_job(job_id):
+    """Отмена задачи загрузки"""
+    try:
+        if not ingestion_job_manager.cancel(job_id):
+            return jsonify({
+                'status': 'error',
+                'message': f'Задача #{job_id} не найдена или уже завершена'
+            }), 404
         
         return jsonify({
             'status': 'success',
-            'data': data
+            'message': f'Отмена задачи #{job_id} запрошена'
         })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Ошибка отмены задачи: {str(e)}'
+        }), 500
+
+
+@app.route('/api/get_available_data', methods=['GET'])
+def get_available_data():
+    """Получение доступных символов, таймфреймов и диапазонов дат"""
+    try:
+        version = coverage_catalog.catalog_version()
+        
+        # Читаем каталог покрытия вместо GROUP BY по всей таблице candles
+        return http_cache.respond(
+            ('get_available_data',), version,
+            lambda: jsonify({
+                'status': 'success',
+                'data': coverage_catalog.get_coverage()
+            }),
+            version[0]
+        )
         
     except Exception as e:
         return jsonify({
@@ -383,13 +706,11 @@ def get_available_data():
         }), 500
 
 
-@app.route('/api/get_candles', methods=['POST'])
+@app.route('/api/get_candles', methods=['GET', 'POST'])
 def get_candles():
-    """Получение свечей для графика"""
+    """Получение свечей для графика (GET позволяет браузеру кэшировать ответ по ETag)"""
     try:
-        import psycopg2
-        
-        data = request.json
+        data = request.json if request.method == 'POST' else request.args
         symbol = data.get('symbol')
         timeframe = data.get('timeframe')
         start_date = data.get('start_date')
@@ -401,53 +722,55 @@ def get_candles():
                 'message': 'Все параметры обязательны'
             }), 400
         
-        DB_CONFIG = {
-            'host': os.getenv('POSTGRES_HOST', 'localhost'),
-            'port': int(os.getenv('POSTGRES_PORT', 5432)),
-            'database': os.getenv('POSTGRES_DATABASE', 'backtrader'),
-            'user': os.getenv('POSTGRES_USER'),
-            'password': os.getenv('POSTGRES_PASSWORD')
-        }
+        # rows - список объектов (по умолчанию), columnar - параллельные массивы,
+        # binary - little-endian int64/float64 колонки (см. candle_payload)
+        response_format = data.get('format', 'rows')
+        if response_format not in CANDLE_FORMATS:
+            return jsonify({
+                'status': 'error',
+                'message': f'Неизвестный формат: {response_format}'
+            }), 400
         
-        conn = psycopg2.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                EXTRACT(EPOCH FROM time) as timestamp,
-                open,
-                high,
-                low,
-                close,
-                volume
-            FROM candles
-            WHERE symbol = %s 
-                AND timeframe = %s 
-                AND time >= %s 
-                AND time <= %s
-            ORDER BY time ASC
-        """, (symbol, timeframe, start_date, end_date))
-        
-        rows = cursor.fetchall()
-        
-        candles = []
-        for row in rows:
-            candles.append({
-                'time': int(row[0]),
-                'open': float(row[1]),
-                'high': float(row[2]),
-                'low': float(row[3]),
-                'close': float(row[4]),
-                'volume': float(row[5])
-            })
+        # Агрегация под график: max_bars или ширина графика в пикселях (width),
+        # bar_timeframe задается явно, чтобы следующие страницы совпадали с первой
+        try:
+            max_bars = data.get('max_bars')
+            if max_bars is None and data.get('width'):
+                max_bars = bars_for_width(data['width'])
+            bar_timeframe = data.get('bar_timeframe')
+            if bar_timeframe:
+                if bar_timeframe != timeframe and not can_resample(timeframe, bar_timeframe):
+                    raise ValueError(f'{timeframe} нельзя агрегировать в {bar_timeframe}')
+            elif max_bars:
+                bar_timeframe = choose_bar_timeframe(timeframe, start_date, end_date, int(max_bars))
+            else:
+                bar_timeframe = timeframe
+            
+            # Страницы: limit свечей графика, cursor из next_cursor предыдущего ответа
+            direction = data.get('direction', 'forward')
+            if direction not in PAGE_DIRECTIONS:
+                raise ValueError(f'Неизвестное направление: {direction}')
+            limit = data.get('limit')
+            limit = min(max(int(limit), 1), CHART_MAX_PAGE_BARS) if limit is not None else None
+            cursor = data.get('cursor')
+            cursor = int(cursor) if cursor is not None else None
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Неверные параметры: {str(e)}'
+            }), 400
         
-        cursor.close()
-        conn.close()
+        # Свечи меняются только при загрузке - версия ряда берется из каталога покрытия
+        version = coverage_catalog.series_version(symbol, timeframe)
+        key = ('get_candles', symbol, timeframe, start_date, end_date, response_format,
+               bar_timeframe, direction, limit, cursor)
         
-        return jsonify({
-            'status': 'success',
-            'candles': candles
-        })
+        return http_cache.respond(
+            key, version,
+            lambda: build_candles_response(symbol, timeframe, start_date, end_date, response_format,
+                                           bar_timeframe, cursor, direction, limit),
+            version[0] if version else None
+        )
         
     except Exception as e:
         return jsonify({
@@ -455,5 +778,55 @@ def get_candles():
             'message': f'Ошибка получения свечей: {str(e)}'
         }), 500
     
+def build_candles_response(symbol, timeframe, start_date, end_date, response_format,
+                           bar_timeframe, cursor, direction, limit):
+    """Строит ответ get_candles в запрошенном формате"""
+    columns, has_more = fetch_candle_columns(symbol, timeframe, start_date, end_date,
+                                             bar_timeframe, cursor, direction, limit)
+    page = {
+        'bar_timeframe': bar_timeframe,
+        'next_cursor': next_cursor(columns, has_more, direction)
+    }
+    
+    if response_format == 'binary':
+        response = app.response_class(to_binary(columns), mimetype=BINARY_MIMETYPE)
+        response.headers['X-Candles-Count'] = str(len(columns['time']))
+        response.headers['X-Bar-Timeframe'] = bar_timeframe
+        if page['next_cursor'] is not None:
+            response.headers['X-Next-Cursor'] = str(page['next_cursor'])
+        return response
+    
+    if response_format == 'columnar':
+        return jsonify({
+            'status': 'success',
+            'format': 'columnar',
+            'count': len(columns['time']),
+            **page,
+            **to_columnar(columns)
+        })
+    
+    return jsonify({
+        'status': 'success',
+        'candles': to_rows(columns),
+        **page
+    })
+    
+@app.route('/api/health/db', methods=['GET'])
+def db_health():
+    """Проверка доступности БД и метрики пула подключений текущего воркера"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'db': db.healthcheck()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'БД недоступна: {str(e)}',
+            'db': db.stats()
+        }), 503
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
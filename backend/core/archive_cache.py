@@ -0,0 +1,173 @@
+"""
+Модуль локального кэша ZIP архивов data.binance.vision
+"""
+import os
+import hashlib
+import logging
+import tempfile
+from typing import Optional, Dict, Any
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Настройки кэша архивов
+CACHE_DIR = os.getenv('BINANCE_CACHE_DIR', os.path.join('cache', 'binance'))
+CACHE_MAX_BYTES = int(float(os.getenv('BINANCE_CACHE_MAX_GB', 20)) * 1024 ** 3)
+CACHE_ENABLED = os.getenv('BINANCE_CACHE_ENABLED', '1') == '1'
+
+
+class ArchiveCache:
+    """
+    Контентно-адресуемый кэш архивов на диске
+
+    Архивы хранятся в objects/<sha256[:2]>/<sha256>.zip, а ключ (путь архива
+    на data.binance.vision) указывает на объект через файл refs/<ключ>.sha256.
+    Все записи атомарны (временный файл + os.replace), поэтому кэш можно
+    использовать одновременно из нескольких воркеров без общих блокировок.
+    Время последнего обращения хранится в mtime объекта и используется для
+    LRU вытеснения.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.refs_dir = os.path.join(root, 'refs')
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.zip")
+
+    def _ref_path(self, key: str) -> str:
+        return os.path.join(self.refs_dir, *key.split('/')) + '.sha256'
+
+    def _atomic_write(self, path: str, data: bytes):
+        """Записывает файл через временный файл в той же директории"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Возвращает архив из кэша
+
+        Args:
+            key: Путь архива, например monthly/klines/BTCUSDT/1m/BTCUSDT-1m-2024-01.zip
+
+        Returns:
+            Optional[bytes]: Содержимое архива или None, если его нет или он поврежден
+        """
+        try:
+            with open(self._ref_path(key), 'r') as f:
+                digest = f.read().strip()
+
+            object_path = self._object_path(digest)
+            with open(object_path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+
+        if hashlib.sha256(content).hexdigest() != digest:
+            logger.warning(f"⚠️ Поврежденный объект в кэше, удаляем: {key}")
+            self._remove(object_path)
+            return None
+
+        # Отмечаем обращение для LRU
+        try:
+            os.utime(object_path)
+        except OSError:
+            pass
+
+        return content
+
+    def put(self, key: str, content: bytes, digest: Optional[str] = None) -> str:
+        """
+        Сохраняет архив в кэш
+
+        Args:
+            key: Путь архива
+            content: Содержимое архива
+            digest: Уже посчитанный sha256 (если есть)
+
+        Returns:
+            str: sha256 содержимого
+        """
+        digest = digest or hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+
+        if not os.path.exists(object_path):
+            self._atomic_write(object_path, content)
+        self._atomic_write(self._ref_path(key), digest.encode('ascii'))
+
+        return digest
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _list_objects(self):
+        """Возвращает список (mtime, size, path) всех объектов кэша"""
+        objects = []
+        if not os.path.isdir(self.objects_dir):
+            return objects
+
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for filename in filenames:
+                if not filename.endswith('.zip'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                objects.append((st.st_mtime, st.st_size, path))
+        return objects
+
+    def evict(self) -> int:
+        """
+        Вытесняет давно не использованные архивы, пока кэш больше лимита
+
+        Ссылки на удаленные объекты остаются и считаются промахом при чтении.
+
+        Returns:
+            int: Количество удаленных объектов
+        """
+        objects = self._list_objects()
+        total = sum(size for _, size, _ in objects)
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        for _, size, path in sorted(objects):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+
+        logger.info(f"🧹 Из кэша архивов вытеснено {removed} объектов")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает размер и количество объектов кэша"""
+        objects = self._list_objects()
+        return {
+            'root': self.root,
+            'objects': len(objects),
+            'size_bytes': sum(size for _, size, _ in objects),
+            'max_bytes': self.max_bytes
+        }
+
+
+# Создаем глобальный экземпляр
+archive_cache = ArchiveCache()
@@ -0,0 +1,277 @@
+"""
+Модуль хранения рядов свечей в memory-mapped NumPy файлах
+"""
+import os
+import time
+import fcntl
+import shutil
+import logging
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Настройки хранилища массивов
+ARRAY_STORE_DIR = os.getenv('ARRAY_STORE_DIR', os.path.join('cache', 'arrays'))
+# Сколько строк читать из БД за один fetch при построении ряда
+ARRAY_STORE_FETCH_SIZE = int(os.getenv('ARRAY_STORE_FETCH_SIZE', 200000))
+
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class OHLCVArrays(NamedTuple):
+    """Срез ряда: время открытия (мс, int64) и цены (float64)"""
+    time: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+
+class ArrayStore:
+    """
+    Хранилище рядов (symbol, timeframe) в виде отдельных .npy файлов по колонкам
+
+    Ряд лежит в {symbol}/{timeframe}/v<версия>/, а файл CURRENT указывает на
+    актуальную версию. Файлы открываются через np.load(mmap_mode='r'), поэтому
+    страницы читаются с диска лениво и общие для всех воркеров через page cache.
+    Диапазон дат находится бинарным поиском по отсортированной колонке time,
+    а результат - это view без копирования.
+
+    При загрузке новых свечей хук загрузчика сбрасывает CURRENT, и ряд
+    перестраивается из БД при следующем обращении.
+    """
+
+    def __init__(self, root: str = ARRAY_STORE_DIR):
+        self.root = root
+        self._opened: Dict[Tuple[str, str], Tuple[str, OHLCVArrays]] = {}
+        self._lock = threading.Lock()
+
+    def _series_dir(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, symbol, timeframe)
+
+    def _read_file(self, path: str) -> str:
+        try:
+            with open(path, 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ''
+
+    def _write_file(self, path: str, text: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def current_version(self, symbol: str, timeframe: str) -> str:
+        """Возвращает актуальную версию ряда или пустую строку, если ряд не построен"""
+        return self._read_file(os.path.join(self._series_dir(symbol, timeframe), 'CURRENT'))
+
+    def build(self, symbol: str, timeframe: str, get_connection) -> Optional[str]:
+        """
+        Строит ряд из таблицы candles
+
+        Чтение идет одним снимком (REPEATABLE READ): сначала COUNT, затем
+        серверный курсор, строки которого пишутся прямо в memory-mapped файлы.
+
+        Args:
+            symbol: Символ
+            timeframe: Таймфрейм
+            get_connection: Функция, возвращающая подключение из пула (контекстный менеджер)
+
+        Returns:
+            Optional[str]: Версия построенного ряда или None, если свечей нет
+        """
+        series_dir = self._series_dir(symbol, timeframe)
+        os.makedirs(series_dir, exist_ok=True)
+
+        with open(os.path.join(series_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            # Пока ждали блокировку, ряд мог построить другой воркер
+            version = self.current_version(symbol, timeframe)
+            if version:
+                return version
+
+            marker = self._read_file(os.path.join(series_dir, '_invalidated'))
+            started = time.monotonic()
+            version = str(time.time_ns())
+            version_dir = os.path.join(series_dir, f"v{version}")
+            os.makedirs(version_dir)
+
+            try:
+                with get_connection() as conn:
+                    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT COUNT(*) FROM candles WHERE symbol = %s AND timeframe = %s",
+                                   (symbol, timeframe))
+                    total = cursor.fetchone()[0]
+
+                    if total == 0:
+                        conn.rollback()
+                        shutil.rmtree(version_dir, ignore_errors=True)
+                        return None
+
+                    columns = {'time': np.lib.format.open_memmap(
+                        os.path.join(version_dir, 'time.npy'), mode='w+', dtype=np.int64, shape=(total,))}
+                    for name in PRICE_COLUMNS:
+                        columns[name] = np.lib.format.open_memmap(
+                            os.path.join(version_dir, f"{name}.npy"), mode='w+', dtype=np.float64, shape=(total,))
+
+                    named = conn.cursor(name=f"array_store_{os.getpid()}_{threading.get_ident()}")
+                    named.itersize = ARRAY_STORE_FETCH_SIZE
+                    named.execute("""
+                        SELECT (EXTRACT(EPOCH FROM time) * 1000)::bigint, open, high, low, close, volume
+                        FROM candles
+                        WHERE symbol = %s AND timeframe = %s
+                        ORDER BY time
+                    """, (symbol, timeframe))
+
+                    position = 0
+                    while True:
+                        rows = named.fetchmany(ARRAY_STORE_FETCH_SIZE)
+                        if not rows:
+                            break
+                        chunk = np.array(rows, dtype=np.float64)
+                        end = position + len(rows)
+                        columns['time'][position:end] = chunk[:, 0].astype(np.int64)
+                        for index, name in enumerate(PRICE_COLUMNS, start=1):
+                            columns[name][position:end] = chunk[:, index]
+                        position = end
+
+                    named.close()
+                    conn.rollback()
+
+                for array in columns.values():
+                    array.flush()
+                del columns
+            except Exception:
+                shutil.rmtree(version_dir, ignore_errors=True)
+                raise
+
+            # Если во время построения пришли новые свечи, версия уже устарела
+            if self._read_file(os.path.join(series_dir, '_invalidated')) != marker:
+                shutil.rmtree(version_dir, ignore_errors=True)
+                logger.info(f"🔁 {symbol} {timeframe}: ряд изменился во время построения, версия не сохранена")
+                return None
+
+            self._write_file(os.path.join(series_dir, 'CURRENT'), version)
+            self._remove_old_versions(series_dir, version)
+
+        logger.info(f"🧱 {symbol} {timeframe}: построено {total} свечей за {time.monotonic() - started:.2f} сек")
+        return version
+
+    def _remove_old_versions(self, series_dir: str, keep: str):
+        """Удаляет старые версии (открытые mmap продолжают работать до закрытия)"""
+        for name in os.listdir(series_dir):
+            if name.startswith('v') and name != f"v{keep}":
+                shutil.rmtree(os.path.join(series_dir, name), ignore_errors=True)
+
+    def open_series(self, symbol: str, timeframe: str, get_connection=None) -> Optional[OHLCVArrays]:
+        """
+        Возвращает ряд целиком как memory-mapped массивы
+
+        Args:
+            symbol: Символ
+            timeframe: Таймфрейм
+            get_connection: Функция подключения к БД для построения отсутствующего ряда
+
+        Returns:
+            Optional[OHLCVArrays]: Массивы ряда или None, если данных нет
+        """
+        key = (symbol, timeframe)
+        version = self.current_version(symbol, timeframe)
+
+        with self._lock:
+            opened = self._opened.get(key)
+            if opened and opened[0] == version:
+                return opened[1]
+
+        if not version:
+            if get_connection is None:
+                return None
+            version = self.build(symbol, timeframe, get_connection)
+            if not version:
+                return None
+
+        version_dir = os.path.join(self._series_dir(symbol, timeframe), f"v{version}")
+        arrays = OHLCVArrays(
+            time=np.load(os.path.join(version_dir, 'time.npy'), mmap_mode='r'),
+            **{name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode='r')
+               for name in PRICE_COLUMNS}
+        )
+
+        with self._lock:
+            self._opened[key] = (version, arrays)
+        return arrays
+
+    def load(self, symbol: str, timeframe: str, start_date: str, end_date: str,
+             get_connection=None) -> Optional[OHLCVArrays]:
+        """
+        Возвращает срез ряда за период [start_date, end_date] без копирования
+
+        Args:
+            symbol: Символ
+            timeframe: Таймфрейм
+            start_date: Дата начала YYYY-MM-DD
+            end_date: Дата конца YYYY-MM-DD (включительно)
+            get_connection: Функция подключения к БД для построения отсутствующего ряда
+
+        Returns:
+            Optional[OHLCVArrays]: Views на memory-mapped массивы или None, если данных нет
+        """
+        series = self.open_series(symbol, timeframe, get_connection)
+        if series is None:
+            return None
+
+        epoch = datetime(1970, 1, 1)
+        start_ms = int((datetime.strptime(start_date, '%Y-%m-%d') - epoch).total_seconds() * 1000)
+        end_ms = int((datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1) - epoch).total_seconds() * 1000)
+
+        left = int(np.searchsorted(series.time, start_ms, side='left'))
+        right = int(np.searchsorted(series.time, end_ms, side='left'))
+        if left >= right:
+            return None
+
+        return OHLCVArrays(*(column[left:right] for column in series))
+
+    def invalidate(self, symbol: str, timeframe: str, start_ms: int, end_ms: int, inserted: int = 0):
+        """Сбрасывает ряд после загрузки новых свечей (хук загрузчика)"""
+        series_dir = self._series_dir(symbol, timeframe)
+        # Директорию создает build до чтения маркера, поэтому без нее сбрасывать нечего
+        if not os.path.isdir(series_dir):
+            return
+        self._write_file(os.path.join(series_dir, '_invalidated'), str(time.time_ns()))
+
+        current = os.path.join(series_dir, 'CURRENT')
+        if os.path.exists(current):
+            os.remove(current)
+            logger.info(f"🧹 {symbol} {timeframe}: ряд в хранилище массивов сброшен")
+
+
+# Создаем глобальный экземпляр
+array_store = ArrayStore()
+
+
+if __name__ == '__main__':
+    import argparse
+    from .binance_data_loader import binance_data_loader
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='Построение рядов в хранилище memory-mapped массивов')
+    parser.add_argument('symbol')
+    parser.add_argument('timeframe')
+    args = parser.parse_args()
+
+    current = os.path.join(array_store._series_dir(args.symbol, args.timeframe), 'CURRENT')
+    if os.path.exists(current):
+        os.remove(current)
+    version = array_store.build(args.symbol, args.timeframe, binance_data_loader.get_connection)
+    print(f"{args.symbol} {args.timeframe}: версия {version or '-'}")
@@ -0,0 +1,443 @@
+"""
+Модуль очереди бэктестов: задачи в БД, выполнение на пуле процессов
+"""
+import os
+import math
+import time
+import logging
+import threading
+import multiprocessing
+import psycopg2
+import psycopg2.extras
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, List, Tuple
+from dotenv import load_dotenv
+from .db import db
+from .backtest_results import backtest_results_manager
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Сколько бэктестов выполняется одновременно на всех воркерах gunicorn (по умолчанию - все ядра);
+# лимит общий - проверяется по таблице backtest_jobs
+BACKTEST_WORKERS = int(os.getenv('BACKTEST_WORKERS', 0)) or os.cpu_count() or 1
+# Сколько веб-процессов делят этот лимит (gunicorn.conf.py выставляет по своему workers)
+GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', 1))
+# Процессов в пуле одного воркера gunicorn (по умолчанию - его доля BACKTEST_WORKERS)
+BACKTEST_POOL_SIZE = int(os.getenv('BACKTEST_POOL_SIZE', 0)) or math.ceil(BACKTEST_WORKERS / max(1, GUNICORN_WORKERS))
+# Сколько задач может ждать в очереди; сверх этого submit отказывает (HTTP 429)
+BACKTEST_QUEUE_MAX = int(os.getenv('BACKTEST_QUEUE_MAX', 20))
+# Через сколько секунд клиенту повторить запрос при заполненной очереди (Retry-After)
+BACKTEST_RETRY_AFTER = int(os.getenv('BACKTEST_RETRY_AFTER', 10))
+# Задача в статусе running без heartbeat дольше этого времени возвращается в очередь
+BACKTEST_JOB_STALE_SECONDS = int(os.getenv('BACKTEST_JOB_STALE_SECONDS', 120))
+# Сколько часов хранить завершенные задачи и их результаты
+BACKTEST_JOB_RETENTION_HOURS = float(os.getenv('BACKTEST_JOB_RETENTION_HOURS', 24))
+# Как часто диспетчер забирает задачи из очереди и обновляет heartbeat
+BACKTEST_DISPATCH_INTERVAL = float(os.getenv('BACKTEST_DISPATCH_INTERVAL', 1))
+# Как часто удалять устаревшие задачи и прогоны (backtest_results_manager.cleanup_runs)
+BACKTEST_CLEANUP_INTERVAL = int(os.getenv('BACKTEST_CLEANUP_INTERVAL', 600))
+
+JOB_PARAMS = ('symbol', 'timeframe', 'start_date', 'end_date', 'strategy_module', 'strategy_class',
+              'strategy_params', 'initial_cash', 'commission')
+SWEEP_JOB_PARAMS = ('symbol', 'timeframe', 'start_date', 'end_date', 'strategy_module', 'strategy_class',
+                    'grid', 'base_params', 'initial_cash', 'commission', 'rank_by', 'top')
+# Виды задач: бэктест (backtest_runner.run_backtest) и перебор параметров (param_sweep.run)
+JOB_KINDS = {'backtest': JOB_PARAMS, 'sweep': SWEEP_JOB_PARAMS}
+JOB_TITLES = {'backtest': 'Бэктест', 'sweep': 'Перебор'}
+
+# Ключ advisory lock, под которым воркеры по очереди забирают задачи и проверяют лимиты
+DISPATCH_LOCK_KEY = 7240021
+
+
+def _init_worker():
+    """Прогревает ядра Numba в новом процессе пула (NUMBA_WARMUP)"""
+    from .jit import NUMBA_WARMUP, warmup
+    if NUMBA_WARMUP:
+        # Задача занимает одно ядро - пул потоков parallel ядер в каждом процессе не поднимаем
+        warmup(parallel=False)
+
+
+def _cancel_requested(job_id: int) -> bool:
+    """Проверяет флаг отмены задачи (вызывается из процесса пула)"""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT cancel_requested FROM backtest_jobs WHERE id = %s", (job_id,))
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def _run_job(job_id: int, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Выполняет бэктест или перебор параметров в процессе пула"""
+    cancel_check = lambda: _cancel_requested(job_id)
+    if kind == 'sweep':
+        from .param_sweep import param_sweep
+        # Перебор занимает один слот очереди - считается в этом процессе и в один поток
+        return param_sweep.run(**params, workers=1, numba_threads=1, cancel_check=cancel_check)
+    from .backtest_runner import backtest_runner
+    return backtest_runner.run_backtest(**params, cancel_check=cancel_check)
+
+
+class BacktestJobManager:
+    """
+    Класс очереди бэктестов
+
+    Задачи (бэктесты и переборы параметров) хранятся в таблице backtest_jobs.
+    Каждый воркер gunicorn держит диспетчер (поток) и свой пул из
+    BACKTEST_POOL_SIZE процессов; задачу забирает тот диспетчер, который
+    первым получил advisory lock, и только если на всех воркерах выполняется
+    меньше BACKTEST_WORKERS задач. Поэтому CPU занят не больше, чем ядер,
+    а потоки Flask остаются свободными для остальных запросов.
+    """
+
+    def __init__(self):
+        self._schema_ready = False
+        self._executor = None
+        self._running = {}
+        self._dispatcher = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._last_requeue = 0.0
+        self._last_cleanup = 0.0
+
+    def get_connection(self):
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
+
+    def ensure_schema(self):
+        """Создает таблицу backtest_jobs, если ее нет"""
+        if self._schema_ready:
+            return
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS backtest_jobs (
+                    id BIGSERIAL PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    params JSONB NOT NULL,
+                    result JSONB,
+                    message TEXT,
+                    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                    worker_pid INTEGER,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    started_at TIMESTAMPTZ,
+                    finished_at TIMESTAMPTZ,
+                    heartbeat_at TIMESTAMPTZ
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS backtest_jobs_status_idx
+                ON backtest_jobs (status, id)
+            """)
+            cursor.execute("ALTER TABLE backtest_jobs ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'backtest'")
+            conn.commit()
+
+        self._schema_ready = True
+
+    def submit(self, params: Dict[str, Any], kind: str = 'backtest') -> Tuple[Optional[int], int]:
+        """
+        Ставит бэктест или перебор параметров в очередь
+
+        Args:
+            params: Аргументы backtest_runner.run_backtest (kind='sweep' - param_sweep.run)
+            kind: Вид задачи (JOB_KINDS)
+
+        Returns:
+            Tuple[Optional[int], int]: (ID задачи, позиция в очереди);
+                если очередь заполнена - (None, количество ожидающих задач)
+        """
+        self.ensure_schema()
+        job_params = {key: params.get(key) for key in JOB_KINDS[kind] if params.get(key) is not None}
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Проверка длины очереди и вставка под одной блокировкой - лимит не превысят параллельные запросы
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (DISPATCH_LOCK_KEY,))
+            cursor.execute("SELECT COUNT(*) FROM backtest_jobs WHERE status = 'queued'")
+            queued = cursor.fetchone()[0]
+            if queued >= BACKTEST_QUEUE_MAX:
+                conn.rollback()
+                logger.warning(f"⚠️ Очередь бэктестов заполнена ({queued}/{BACKTEST_QUEUE_MAX})")
+                return None, queued
+
+            cursor.execute(
+                "INSERT INTO backtest_jobs (kind, params) VALUES (%s, %s) RETURNING id",
+                (kind, psycopg2.extras.Json(job_params))
+            )
+            job_id = cursor.fetchone()[0]
+            conn.commit()
+
+        logger.info(f"📨 {JOB_TITLES[kind]} #{job_id} поставлен в очередь (позиция {queued + 1})")
+        self.start_dispatcher()
+        self._wakeup.set()
+        return job_id, queued + 1
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # fork - только из главного потока (start_dispatcher в post_fork): после fork из другого
+            # потока пул потоков TBB, поднятый ядрами Numba, в дочернем процессе неисправен. Из потока
+            # диспетчера (пересоздание упавшего пула) и потоков Flask процессы берутся у forkserver
+            context = None
+            if threading.current_thread() is not threading.main_thread():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(max_workers=BACKTEST_POOL_SIZE, initializer=_init_worker,
+                                                 mp_context=context)
+        return self._executor
+
+    def _claim(self) -> Optional[Tuple[int, str, Dict[str, Any]]]:
+        """
+        Забирает самую старую задачу из очереди, если есть свободный слот
+
+        Returns:
+            Optional[Tuple[int, str, Dict[str, Any]]]: (ID задачи, вид, параметры) или None
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (DISPATCH_LOCK_KEY,))
+            cursor.execute("SELECT COUNT(*) FROM backtest_jobs WHERE status = 'running'")
+            if cursor.fetchone()[0] >= BACKTEST_WORKERS:
+                return None
+
+            cursor.execute("""
+                UPDATE backtest_jobs
+                SET status = 'running', started_at = now(), heartbeat_at = now(), worker_pid = %s
+                WHERE id = (
+                    SELECT id FROM backtest_jobs
+                    WHERE status = 'queued' AND NOT cancel_requested
+                    ORDER BY id
+                    LIMIT 1
+                )
+                RETURNING id, kind, params
+            """, (os.getpid(),))
+            row = cursor.fetchone()
+            conn.commit()
+        return tuple(row) if row else None
+
+    def _dispatch(self):
+        """Запускает задачи из очереди, пока есть свободные слоты"""
+        while len(self._running) < BACKTEST_POOL_SIZE:
+            claimed = self._claim()
+            if claimed is None:
+                return
+
+            job_id, kind, params = claimed
+            logger.info(f"▶️ {JOB_TITLES[kind]} #{job_id} запущен: {params.get('symbol')} {params.get('timeframe')}")
+            try:
+                future = self._get_executor().submit(_run_job, job_id, kind, params)
+            except BrokenProcessPool as e:
+                self._executor = None
+                self._finish(job_id, 'failed', f'Пул процессов недоступен: {e}')
+                continue
+            self._running[job_id] = (kind, future)
+            future.add_done_callback(lambda _: self._wakeup.set())
+
+    def _collect(self):
+        """Сохраняет результаты завершившихся задач"""
+        for job_id, (kind, future) in list(self._running.items()):
+            if not future.done():
+                continue
+            del self._running[job_id]
+
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                # Процесс пула упал (например, OOM) - пул пересоздается при следующем запуске (forkserver)
+                self._executor = None
+                self._finish(job_id, 'failed', f'Процесс бэктеста аварийно завершился: {e}')
+                continue
+            except Exception as e:
+                self._finish(job_id, 'failed', str(e))
+                continue
+
+            if result.get('cancelled'):
+                self._finish(job_id, 'cancelled', result.get('error'))
+            elif result.get('success'):
+                self._finish(job_id, 'done', f'{JOB_TITLES[kind]} завершен', result)
+            else:
+                self._finish(job_id, 'failed', result.get('error'), result)
+
+    def _heartbeat(self):
+        if not self._running:
+            return
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE backtest_jobs SET heartbeat_at = now()
+                WHERE id = ANY(%s) AND status = 'running'
+            """, (list(self._running),))
+            conn.commit()
+
+    def _finish(self, job_id: int, status: str, message: Optional[str], result: Optional[dict] = None):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE backtest_jobs
+                SET status = CASE WHEN cancel_requested THEN 'cancelled' ELSE %s END,
+                    message = %s, result = %s, finished_at = now(), heartbeat_at = now()
+                WHERE id = %s AND status = 'running' AND worker_pid = %s
+            """, (status, message, psycopg2.extras.Json(result) if result is not None else None,
+                  job_id, os.getpid()))
+            conn.commit()
+        logger.info(f"🏁 Задача #{job_id}: {status} - {message}")
+
+    def requeue_stale(self) -> int:
+        """
+        Возвращает в очередь задачи, воркер которых перестал обновлять heartbeat
+
+        Returns:
+            int: Количество задач
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE backtest_jobs
+                SET status = 'queued', worker_pid = NULL
+                WHERE status = 'running'
+                    AND heartbeat_at < now() - make_interval(secs => %s)
+            """, (BACKTEST_JOB_STALE_SECONDS,))
+            count = cursor.rowcount
+            conn.commit()
+        return count
+
+    def cleanup(self) -> int:
+        """
+        Удаляет завершенные задачи старше BACKTEST_JOB_RETENTION_HOURS
+
+        Returns:
+            int: Количество удаленных задач
+        """
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM backtest_jobs
+                WHERE status IN ('done', 'failed', 'cancelled')
+                    AND finished_at < now() - make_interval(secs => %s)
+            """, (BACKTEST_JOB_RETENTION_HOURS * 3600,))
+            count = cursor.rowcount
+            conn.commit()
+        if count:
+            logger.info(f"🗑️ Удалено завершенных бэктестов: {count}")
+        return count
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Запрашивает отмену задачи
+
+        Задача в очереди отменяется сразу, выполняющаяся - на ближайшей
+        проверке в run_backtest или param_sweep.run (ее результат не сохраняется).
+
+        Returns:
+            bool: True, если задача найдена и еще не завершена
+        """
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE backtest_jobs
+                SET cancel_requested = TRUE,
+                    status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                    finished_at = CASE WHEN status = 'queued' THEN now() ELSE finished_at END
+                WHERE id = %s AND status IN ('queued', 'running')
+                RETURNING id
+            """, (job_id,))
+            found = cursor.fetchone() is not None
+            conn.commit()
+        return found
+
+    def _serialize(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        job = dict(row)
+        for key in ('created_at', 'started_at', 'finished_at', 'heartbeat_at'):
+            if job.get(key) is not None:
+                job[key] = job[key].isoformat()
+        return job
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает состояние задачи (для задачи в очереди - позицию в ней)"""
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("""
+                SELECT j.id, j.kind, j.status, j.params, j.result, j.message, j.cancel_requested,
+                       j.created_at, j.started_at, j.finished_at, j.heartbeat_at,
+                       CASE WHEN j.status = 'queued' THEN (
+                           SELECT COUNT(*) FROM backtest_jobs q
+                           WHERE q.status = 'queued' AND q.id <= j.id
+                       ) END AS queue_position
+                FROM backtest_jobs j
+                WHERE j.id = %s
+            """, (job_id,))
+            row = cursor.fetchone()
+        return self._serialize(row) if row else None
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Возвращает последние задачи (без результатов)"""
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("""
+                SELECT id, kind, status, params, message, cancel_requested,
+                       created_at, started_at, finished_at, heartbeat_at
+                FROM backtest_jobs
+                ORDER BY id DESC
+                LIMIT %s
+            """, (limit,))
+            rows = cursor.fetchall()
+        return [self._serialize(row) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """Количество задач по статусам и лимиты очереди"""
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM backtest_jobs GROUP BY status")
+            counts = dict(cursor.fetchall())
+        return {
+            'workers': BACKTEST_WORKERS,
+            'pool_size': BACKTEST_POOL_SIZE,
+            'queue_max': BACKTEST_QUEUE_MAX,
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'local_running': len(self._running),
+        }
+
+    def start_dispatcher(self):
+        """Запускает диспетчер очереди (один раз на процесс)"""
+        with self._lock:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            # Процессы пула создаются сразу из вызывающего потока, а не из потока диспетчера
+            self._get_executor().submit(os.getpid)
+            self._dispatcher = threading.Thread(target=self._dispatcher_loop,
+                                                name='backtest-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _dispatcher_loop(self):
+        while True:
+            self._wakeup.wait(BACKTEST_DISPATCH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.ensure_schema()
+                self._collect()
+                self._heartbeat()
+                now = time.monotonic()
+                if now - self._last_requeue >= BACKTEST_JOB_STALE_SECONDS / 2:
+                    self._last_requeue = now
+                    requeued = self.requeue_stale()
+                    if requeued:
+                        logger.info(f"🔁 Возвращено в очередь брошенных бэктестов: {requeued}")
+                if now - self._last_cleanup >= BACKTEST_CLEANUP_INTERVAL:
+                    self._last_cleanup = now
+                    self.cleanup()
+                    backtest_results_manager.cleanup_runs()
+                self._dispatch()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка диспетчера бэктестов: {e}")
+
+
+# Создаем глобальный экземпляр
+backtest_job_manager = BacktestJobManager()
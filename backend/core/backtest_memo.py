@@ -0,0 +1,277 @@
+"""
+Модуль мемоизации результатов бэктеста по отпечатку входных данных
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+import psycopg2.extras
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+from .db import db
+from .coverage_catalog import coverage_catalog
+from .backtest_results import backtest_results_manager
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_MEMO_ENABLED = os.getenv('BACKTEST_MEMO_ENABLED', '1') == '1'
+# Сколько результатов держать в памяти процесса (первый уровень)
+BACKTEST_MEMO_SIZE = int(os.getenv('BACKTEST_MEMO_SIZE', 256))
+
+STRATEGIES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                              'strategies')
+# Код, от которого зависит результат при тех же данных и параметрах
+ENGINE_FILES = tuple(os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                     for name in ('backtest_runner.py', 'trade_simulator.py', 'metrics_nb.py'))
+
+
+def canonicalize(value):
+    """Приводит параметры к виду, не зависящему от порядка ключей и записи чисел (5 == 5.0)"""
+    if isinstance(value, dict):
+        return {str(key): canonicalize(item) for key, item in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(item) for item in value]
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return repr(float(value))
+    return str(value)
+
+
+class BacktestMemo:
+    """
+    Класс двухуровневого кэша результатов бэктеста
+
+    Отпечаток - sha256 от версии покрытия ряда (меняется при каждой записи
+    свечей), хэша исходников стратегии и движка и канонизированных
+    параметров. Первый уровень - LRU в памяти процесса, второй - таблица
+    backtest_memo, общая для всех воркеров и переживающая рестарты. Запись
+    ссылается на сохраненный прогон (backtest_runs) и удаляется вместе с ним.
+    """
+
+    def __init__(self, max_entries: int = BACKTEST_MEMO_SIZE, enabled: bool = BACKTEST_MEMO_ENABLED):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_connection(self):
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
+
+    def ensure_schema(self):
+        """Создает таблицу backtest_memo, если ее нет"""
+        if self._schema_ready:
+            return
+
+        backtest_results_manager.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS backtest_memo (
+                    fingerprint TEXT PRIMARY KEY,
+                    symbol TEXT NOT NULL,
+                    timeframe TEXT NOT NULL,
+                    sar_timeframe TEXT,
+                    run_id BIGINT NOT NULL REFERENCES backtest_runs (id) ON DELETE CASCADE,
+                    result JSONB NOT NULL,
+                    hits BIGINT NOT NULL DEFAULT 0,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    last_hit_at TIMESTAMPTZ
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS backtest_memo_series_idx
+                ON backtest_memo (symbol, timeframe)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS backtest_memo_run_id_idx
+                ON backtest_memo (run_id)
+            """)
+            conn.commit()
+
+        self._schema_ready = True
+
+    def _file_hash(self, path: str) -> Optional[str]:
+        """sha256 файла (пересчитывается только при изменении mtime/размера)"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._file_hashes.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self._file_hashes[path] = (key, digest)
+        return digest
+
+    def fingerprint(self, params: Dict[str, Any]) -> Optional[str]:
+        """
+        Считает отпечаток бэктеста
+
+        Args:
+            params: Аргументы run_backtest (symbol, timeframe, start_date, end_date,
+                strategy_module, strategy_class, strategy_params, initial_cash, commission)
+
+        Returns:
+            Optional[str]: Отпечаток или None, если ряда нет в каталоге покрытия
+        """
+        symbol = params['symbol']
+        timeframe = params['timeframe']
+        series_version = coverage_catalog.series_version(symbol, timeframe)
+        if series_version is None:
+            return None
+
+        strategy_params = params.get('strategy_params') or {}
+        sar_timeframe = strategy_params.get('sar_timeframe') or ''
+        sar_version = (coverage_catalog.series_version(symbol, sar_timeframe)
+                       if sar_timeframe and sar_timeframe != timeframe else None)
+
+        strategy_file = os.path.join(STRATEGIES_DIR, *params['strategy_module'].split('.')) + '.py'
+        payload = {
+            'series': [symbol, timeframe, [str(part) for part in series_version]],
+            'sar_series': [str(part) for part in sar_version] if sar_version else None,
+            'range': [str(params['start_date']), str(params['end_date'])],
+            'strategy': [params['strategy_module'], params['strategy_class'],
+                         self._file_hash(strategy_file), self._file_hash(os.path.join(STRATEGIES_DIR, 'base.py'))],
+            'engine': [os.getenv('BACKTEST_ENGINE', 'native')] + [self._file_hash(path) for path in ENGINE_FILES],
+            'params': canonicalize(strategy_params),
+            'initial_cash': canonicalize(params.get('initial_cash')),
+            'commission': canonicalize(params.get('commission')),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    def _remember(self, fingerprint: str, entry: Dict[str, Any]):
+        with self._lock:
+            self._entries[fingerprint] = entry
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает сохраненный результат (сначала из памяти, затем из БД)
+
+        Returns:
+            Optional[Dict[str, Any]]: Результат run_backtest или None
+        """
+        if not self.enabled or fingerprint is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+
+        # Прогон мог быть удален политикой хранения - тогда запись в памяти недействительна
+        if entry is not None and backtest_results_manager.get_trades_version(entry['run_id']) is not None:
+            self.memory_hits += 1
+            return entry['result']
+
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE backtest_memo
+                SET hits = hits + 1, last_hit_at = now()
+                WHERE fingerprint = %s
+                RETURNING run_id, result
+            """, (fingerprint,))
+            row = cursor.fetchone()
+            conn.commit()
+
+        if row is None:
+            with self._lock:
+                self._entries.pop(fingerprint, None)
+            self.misses += 1
+            return None
+
+        self.store_hits += 1
+        self._remember(fingerprint, {'run_id': row[0], 'result': row[1]})
+        return row[1]
+
+    def put(self, fingerprint: str, params: Dict[str, Any], result: Dict[str, Any]):
+        """Сохраняет успешный результат прогона на обоих уровнях"""
+        if not self.enabled or fingerprint is None or not result.get('success') or result.get('run_id') is None:
+            return
+
+        self.ensure_schema()
+        sar_timeframe = (params.get('strategy_params') or {}).get('sar_timeframe') or None
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO backtest_memo (fingerprint, symbol, timeframe, sar_timeframe, run_id, result)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (fingerprint) DO UPDATE
+                SET run_id = EXCLUDED.run_id, result = EXCLUDED.result, created_at = now()
+            """, (fingerprint, params['symbol'], params['timeframe'], sar_timeframe,
+                  result['run_id'], psycopg2.extras.Json(result)))
+            conn.commit()
+
+        self._remember(fingerprint, {'run_id': result['run_id'], 'result': result})
+
+    def lookup(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Отпечаток и поиск результата одним вызовом (None - считать заново)"""
+        if not self.enabled:
+            return None
+        return self.get(self.fingerprint(params))
+
+    def invalidate(self, symbol: str, timeframe: str, start_ms: int = None, end_ms: int = None,
+                   inserted: int = 0):
+        """
+        Удаляет результаты по ряду после загрузки новых свечей (хук загрузчика)
+
+        Отпечатки таких результатов уже не совпадут (версия покрытия изменилась),
+        поэтому сброс освобождает место, а не исправляет выдачу.
+        """
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM backtest_memo
+                WHERE symbol = %s AND (timeframe = %s OR sar_timeframe = %s)
+                RETURNING fingerprint
+            """, (symbol, timeframe, timeframe))
+            fingerprints = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+
+        with self._lock:
+            for fingerprint in fingerprints:
+                self._entries.pop(fingerprint, None)
+        self.invalidations += len(fingerprints)
+        if fingerprints:
+            logger.info(f"🧹 {symbol} {timeframe}: сброшено сохраненных бэктестов: {len(fingerprints)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики кэша текущего процесса"""
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            'enabled': self.enabled,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'memory_hits': self.memory_hits,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+
+# Создаем глобальный экземпляр
+backtest_memo = BacktestMemo()
@@ -3,95 +3,258 @@
 """
 import os
 import logging
-import psycopg2
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
+from .db import db
 import json
+import psycopg2.extras
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Настройки подключения к PostgreSQL
-DB_CONFIG = {
-    'host': os.getenv('POSTGRES_HOST', 'localhost'),
-    'port': int(os.getenv('POSTGRES_PORT', 5432)),
-    'database': os.getenv('POSTGRES_DATABASE', 'messages'),
-    'user': os.getenv('POSTGRES_USER'),
-    'password': os.getenv('POSTGRES_PASSWORD')
-}
+# Сколько последних прогонов хранить всегда (независимо от возраста)
+BACKTEST_RUNS_KEEP = int(os.getenv('BACKTEST_RUNS_KEEP', 50))
+# Прогоны сверх BACKTEST_RUNS_KEEP удаляются, когда они старше этого срока
+BACKTEST_RUNS_RETENTION_DAYS = float(os.getenv('BACKTEST_RUNS_RETENTION_DAYS', 7))
+# Сколько строк сделок удалять одной транзакцией (короткие блокировки вместо TRUNCATE)
+BACKTEST_RUNS_DELETE_BATCH = int(os.getenv('BACKTEST_RUNS_DELETE_BATCH', 5000))
+
+TRADE_COLUMNS = ('entry_date', 'entry_price', 'entry_size', 'side', 'exit_date', 'exit_price',
+                 'pnl', 'pnl_percent', 'commission', 'bars_held', 'trade_history')
 
 class BacktestResultsManager:
-    """Класс для управления результатами бэктестов"""
-    
+    """
+    Класс для управления результатами бэктестов
+
+    Каждый прогон получает run_id в таблице backtest_runs (параметры и
+    итоговые метрики), а его сделки пишутся в current_trades с этим run_id.
+    Параллельные бэктесты не затирают друг друга, а старые прогоны удаляет
+    cleanup_runs небольшими пачками.
+    """
+
+    def __init__(self):
+        self._schema_ready = False
+
     def get_connection(self):
-        """Создает подключение к PostgreSQL"""
-        try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            return conn
-        except Exception as e:
-            logger.error(f"❌ Ошибка подключения к PostgreSQL: {e}")
-            raise
-    
-    def clear_results(self):
-        """Очищает таблицу current_trades перед новым бэктестом"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("TRUNCATE TABLE current_trades RESTART IDENTITY")
-                conn.commit()
-            logger.info("🗑️ Таблица current_trades очищена")
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка очистки таблицы: {e}")
-            return False
-    
-    def save_trades(self, trades: List[Dict[str, Any]]):
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
+
+    def ensure_schema(self):
+        """Создает backtest_runs и колонку run_id в current_trades, если их нет"""
+        if self._schema_ready:
+            return
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS backtest_runs (
+                    id BIGSERIAL PRIMARY KEY,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    symbol TEXT,
+                    timeframe TEXT,
+                    start_date TEXT,
+                    end_date TEXT,
+                    strategy_module TEXT,
+                    strategy_class TEXT,
+                    strategy_params JSONB,
+                    initial_cash DOUBLE PRECISION,
+                    commission DOUBLE PRECISION,
+                    trades_count INTEGER NOT NULL DEFAULT 0,
+                    results JSONB
+                )
+            """)
+            cursor.execute("ALTER TABLE current_trades ADD COLUMN IF NOT EXISTS run_id BIGINT")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS current_trades_run_id_idx
+                ON current_trades (run_id, entry_date)
+            """)
+            # Сделки последнего прогона - для дашбордов, которые читали current_trades целиком
+            cursor.execute("""
+                CREATE OR REPLACE VIEW latest_trades AS
+                SELECT * FROM current_trades
+                WHERE run_id = (SELECT MAX(id) FROM backtest_runs)
+            """)
+            conn.commit()
+
+        self._schema_ready = True
+
+    def save_run(self, run: Dict[str, Any], results: Dict[str, Any], trades: List[Dict[str, Any]]) -> int:
         """
-        Сохраняет результаты сделок в таблицу current_trades
-        
+        Сохраняет прогон и его сделки одной транзакцией
+
         Args:
+            run: Параметры прогона (symbol, timeframe, start_date, end_date,
+                strategy_module, strategy_class, strategy_params, initial_cash, commission)
+            results: Итоговые метрики
             trades: Список сделок с данными
+
+        Returns:
+            int: run_id
         """
-        if not trades:
-            logger.warning("⚠️ Нет сделок для сохранения")
-            return False
-        
-        try:
+        self.ensure_schema()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO backtest_runs (
+                    symbol, timeframe, start_date, end_date, strategy_module, strategy_class,
+                    strategy_params, initial_cash, commission, trades_count, results
+                ) VALUES (
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                )
+                RETURNING id
+            """, (
+                run.get('symbol'),
+                run.get('timeframe'),
+                run.get('start_date'),
+                run.get('end_date'),
+                run.get('strategy_module'),
+                run.get('strategy_class'),
+                psycopg2.extras.Json(run.get('strategy_params') or {}),
+                run.get('initial_cash'),
+                run.get('commission'),
+                len(trades),
+                psycopg2.extras.Json(results)
+            ))
+            run_id = cursor.fetchone()[0]
+
+            if trades:
+                # Все сделки прогона - одним многострочным INSERT (пачками по page_size)
+                psycopg2.extras.execute_values(
+                    cursor,
+                    f"INSERT INTO current_trades (run_id, {', '.join(TRADE_COLUMNS)}) VALUES %s",
+                    [
+                        (run_id, *(json.dumps(trade.get(column)) if column == 'trade_history' else trade.get(column)
+                                   for column in TRADE_COLUMNS))
+                        for trade in trades
+                    ],
+                    page_size=1000
+                )
+
+            conn.commit()
+
+        logger.info(f"✅ Прогон #{run_id}: сохранено {len(trades)} сделок в базу")
+        return run_id
+
+    def get_run(self, run_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает параметры и метрики прогона"""
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("SELECT * FROM backtest_runs WHERE id = %s", (run_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        run['created_at'] = run['created_at'].isoformat()
+        return run
+
+    def latest_run_id(self) -> Optional[int]:
+        """ID последнего прогона (None, если прогонов нет)"""
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MAX(id) FROM backtest_runs")
+            return cursor.fetchone()[0]
+
+    def get_trades(self, run_id: int) -> List[tuple]:
+        """
+        Сделки прогона по индексу (run_id, entry_date)
+
+        Returns:
+            List[tuple]: (entry_time, exit_time, entry_price, exit_price, side, pnl)
+        """
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT
+                    EXTRACT(EPOCH FROM entry_date) as entry_time,
+                    EXTRACT(EPOCH FROM exit_date) as exit_time,
+                    entry_price,
+                    exit_price,
+                    side,
+                    pnl
+                FROM current_trades
+                WHERE run_id = %s
+                ORDER BY entry_date ASC
+            """, (run_id,))
+            return cursor.fetchall()
+
+    def get_trades_version(self, run_id: int):
+        """
+        Версия сделок прогона для HTTP валидаторов
+
+        Сделки прогона после сохранения не меняются, поэтому версией служит
+        сам прогон (None, если он уже удален).
+
+        Returns:
+            tuple: (run_id, количество сделок) или None
+        """
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, trades_count FROM backtest_runs WHERE id = %s", (run_id,))
+            return cursor.fetchone()
+
+    def cleanup_runs(self, keep: int = BACKTEST_RUNS_KEEP,
+                     retention_days: float = BACKTEST_RUNS_RETENTION_DAYS) -> int:
+        """
+        Удаляет старые прогоны: сделки пачками по BACKTEST_RUNS_DELETE_BATCH, затем сами прогоны
+
+        Каждая пачка - отдельная короткая транзакция с блокировками строк,
+        а не ACCESS EXCLUSIVE на всю таблицу, поэтому чтение не ждет.
+
+        Args:
+            keep: Сколько последних прогонов не удалять
+            retention_days: Минимальный возраст удаляемого прогона
+
+        Returns:
+            int: Количество удаленных прогонов
+        """
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id FROM backtest_runs
+                WHERE created_at < now() - make_interval(secs => %s)
+                    AND id < COALESCE((SELECT MIN(id) FROM (
+                        SELECT id FROM backtest_runs ORDER BY id DESC LIMIT %s
+                    ) recent), 9223372036854775807)
+                ORDER BY id
+            """, (retention_days * 86400, keep))
+            run_ids = [row[0] for row in cursor.fetchall()]
+
+        # Сделки без run_id остались от версий до backtest_runs - удаляются вместе со старыми прогонами
+        deleted_trades = 0
+        while True:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                
-                for trade in trades:
-                    cursor.execute("""
-                        INSERT INTO current_trades (
-                            entry_date, entry_price, entry_size, side,
-                        exit_date, exit_price, pnl, pnl_percent,
-                            commission, bars_held, trade_history
-                        ) VALUES (
-                            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                        )
-                    """, (
-                        trade.get('entry_date'),
-                        trade.get('entry_price'),
-                        trade.get('entry_size'),
-                        trade.get('side'),
-                        trade.get('exit_date'),
-                        trade.get('exit_price'),
-                        trade.get('pnl'),
-                        trade.get('pnl_percent'),
-                        trade.get('commission'),
-                        trade.get('bars_held'),
-                        json.dumps(trade.get('trade_history'))
+                cursor.execute("""
+                    DELETE FROM current_trades
+                    WHERE ctid = ANY(ARRAY(
+                        SELECT ctid FROM current_trades
+                        WHERE run_id = ANY(%s) OR run_id IS NULL
+                        LIMIT %s
                     ))
-                
+                """, (run_ids, BACKTEST_RUNS_DELETE_BATCH))
+                deleted = cursor.rowcount
                 conn.commit()
-                logger.info(f"✅ Сохранено {len(trades)} сделок в базу")
-                return True
-                
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения сделок: {e}")
-            return False
+            deleted_trades += deleted
+            if deleted < BACKTEST_RUNS_DELETE_BATCH:
+                break
+
+        if not run_ids and not deleted_trades:
+            return 0
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM backtest_runs WHERE id = ANY(%s)", (run_ids,))
+            conn.commit()
+
+        logger.info(f"🗑️ Удалено прогонов: {len(run_ids)} (сделок: {deleted_trades})")
+        return len(run_ids)
 
 # Создаем глобальный экземпляр
 backtest_results_manager = BacktestResultsManager()
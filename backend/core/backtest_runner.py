@@ -1,22 +1,33 @@
 """
-Модуль для запуска бэктестов на VectorBT
+Модуль для запуска бэктестов (Numba симулятор, VectorBT - для сверки)
 """
+import os
+import math
 import logging
 import pandas as pd
 import numpy as np
-import vectorbt as vbt
-from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional
+from dotenv import load_dotenv
 from .binance_data_loader import binance_data_loader
 from .backtest_results import backtest_results_manager
+from .backtest_memo import backtest_memo
+from .resampler import resampler, can_resample
 from strategies import get_strategy_class
 
+load_dotenv()
+
 logger = logging.getLogger(__name__)
 
+# Движок расчета: native - записи сделок и метрики на Numba, vectorbt - через
+# vbt.Portfolio.from_orders, both - native с логированием расхождений с vectorbt
+BACKTEST_ENGINES = ('native', 'vectorbt', 'both')
+BACKTEST_ENGINE = os.getenv('BACKTEST_ENGINE', 'native')
+# Допустимое расхождение метрик native и vectorbt в режиме both
+BACKTEST_CROSS_CHECK_TOLERANCE = float(os.getenv('BACKTEST_CROSS_CHECK_TOLERANCE', 1e-6))
 
 
 class BacktestRunner:
-    """Класс для запуска бэктестов на VectorBT"""
+    """Класс для запуска бэктестов"""
 
     
 
@@ -31,14 +42,34 @@ class BacktestRunner:
         strategy_class: str,
         strategy_params: Dict[str, Any],
         initial_cash: float = 100.0,
-        commission: float = 0.05
+        commission: float = 0.05,
+        cancel_check: Optional[Callable[[], bool]] = None
     ) -> Dict[str, Any]:
         """
         Запускает бэктест с указанными параметрами
+        
+        cancel_check (очередь бэктестов) вызывается между этапами; если он
+        вернул True, бэктест прерывается без сохранения сделок. Результат
+        содержит run_id сохраненного прогона (/api/get_trades?run_id=).
+        Повторный запуск с теми же данными и параметрами берется из backtest_memo.
         """
         try:
-            # Очищаем таблицу результатов
-            backtest_results_manager.clear_results()
+            run = {
+                'symbol': symbol,
+                'timeframe': timeframe,
+                'start_date': start_date,
+                'end_date': end_date,
+                'strategy_module': strategy_module,
+                'strategy_class': strategy_class,
+                'strategy_params': strategy_params,
+                'initial_cash': initial_cash,
+                'commission': commission
+            }
+            fingerprint = backtest_memo.fingerprint(run) if backtest_memo.enabled else None
+            cached = backtest_memo.get(fingerprint)
+            if cached is not None:
+                logger.info(f"⚡ Бэктест взят из кэша (прогон #{cached.get('run_id')})")
+                return {**cached, 'cached': True}
             
             # Загружаем данные из базы
             logger.info(f"📊 Загрузка данных: {symbol} {timeframe} {start_date} - {end_date}")
@@ -69,25 +100,17 @@ class BacktestRunner:
             strategy = StrategyClass(**strategy_params)
             
             # Загружаем данные для SAR если указан другой таймфрейм
-            df_sar = None
             sar_timeframe = strategy_params.get('sar_timeframe', '')
+            df_sar = self.load_sar_data(df, symbol, timeframe, sar_timeframe, start_date, end_date)
             
-            if sar_timeframe and sar_timeframe != timeframe:
-                logger.info(f"📊 Загрузка SAR данных: {symbol} {sar_timeframe}")
-                df_sar = binance_data_loader.load_data_for_backtest(
-                    symbol=symbol,
-                    timeframe=sar_timeframe,
-                    start_date=start_date,
-                    end_date=end_date
-                )
-                
-                if df_sar is None or df_sar.empty:
-                    return {
-                        'success': False,
-                        'error': f'Нет данных для SAR таймфрейма {sar_timeframe}'
-                    }
-                
-                logger.info(f"✅ Загружено {len(df_sar)} SAR свечей")
+            if sar_timeframe and sar_timeframe != timeframe and df_sar is None:
+                return {
+                    'success': False,
+                    'error': f'Нет данных для SAR таймфрейма {sar_timeframe}'
+                }
+            
+            if cancel_check and cancel_check():
+                return self._cancelled()
             
             # Генерируем сигналы
             signals = strategy.generate_signals(df, df_sar)
@@ -108,45 +131,49 @@ class BacktestRunner:
 
             
             # Импортируем симулятор
-            from .trade_simulator import simulate_trades_nb
+            from .trade_simulator import simulate_trade_records
             
             # Конвертируем сигналы в numpy array
             direction_signals = signals.values.astype(np.float64)
+            quote_size = strategy_params.get('quote', initial_cash)
             
-            # Запускаем симуляцию
-            order_size, order_price = simulate_trades_nb(
-                direction_signals,
-                df['open'].values,
-                df['high'].values,
-                df['low'].values,
-                df['close'].values,
-                tp_level,
-                trail_offset,
-                exit_params['stop_loss'],
-                strategy_params.get('quote', initial_cash)
-            )
-            
-            # Создаём Portfolio через from_orders
-            pf = vbt.Portfolio.from_orders(
-                close=df['close'],
-                size=pd.Series(order_size, index=df.index),
-                price=pd.Series(order_price, index=df.index),
-                init_cash=initial_cash,
-                fees=commission,
-                freq=timeframe,
-            )
+            engine = BACKTEST_ENGINE if BACKTEST_ENGINE in BACKTEST_ENGINES else 'native'
+            if engine == 'vectorbt':
+                pf = self._run_vectorbt(df, direction_signals, exit_params, quote_size,
+                                        initial_cash, commission, timeframe)
+                trades_list = self._collect_trades(pf, df)
+                results = self._format_results(pf, initial_cash, len(trades_list))
+            else:
+                # Запускаем симуляцию
+                records = simulate_trade_records(
+                    direction_signals,
+                    df['open'].values,
+                    df['high'].values,
+                    df['low'].values,
+                    df['close'].values,
+                    tp_level,
+                    trail_offset,
+                    exit_params['stop_loss'],
+                    quote_size,
+                    commission,
+                    initial_cash
+                )
+                trades_list = self._records_to_trades(records, df)
+                results = self._native_results(records, df, initial_cash, timeframe)
+                
+                if engine == 'both':
+                    pf = self._run_vectorbt(df, direction_signals, exit_params, quote_size,
+                                            initial_cash, commission, timeframe)
+                    self._cross_check(results, self._format_results(pf, initial_cash, len(trades_list)))
             
-
-            # Собираем сделки
-            trades_list = self._collect_trades(pf, df)
+            if cancel_check and cancel_check():
+                return self._cancelled()
             
-            # Сохраняем сделки в базу
-            if trades_list:
-                backtest_results_manager.save_trades(trades_list)
-                logger.info(f"✅ Сохранено {len(trades_list)} сделок")
+            # Сохраняем прогон и сделки в базу
+            results['run_id'] = backtest_results_manager.save_run(run, results['results'], trades_list)
+            backtest_memo.put(fingerprint, run, results)
             
-            # Формируем результаты
-            return self._format_results(pf, initial_cash, len(trades_list))
+            return results
             
         except Exception as e:
             logger.error(f"❌ Ошибка запуска бэктеста: {e}")
@@ -157,6 +184,138 @@ class BacktestRunner:
                 'error': str(e)
             }
     
+    def _cancelled(self) -> Dict[str, Any]:
+        logger.info("⏹️ Бэктест отменен")
+        return {
+            'success': False,
+            'cancelled': True,
+            'error': 'Бэктест отменен'
+        }
+    
+    def load_sar_data(self, df: pd.DataFrame, symbol: str, timeframe: str, sar_timeframe: str,
+                      start_date: str, end_date: str):
+        """
+        Возвращает свечи SAR таймфрейма (None, если он совпадает с основным или данных нет)
+        """
+        if not sar_timeframe or sar_timeframe == timeframe:
+            return None
+        
+        if can_resample(timeframe, sar_timeframe):
+            # Старший таймфрейм собираем из уже загруженных свечей без второго запроса к БД
+            logger.info(f"📊 Агрегация SAR данных: {symbol} {timeframe} -> {sar_timeframe}")
+            df_sar = resampler.resample_df(df, timeframe, sar_timeframe, symbol, start_date, end_date)
+        else:
+            logger.info(f"📊 Загрузка SAR данных: {symbol} {sar_timeframe}")
+            df_sar = binance_data_loader.load_data_for_backtest(
+                symbol=symbol,
+                timeframe=sar_timeframe,
+                start_date=start_date,
+                end_date=end_date
+            )
+        
+        if df_sar is None or df_sar.empty:
+            return None
+        
+        logger.info(f"✅ Загружено {len(df_sar)} SAR свечей")
+        return df_sar
+    
+    def _run_vectorbt(self, df: pd.DataFrame, direction_signals: np.ndarray, exit_params: Dict[str, Any],
+                      quote_size: float, initial_cash: float, commission: float, timeframe: str):
+        """Симулирует ордера и строит vbt.Portfolio (движок vectorbt и сверка)"""
+        import vectorbt as vbt
+        from .trade_simulator import simulate_trades
+        
+        order_size, order_price = simulate_trades(
+            direction_signals,
+            df['open'].values,
+            df['high'].values,
+            df['low'].values,
+            df['close'].values,
+            exit_params['take_profit'],
+            exit_params.get('trail_offset', 0),
+            exit_params['stop_loss'],
+            quote_size,
+            commission,
+            initial_cash
+        )
+        
+        # Создаём Portfolio через from_orders
+        return vbt.Portfolio.from_orders(
+            close=df['close'],
+            size=pd.Series(order_size, index=df.index),
+            price=pd.Series(order_price, index=df.index),
+            init_cash=initial_cash,
+            fees=commission,
+            freq=timeframe,
+        )
+    
+    def _records_to_trades(self, records: np.ndarray, df: pd.DataFrame) -> list:
+        """Собирает сделки из записей Numba симулятора (формат _collect_trades)"""
+        from .trade_simulator import EXIT_REASONS
+        
+        trades_list = []
+        for record in records.tolist():
+            (entry_idx, exit_idx, side, size, entry_price, exit_price,
+             entry_fees, exit_fees, pnl, exit_reason) = record
+            entry_value = size * entry_price
+            trades_list.append({
+                'entry_date': df.index[entry_idx],
+                'entry_price': entry_price,
+                'entry_size': size,
+                'side': 'LONG' if side > 0 else 'SHORT',
+                'exit_date': df.index[exit_idx],
+                'exit_price': exit_price,
+                'pnl': pnl,
+                'pnl_percent': pnl / entry_value * 100 if entry_value else 0.0,
+                'commission': entry_fees + exit_fees,
+                'bars_held': exit_idx - entry_idx,
+                'mae': None,
+                'mfe': None,
+                'trade_history': {},
+                'exit_reason': EXIT_REASONS[exit_reason],
+            })
+        
+        logger.info(f"📊 Собрано сделок: {len(trades_list)}")
+        return trades_list
+    
+    def _native_results(self, records: np.ndarray, df: pd.DataFrame, initial_cash: float,
+                        timeframe: str) -> Dict:
+        """Форматирует результаты по метрикам Numba (формат _format_results)"""
+        from .metrics_nb import compute_metrics
+        
+        metrics = compute_metrics(records, df['close'].values, initial_cash, timeframe)
+        return {
+            'success': True,
+            'results': {
+                'initial_value': float(initial_cash),
+                'final_value': metrics['final_value'],
+                'profit': metrics['profit'],
+                'profit_percent': metrics['total_return'],
+                'sharpe_ratio': metrics['sharpe_ratio'],
+                'max_drawdown': metrics['max_drawdown'],
+                'total_return': metrics['total_return'],
+                'trades_count': metrics['trades_count'],
+                'win_rate': metrics['win_rate'],
+                'trades_analysis': {}
+            }
+        }
+    
+    def _cross_check(self, native: Dict, reference: Dict):
+        """Логирует расхождения метрик native движка с vectorbt"""
+        mismatches = []
+        for name, value in native['results'].items():
+            expected = reference['results'].get(name)
+            if not isinstance(value, (int, float)) or not isinstance(expected, (int, float)):
+                continue
+            if not math.isclose(value, expected, rel_tol=BACKTEST_CROSS_CHECK_TOLERANCE,
+                                abs_tol=BACKTEST_CROSS_CHECK_TOLERANCE):
+                mismatches.append(f"{name}: native={value} vectorbt={expected}")
+        
+        if mismatches:
+            logger.warning(f"⚠️ Расхождение native и vectorbt: {'; '.join(mismatches)}")
+        else:
+            logger.info("✅ Метрики native совпадают с vectorbt")
+    
     def _collect_trades(self, pf, df: pd.DataFrame) -> list:
         """Собирает сделки из VectorBT Portfolio"""
         trades_list = []
@@ -211,8 +370,6 @@ class BacktestRunner:
     
     def _format_results(self, pf, initial_cash: float, trades_count: int) -> Dict:
         """Форматирует результаты бэктеста"""
-        import math
-        
         def safe_float(value, default=0.0):
             try:
                 if value is None:
@@ -0,0 +1,210 @@
+"""
+Модуль пакетной загрузки исторических данных по нескольким символам и таймфреймам
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple, Dict, Optional, Callable
+from dotenv import load_dotenv
+from .binance_data_loader import binance_data_loader
+from .binance_symbols import binance_symbols_manager
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Сколько рядов (symbol, timeframe) загружается параллельно
+BATCH_WORKERS = int(os.getenv('BATCH_INGESTION_WORKERS', 4))
+# Параллельных загрузок архивов внутри одного ряда
+BATCH_SERIES_CONCURRENCY = int(os.getenv('BATCH_SERIES_CONCURRENCY', 4))
+
+# План загрузки: [(symbol, timeframe, [(тип периода, дата), ...]), ...]
+SeriesPlan = List[Tuple[str, str, List[Tuple[str, str]]]]
+
+
+class BatchIngestor:
+    """
+    Класс для пакетной загрузки
+
+    Ряды распределяются по пулу воркеров, а все HTTP запросы проходят через
+    общий ограничитель частоты загрузчика (binance_rate_limiter).
+    """
+
+    def resolve_symbols(self, symbols: Optional[List[str]] = None, pattern: Optional[str] = None,
+                        filters: Optional[Dict[str, str]] = None) -> List[str]:
+        """
+        Возвращает список символов: явно заданный или из binance_symbols по фильтру
+
+        Args:
+            symbols: Явный список символов (пустые элементы отбрасываются; если не осталось
+                ни одного - символы выбираются по pattern и filters)
+            pattern: Шаблон LIKE для binance_symbols (например '%USDT')
+            filters: Фильтр по полям msg_data (например {'contractType': 'PERPETUAL'})
+        """
+        symbols = [s.strip().upper() for s in symbols or [] if s and s.strip()]
+        if symbols:
+            return symbols
+        return binance_symbols_manager.get_symbols_list(pattern=pattern, filters=filters)
+
+    def plan(self, symbols: List[str], timeframes: List[str], period: str,
+             start_date: str, end_date: str, only_missing: bool = True) -> Tuple[SeriesPlan, int]:
+        """
+        Составляет план загрузки для всех рядов
+
+        Returns:
+            Tuple[SeriesPlan, int]: (план, количество пропущенных полных периодов)
+        """
+        series_plan = []
+        skipped = 0
+        for symbol in symbols:
+            for timeframe in timeframes:
+                periods, series_skipped = binance_data_loader.plan_download(
+                    symbol, timeframe, period, start_date, end_date, only_missing
+                )
+                skipped += series_skipped
+                if periods:
+                    series_plan.append((symbol, timeframe, periods))
+        return series_plan, skipped
+
+    def run(self, series_plan: SeriesPlan, period: str, start_date: str, end_date: str,
+            workers: Optional[int] = None, concurrency: Optional[int] = None,
+            offline: Optional[bool] = None,
+            progress_callback: Optional[Callable[[str, str, dict], bool]] = None) -> Tuple[bool, str, dict]:
+        """
+        Загружает все ряды плана
+
+        Args:
+            series_plan: План из plan()
+            period: Режим периода (для логов и статистики загрузчика)
+            start_date: Дата начала
+            end_date: Дата конца
+            workers: Количество рядов, загружаемых параллельно
+            concurrency: Параллельных загрузок архивов внутри ряда
+            offline: Работать только из кэша архивов
+            progress_callback: Вызывается после каждого периода (symbol, timeframe, статистика
+                периода); если возвращает False, вся пакетная загрузка отменяется
+
+        Returns:
+            Tuple[bool, str, dict]: (успех, сообщение, агрегированная статистика)
+        """
+        workers = max(1, int(workers or BATCH_WORKERS))
+        concurrency = max(1, int(concurrency or BATCH_SERIES_CONCURRENCY))
+        cancel = threading.Event()
+        started = time.monotonic()
+
+        total_periods = sum(len(periods) for _, _, periods in series_plan)
+        logger.info(f"📦 Пакетная загрузка: {len(series_plan)} рядов, {total_periods} архивов, воркеров: {workers}")
+
+        def load_series(symbol: str, timeframe: str, periods: List[Tuple[str, str]]):
+            if cancel.is_set():
+                return symbol, timeframe, False, 'отменено', {'cancelled': True, 'periods': []}
+
+            def on_period(period_stats: dict) -> bool:
+                if progress_callback and progress_callback(symbol, timeframe, period_stats) is False:
+                    cancel.set()
+                return not cancel.is_set()
+
+            success, message, stats = binance_data_loader.download_historical_data(
+                symbol=symbol,
+                timeframe=timeframe,
+                period=period,
+                start_date=start_date,
+                end_date=end_date,
+                concurrency=concurrency,
+                offline=offline,
+                periods=periods,
+                progress_callback=on_period
+            )
+            return symbol, timeframe, success, message, stats
+
+        series_stats = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch-series') as pool:
+            futures = [pool.submit(load_series, symbol, timeframe, periods)
+                       for symbol, timeframe, periods in series_plan]
+            for future in as_completed(futures):
+                symbol, timeframe, success, message, stats = future.result()
+                period_list = stats.get('periods', [])
+                series_stats.append({
+                    'symbol': symbol,
+                    'timeframe': timeframe,
+                    'success': success,
+                    'message': message,
+                    'successful': stats.get('successful', 0),
+                    'failed': stats.get('failed', 0),
+                    'inserted': stats.get('inserted', 0),
+                    'duplicates': stats.get('duplicates', 0),
+                    'rows': sum(p.get('rows', 0) for p in period_list),
+                    'bytes': sum(p.get('bytes', 0) for p in period_list),
+                })
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        archives = sum(s['successful'] for s in series_stats)
+        rows = sum(s['rows'] for s in series_stats)
+        series_stats.sort(key=lambda s: (s['symbol'], s['timeframe']))
+
+        stats = {
+            'series': len(series_plan),
+            'total_periods': total_periods,
+            'successful': archives,
+            'failed': sum(s['failed'] for s in series_stats),
+            'inserted': sum(s['inserted'] for s in series_stats),
+            'duplicates': sum(s['duplicates'] for s in series_stats),
+            'rows': rows,
+            'bytes': sum(s['bytes'] for s in series_stats),
+            'elapsed': round(elapsed, 3),
+            'archives_per_sec': round(archives / elapsed, 2),
+            'rows_per_sec': round(rows / elapsed, 1),
+            'workers': workers,
+            'cancelled': cancel.is_set(),
+            'series_stats': series_stats
+        }
+
+        status = 'отменена' if cancel.is_set() else 'завершена'
+        message = (f"Пакетная загрузка {status}: {archives}/{total_periods} архивов по {len(series_plan)} рядам, "
+                   f"добавлено {stats['inserted']} свечей, {stats['archives_per_sec']} арх/с, "
+                   f"{stats['rows_per_sec']} строк/с")
+        logger.info(f"✅ {message}")
+
+        return True, message, stats
+
+
+# Создаем глобальный экземпляр
+batch_ingestor = BatchIngestor()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='Пакетная загрузка исторических данных Binance')
+    parser.add_argument('--symbols', default='', help='Список символов через запятую')
+    parser.add_argument('--pattern', default=None, help="Шаблон LIKE для binance_symbols, например '%%USDT'")
+    parser.add_argument('--contract-type', default=None, help='Фильтр contractType, например PERPETUAL')
+    parser.add_argument('--timeframes', required=True, help='Список таймфреймов через запятую')
+    parser.add_argument('--period', default='auto', choices=['daily', 'monthly', 'auto'])
+    parser.add_argument('--start', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--all-periods', action='store_true', help='Загружать и уже полные периоды')
+    parser.add_argument('--offline', action='store_true', help='Только из локального кэша архивов')
+    args = parser.parse_args()
+
+    filters = {'contractType': args.contract_type} if args.contract_type else None
+    symbols = batch_ingestor.resolve_symbols([s for s in args.symbols.split(',') if s.strip()] or None,
+                                             args.pattern, filters)
+    timeframes = [tf.strip() for tf in args.timeframes.split(',') if tf.strip()]
+
+    series_plan, skipped = batch_ingestor.plan(symbols, timeframes, args.period, args.start, args.end,
+                                               only_missing=not args.all_periods)
+    success, message, stats = batch_ingestor.run(series_plan, args.period, args.start, args.end,
+                                                 workers=args.workers, concurrency=args.concurrency,
+                                                 offline=args.offline or None)
+    stats['skipped_complete'] = skipped
+    print(message)
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+    raise SystemExit(0 if success else 1)
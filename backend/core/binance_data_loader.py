@@ -4,83 +4,196 @@
 import requests
 import zipfile
 import io
-import csv
-import psycopg2
+import struct
+import hashlib
+import numpy as np
 import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Callable
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from .db import db
+from .archive_cache import archive_cache, CACHE_ENABLED
+from .sync_planner import sync_planner
+from .rate_limiter import binance_rate_limiter
+from .candle_cache import candle_cache
+from .array_store import array_store, OHLCVArrays
+from .resampler import resampler, source_timeframes
+from .coverage_catalog import coverage_catalog
+from .backtest_memo import backtest_memo
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Настройки подключения к PostgreSQL
-DB_CONFIG = {
-    'host': os.getenv('POSTGRES_HOST', 'localhost'),
-    'port': int(os.getenv('POSTGRES_PORT', 5432)),
-    'database': os.getenv('POSTGRES_DATABASE', 'backtrader'),
-    'user': os.getenv('POSTGRES_USER'),
-    'password': os.getenv('POSTGRES_PASSWORD')
-}
+# Настройки конвейера загрузки архивов
+DOWNLOAD_CONCURRENCY = int(os.getenv('BINANCE_DOWNLOAD_CONCURRENCY', 8))
+PARSE_WORKERS = int(os.getenv('BINANCE_PARSE_WORKERS', 2))
+MAX_RETRIES = int(os.getenv('BINANCE_MAX_RETRIES', 3))
+RETRY_BACKOFF = float(os.getenv('BINANCE_RETRY_BACKOFF', 1.0))
+
+# Работа только из локального кэша архивов, без обращения к сети
+OFFLINE = os.getenv('BINANCE_OFFLINE', '0') == '1'
+
+# Источник свечей для бэктеста: 'parquet' (кэш Parquet перед БД), 'mmap' (memory-mapped массивы), 'db'
+DATA_BACKEND = os.getenv('CANDLE_DATA_BACKEND', 'parquet')
+
+# Собирать отсутствующий в candles таймфрейм из младшего (например, 4h из 1m)
+RESAMPLE_FALLBACK = os.getenv('CANDLE_RESAMPLE_FALLBACK', '1') == '1'
+
+# Через сколько дней после конца месяца месячный архив уже опубликован
+MONTHLY_PUBLISH_LAG_DAYS = int(os.getenv('BINANCE_MONTHLY_PUBLISH_LAG_DAYS', 3))
+
+# HTTP статусы, при которых имеет смысл повторить запрос
+RETRYABLE_STATUSES = {418, 429, 500, 502, 503, 504}
+
+# Типизированные колонки свечей из Binance CSV:
+# [0] open_time, [1] open, [2] high, [3] low, [4] close, [5] volume, ...
+KLINE_DTYPE = np.dtype([
+    ('open_time', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+])
+
+# Кортеж в бинарном формате COPY: число полей (int16), затем для каждого поля
+# длина (int32) и значение, все в network byte order
+COPY_ROW_DTYPE = np.dtype([('fields', '>i2')] + [
+    item for name in KLINE_DTYPE.names
+    for item in ((f'{name}_len', '>i4'), (name, '>i8' if name == 'open_time' else '>f8'))
+])
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('>h', -1)
 
 class BinanceDataLoader:
     """Класс для загрузки исторических данных с Binance"""
     
     def __init__(self):
         self.base_url = "https://data.binance.vision/data/futures/um"
+        self.archive_cache = archive_cache
+        self.rate_limiter = binance_rate_limiter
+        self.candle_cache = candle_cache
 
-        # SQLAlchemy engine
-        from sqlalchemy import create_engine
-        db_url = f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
-        self.engine = create_engine(db_url)
+        # Хуки, вызываемые после записи новых свечей: hook(symbol, timeframe, start_ms, end_ms)
+        self.ingest_hooks = []
+        self.array_store = array_store
+        if self.candle_cache.enabled:
+            self.add_ingest_hook(self.candle_cache.invalidate)
+        self.add_ingest_hook(self.array_store.invalidate)
+        self.add_ingest_hook(coverage_catalog.on_ingest)
+        if backtest_memo.enabled:
+            self.add_ingest_hook(backtest_memo.invalidate)
     
     def get_connection(self):
-        """Создает подключение к PostgreSQL"""
-        try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            return conn
-        except Exception as e:
-            logger.error(f"❌ Ошибка подключения к PostgreSQL: {e}")
-            raise
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
         
 
-    def load_data_for_backtest(self, symbol: str, timeframe: str, start_date: str, end_date: str):
-        try:
-            import pandas as pd
-            
-            query = """
+    def add_ingest_hook(self, hook: Callable[[str, str, int, int, int], None]):
+        """
+        Регистрирует хук, вызываемый после записи новых свечей в candles
+        
+        Args:
+            hook: Функция (symbol, timeframe, время первой свечи мс, время последней свечи мс,
+                количество новых свечей)
+        """
+        self.ingest_hooks.append(hook)
+    
+    def _run_ingest_hooks(self, symbol: str, timeframe: str, start_ms: int, end_ms: int, inserted: int):
+        for hook in self.ingest_hooks:
+            try:
+                hook(symbol, timeframe, start_ms, end_ms, inserted)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка хука загрузки {getattr(hook, '__qualname__', hook)}: {e}")
+    
+    def query_candles(self, symbol: str, timeframe: str, start: datetime, end: datetime):
+        """
+        Читает свечи из таблицы candles в интервале [start, end)
+        
+        Returns:
+            pd.DataFrame: DataFrame с индексом datetime (может быть пустым)
+        """
+        import pandas as pd
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
                 SELECT 
-                    time as datetime,
+                    (EXTRACT(EPOCH FROM time) * 1000)::bigint,
                     open, high, low, close, volume
                 FROM candles
-                WHERE symbol = %(symbol)s 
-                AND timeframe = %(timeframe)s
-                AND time >= %(start_date)s 
-                AND time <= %(end_date)s
+                WHERE symbol = %s 
+                AND timeframe = %s
+                AND time >= %s 
+                AND time < %s
                 ORDER BY time
-            """
-            
-            df = pd.read_sql_query(
-                query, 
-                self.engine,  # <-- SQLAlchemy engine вместо conn
-                params={
-                    'symbol': symbol,
-                    'timeframe': timeframe,
-                    'start_date': start_date,
-                    'end_date': end_date + ' 23:59:59'
-                }
+            """, (symbol, timeframe, start.strftime('%Y-%m-%d %H:%M:%S+00'), end.strftime('%Y-%m-%d %H:%M:%S+00')))
+            rows = cursor.fetchall()
+        
+        values = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        
+        # Преобразуем datetime в индекс
+        return pd.DataFrame(
+            values[:, 1:],
+            columns=['open', 'high', 'low', 'close', 'volume'],
+            index=pd.DatetimeIndex(pd.to_datetime(values[:, 0].astype(np.int64), unit='ms', utc=True),
+                                   name='datetime')
+        )
+    
+    def load_arrays(self, symbol: str, timeframe: str, start_date: str, end_date: str) -> Optional[OHLCVArrays]:
+        """
+        Возвращает свечи периода как memory-mapped массивы (без копирования)
+        
+        Ряд строится из candles при первом обращении и после загрузки новых свечей.
+        
+        Returns:
+            Optional[OHLCVArrays]: Массивы time/open/high/low/close/volume или None
+        """
+        return self.array_store.load(symbol, timeframe, start_date, end_date, self.get_connection)
+    
+    def _load_stored(self, symbol: str, timeframe: str, start_date: str, end_date: str):
+        """Читает свечи таймфрейма в том виде, как они хранятся в candles"""
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+        
+        if DATA_BACKEND == 'mmap':
+            import pandas as pd
+            
+            arrays = self.load_arrays(symbol, timeframe, start_date, end_date)
+            if arrays is None:
+                return None
+            return pd.DataFrame(
+                {name: getattr(arrays, name) for name in ('open', 'high', 'low', 'close', 'volume')},
+                index=pd.DatetimeIndex(pd.to_datetime(arrays.time, unit='ms', utc=True), name='datetime')
             )
+        if DATA_BACKEND == 'parquet' and self.candle_cache.enabled:
+            return self.candle_cache.load(symbol, timeframe, start, end, fetch=self.query_candles)
+        return self.query_candles(symbol, timeframe, start, end)
+    
+    def load_data_for_backtest(self, symbol: str, timeframe: str, start_date: str, end_date: str):
+        try:
+            df = self._load_stored(symbol, timeframe, start_date, end_date)
+            
+            # Таймфрейма нет в candles - собираем его из младшего
+            if (df is None or df.empty) and RESAMPLE_FALLBACK:
+                for source_tf in source_timeframes(timeframe):
+                    source_df = self._load_stored(symbol, source_tf, start_date, end_date)
+                    if source_df is not None and not source_df.empty:
+                        logger.info(f"🧮 {symbol} {timeframe} нет в candles, собираем из {source_tf}")
+                        df = resampler.resample_df(source_df, source_tf, timeframe, symbol, start_date, end_date)
+                        break
                 
-            if df.empty:
+            if df is None or df.empty:
                 logger.warning(f"⚠️ Нет данных для {symbol} {timeframe} за период {start_date} - {end_date}")
                 return None
             
-            # Преобразуем datetime в индекс
-            df['datetime'] = pd.to_datetime(df['datetime'])
-            df.set_index('datetime', inplace=True)
-            
             logger.info(f"✅ Загружено {len(df)} свечей из таблицы candles")
             return df
                 
@@ -90,103 +203,269 @@ class BinanceDataLoader:
 
 
 
-    def download_and_parse_zip(self, url: str) -> Tuple[bool, List[List]]:
+    def create_session(self, concurrency: int) -> requests.Session:
         """
-        Скачивает ZIP архив и парсит CSV данные
+        Создает HTTP сессию с пулом соединений под нужное число загрузчиков
+        
+        Args:
+            concurrency: Количество параллельных загрузок
+            
+        Returns:
+            requests.Session: Сессия, общая для всех потоков загрузки
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    def fetch_archive(self, url: str, session: Optional[requests.Session] = None,
+                      max_retries: int = MAX_RETRIES) -> Tuple[str, Optional[bytes], int]:
+        """
+        Скачивает ZIP архив с повторами и экспоненциальной задержкой
         
         Args:
             url: URL для скачивания
+            session: HTTP сессия (если None - одиночный запрос)
+            max_retries: Количество повторов при сетевых ошибках и 5xx/429
             
         Returns:
-            Tuple[bool, List[List]]: (успех, список строк данных)
+            Tuple[str, Optional[bytes], int]: (статус 'ok'/'not_found'/'failed', содержимое, число попыток)
         """
-        try:
-            logger.info(f"📥 Скачивание: {url}")
-            response = requests.get(url, timeout=60)
+        http = session or requests
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            try:
+                self.rate_limiter.acquire()
+                logger.info(f"📥 Скачивание: {url}")
+                response = http.get(url, timeout=60)
+                
+                if response.status_code == 404:
+                    logger.warning(f"⚠️ Данные не найдены: {url}")
+                    return 'not_found', None, attempt
+                
+                if response.status_code == 200:
+                    return 'ok', response.content, attempt
+                
+                error = f"HTTP {response.status_code}"
+                retryable = response.status_code in RETRYABLE_STATUSES
+                
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+                retryable = True
+            
+            if not retryable or attempt > max_retries:
+                logger.error(f"❌ Ошибка скачивания {url}: {error}")
+                return 'failed', None, attempt
+            
+            delay = RETRY_BACKOFF * (2 ** (attempt - 1))
+            logger.warning(f"🔁 Повтор {attempt}/{max_retries} через {delay:.1f}с ({error}): {url}")
+            time.sleep(delay)
+    
+    def fetch_checksum(self, url: str, session: Optional[requests.Session] = None,
+                       max_retries: int = MAX_RETRIES) -> Optional[str]:
+        """
+        Скачивает опубликованный sha256 архива (файл <архив>.CHECKSUM)
+        
+        Args:
+            url: URL архива
+            session: HTTP сессия
+            max_retries: Количество повторов
             
-            if response.status_code == 404:
-                logger.warning(f"⚠️ Данные не найдены: {url}")
-                return False, []
+        Returns:
+            Optional[str]: sha256 в hex или None, если CHECKSUM недоступен
+        """
+        status, content, _ = self.fetch_archive(f"{url}.CHECKSUM", session, max_retries)
+        if status != 'ok' or not content:
+            return None
+        
+        # Формат: "<sha256>  <имя файла>"
+        return content.decode('ascii', errors='ignore').split()[0].lower()
+    
+    def get_archive(self, url: str, session: Optional[requests.Session] = None,
+                    max_retries: int = MAX_RETRIES, use_cache: bool = True,
+                    offline: bool = False) -> Tuple[str, Optional[bytes], int, str]:
+        """
+        Возвращает архив из локального кэша или скачивает и проверяет его
+        
+        Скачанный архив сверяется с опубликованным .CHECKSUM и только после
+        этого попадает в кэш. При несовпадении архив скачивается повторно.
+        
+        Args:
+            url: URL архива
+            session: HTTP сессия
+            max_retries: Количество повторов
+            use_cache: Использовать локальный кэш архивов
+            offline: Не обращаться к сети, только кэш
+            
+        Returns:
+            Tuple[str, Optional[bytes], int, str]: (статус, содержимое, число попыток, источник 'cache'/'network')
+        """
+        key = url[len(self.base_url):].lstrip('/')
+        
+        if use_cache:
+            content = self.archive_cache.get(key)
+            if content is not None:
+                return 'ok', content, 0, 'cache'
+        
+        if offline:
+            logger.warning(f"⚠️ Архива нет в кэше (offline): {key}")
+            return 'not_cached', None, 0, 'cache'
+        
+        attempts = 0
+        for _ in range(2):
+            status, content, tries = self.fetch_archive(url, session, max_retries)
+            attempts += tries
+            if status != 'ok':
+                return status, None, attempts, 'network'
+            
+            digest = hashlib.sha256(content).hexdigest()
+            expected = self.fetch_checksum(url, session, max_retries)
+            
+            if expected is None:
+                logger.warning(f"⚠️ CHECKSUM недоступен, архив не проверен: {key}")
+            elif expected != digest:
+                logger.error(f"❌ Несовпадение CHECKSUM: {key}")
+                continue
+            
+            if use_cache:
+                try:
+                    self.archive_cache.put(key, content, digest)
+                except OSError as e:
+                    logger.warning(f"⚠️ Не удалось сохранить архив в кэш: {e}")
+            
+            return 'ok', content, attempts, 'network'
+        
+        return 'checksum_mismatch', None, attempts, 'network'
+    
+    def parse_zip(self, content: bytes) -> np.ndarray:
+        """
+        Распаковывает ZIP архив и разбирает CSV сразу в типизированные колонки
+        
+        CSV читается потоком из архива без промежуточной строки со всем
+        содержимым, необязательный заголовок определяется по первому байту.
+        
+        Args:
+            content: Содержимое ZIP архива
             
-            if response.status_code != 200:
-                logger.error(f"❌ Ошибка скачивания: HTTP {response.status_code}")
-                return False, []
+        Returns:
+            np.ndarray: Массив с dtype KLINE_DTYPE (open_time int64, OHLCV float64)
+        """
+        zip_file = zipfile.ZipFile(io.BytesIO(content))
+        csv_filename = zip_file.namelist()[0]
+        
+        with zip_file.open(csv_filename) as csv_file:
+            # Часть архивов начинается с заголовка open_time,open,...
+            first = csv_file.peek(1)[:1]
+            has_header = bool(first) and not first.isdigit()
             
-            # Распаковываем ZIP
-            zip_file = zipfile.ZipFile(io.BytesIO(response.content))
-            csv_filename = zip_file.namelist()[0]
+            klines = np.loadtxt(
+                io.TextIOWrapper(csv_file, encoding='ascii'),
+                delimiter=',',
+                usecols=range(len(KLINE_DTYPE.names)),
+                dtype=KLINE_DTYPE,
+                skiprows=1 if has_header else 0,
+                ndmin=1
+            )
+        
+        logger.info(f"✅ Получено {len(klines)} строк")
+        return klines
+    
+    def download_and_parse_zip(self, url: str) -> Tuple[bool, np.ndarray]:
+        """
+        Скачивает ZIP архив и парсит CSV данные
+        
+        Args:
+            url: URL для скачивания
             
-            # Читаем CSV
-            with zip_file.open(csv_filename) as csv_file:
-                csv_content = csv_file.read().decode('utf-8')
-                csv_reader = csv.reader(io.StringIO(csv_content))
-                data_rows = list(csv_reader)
+        Returns:
+            Tuple[bool, np.ndarray]: (успех, массив свечей KLINE_DTYPE)
+        """
+        try:
+            status, content, _ = self.fetch_archive(url)
+            if status != 'ok':
+                return False, np.empty(0, dtype=KLINE_DTYPE)
             
-            logger.info(f"✅ Получено {len(data_rows)} строк")
-            return True, data_rows
+            return True, self.parse_zip(content)
             
         except Exception as e:
             logger.error(f"❌ Ошибка обработки ZIP: {e}")
-            return False, []
+            return False, np.empty(0, dtype=KLINE_DTYPE)
+    
+    def to_copy_binary(self, klines: np.ndarray) -> bytes:
+        """
+        Кодирует массив свечей в бинарный формат PostgreSQL COPY
+        
+        Args:
+            klines: Массив с dtype KLINE_DTYPE
+            
+        Returns:
+            bytes: Поток для COPY ... WITH (FORMAT binary)
+        """
+        rows = np.empty(len(klines), dtype=COPY_ROW_DTYPE)
+        rows['fields'] = len(KLINE_DTYPE.names)
+        for name in KLINE_DTYPE.names:
+            rows[f'{name}_len'] = 8
+            rows[name] = klines[name]
+        return COPY_BINARY_HEADER + rows.tobytes() + COPY_BINARY_TRAILER
     
-    def save_to_database(self, symbol: str, timeframe: str, data_rows: List[List]) -> Tuple[bool, int, int]:
+    def save_to_database(self, symbol: str, timeframe: str, klines: np.ndarray) -> Tuple[bool, int, int]:
         """
         Сохраняет данные в таблицу candles
         
+        Свечи загружаются бинарным COPY FROM STDIN во временную
+        staging-таблицу, затем переносятся в candles одним
+        INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+        
         Args:
             symbol: Символ (например BTCUSDT)
             timeframe: Таймфрейм (например 1d)
-            data_rows: Список строк данных из CSV
+            klines: Массив свечей с dtype KLINE_DTYPE
             
         Returns:
             Tuple[bool, int, int]: (успех, количество новых записей, количество пропущенных дубликатов)
         """
         try:
+            total = len(klines)
+            if total == 0:
+                return True, 0, 0
+            
+            buffer = io.BytesIO(self.to_copy_binary(klines))
+            
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                inserted = 0
-                duplicates = 0
+                cursor.execute("""
+                    CREATE TEMP TABLE candles_staging (
+                        open_time BIGINT,
+                        open DOUBLE PRECISION,
+                        high DOUBLE PRECISION,
+                        low DOUBLE PRECISION,
+                        close DOUBLE PRECISION,
+                        volume DOUBLE PRECISION
+                    ) ON COMMIT DROP
+                """)
+                cursor.copy_expert("COPY candles_staging FROM STDIN WITH (FORMAT binary)", buffer)
                 
-                for idx, row in enumerate(data_rows):
-                    # Пропускаем заголовок если он есть
-                    if idx == 0 and row[0] == 'open_time':
-                        continue
-                    
-                    try:
-                        # Формат Binance CSV:
-                        # [0] open_time, [1] open, [2] high, [3] low, [4] close, [5] volume, ...
-                        timestamp = int(row[0])
-                        dt = datetime.fromtimestamp(timestamp / 1000)
-                        
-                        cursor.execute("""
-                            INSERT INTO candles (time, symbol, timeframe, open, high, low, close, volume)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (symbol, timeframe, time) DO NOTHING
-                            RETURNING time
-                        """, (
-                            dt,
-                            symbol,
-                            timeframe,
-                            float(row[1]),  # open
-                            float(row[2]),  # high
-                            float(row[3]),  # low
-                            float(row[4]),  # close
-                            float(row[5])   # volume
-                        ))
-                        
-                        if cursor.fetchone():
-                            inserted += 1
-                        else:
-                            duplicates += 1
-                            
-                    except Exception as e:
-                        logger.warning(f"⚠️ Ошибка сохранения строки {idx}: {e}")
-                        continue
+                cursor.execute("""
+                    INSERT INTO candles (time, symbol, timeframe, open, high, low, close, volume)
+                    SELECT to_timestamp(open_time / 1000.0), %s, %s, open, high, low, close, volume
+                    FROM candles_staging
+                    ON CONFLICT (symbol, timeframe, time) DO NOTHING
+                """, (symbol, timeframe))
+                
+                inserted = max(cursor.rowcount, 0)
+                duplicates = total - inserted
                 
                 conn.commit()
                 logger.info(f"💾 Сохранено: {inserted} новых, {duplicates} дубликатов")
-                return True, inserted, duplicates
+            
+            if inserted:
+                self._run_ingest_hooks(symbol, timeframe,
+                                       int(klines['open_time'].min()), int(klines['open_time'].max()), inserted)
+            return True, inserted, duplicates
                 
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения в БД: {e}")
@@ -215,6 +494,7 @@ class BinanceDataLoader:
                 dates.append(current.strftime('%Y-%m-%d'))
                 current += timedelta(days=1)
         else:  # monthly
+            current = start.replace(day=1)
             while current <= end:
                 dates.append(current.strftime('%Y-%m'))
                 # Переходим к следующему месяцу
@@ -225,64 +505,253 @@ class BinanceDataLoader:
         
         return dates
     
+    def generate_download_plan(self, start_date: str, end_date: str,
+                               period: str) -> List[Tuple[str, str]]:
+        """
+        Генерирует список архивов для загрузки
+        
+        В режиме 'auto' полные завершенные месяцы покрываются месячными
+        архивами, а неполные крайние месяцы (и текущий месяц, для которого
+        месячного архива еще нет) - дневными.
+        
+        Args:
+            start_date: Дата начала (YYYY-MM-DD)
+            end_date: Дата конца (YYYY-MM-DD)
+            period: 'daily', 'monthly' или 'auto'
+            
+        Returns:
+            List[Tuple[str, str]]: Список (тип периода 'daily'/'monthly', дата)
+        """
+        if period == 'daily':
+            return [('daily', date) for date in self.generate_date_range(start_date, end_date, 'daily')]
+        if period != 'auto':
+            return [('monthly', date) for date in self.generate_date_range(start_date, end_date, 'monthly')]
+        
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d')
+        published_before = datetime.utcnow() - timedelta(days=MONTHLY_PUBLISH_LAG_DAYS)
+        
+        plan = []
+        for month in self.generate_date_range(start_date, end_date, 'monthly'):
+            month_start = datetime.strptime(month, '%Y-%m')
+            if month_start.month == 12:
+                next_month = month_start.replace(year=month_start.year + 1, month=1)
+            else:
+                next_month = month_start.replace(month=month_start.month + 1)
+            month_end = next_month - timedelta(days=1)
+            
+            if start <= month_start and month_end <= end and next_month <= published_before:
+                plan.append(('monthly', month))
+            else:
+                first_day = max(start, month_start).strftime('%Y-%m-%d')
+                last_day = min(end, month_end).strftime('%Y-%m-%d')
+                plan.extend(('daily', date) for date in self.generate_date_range(first_day, last_day, 'daily'))
+        
+        return plan
+    
+    def build_url(self, symbol: str, timeframe: str, period_type: str, date: str) -> str:
+        """Формирует URL архива data.binance.vision"""
+        return f"{self.base_url}/{period_type}/klines/{symbol}/{timeframe}/{symbol}-{timeframe}-{date}.zip"
+    
+    def _fetch_and_parse(self, url: str, period_type: str, date: str,
+                         session: requests.Session, max_retries: int,
+                         use_cache: bool, offline: bool,
+                         parse_pool: ThreadPoolExecutor, window: threading.Semaphore,
+                         results: queue.Queue, abort: threading.Event):
+        """
+        Стадия загрузки конвейера: скачивает архив и передает его на разбор
+        
+        Результат каждого периода (успешный или нет) попадает в очередь writer'а
+        ровно один раз.
+        """
+        while not window.acquire(timeout=1):
+            if abort.is_set():
+                return
+        period_stats = {'period': date, 'type': period_type, 'url': url, 'attempts': 0, 'bytes': 0, 'rows': 0}
+        try:
+            started = time.monotonic()
+            status, content, attempts, source = self.get_archive(url, session, max_retries,
+                                                                 use_cache, offline)
+            period_stats['attempts'] = attempts
+            period_stats['source'] = source
+            period_stats['download_time'] = round(time.monotonic() - started, 3)
+            
+            if status != 'ok':
+                period_stats['status'] = status
+                results.put((period_stats, None))
+                return
+            
+            period_stats['bytes'] = len(content)
+            parse_pool.submit(self._parse_stage, content, period_stats, results)
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки {url}: {e}")
+            period_stats['status'] = 'failed'
+            period_stats['error'] = str(e)
+            results.put((period_stats, None))
+    
+    def _parse_stage(self, content: bytes, period_stats: dict, results: queue.Queue):
+        """Стадия разбора конвейера: распаковывает архив и отдает колонки writer'у"""
+        try:
+            klines = self.parse_zip(content)
+            period_stats['rows'] = len(klines)
+            period_stats['status'] = 'ok' if len(klines) else 'empty'
+            results.put((period_stats, klines))
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки ZIP {period_stats['url']}: {e}")
+            period_stats['status'] = 'failed'
+            period_stats['error'] = str(e)
+            results.put((period_stats, None))
+    
+    def plan_download(self, symbol: str, timeframe: str, period: str, start_date: str, end_date: str,
+                      only_missing: bool = False) -> Tuple[List[Tuple[str, str]], int]:
+        """
+        Составляет список архивов для загрузки
+        
+        Returns:
+            Tuple[List[Tuple[str, str]], int]: (периоды к загрузке, количество пропущенных полных периодов)
+        """
+        all_periods = self.generate_download_plan(start_date, end_date, period)
+        periods = all_periods
+        if only_missing:
+            periods, _ = sync_planner.plan(symbol, timeframe, all_periods)
+        return periods, len(all_periods) - len(periods)
+    
     def download_historical_data(self, symbol: str, timeframe: str, period: str, 
-                                 start_date: str, end_date: str) -> Tuple[bool, str, dict]:
+                                 start_date: str, end_date: str,
+                                 concurrency: Optional[int] = None,
+                                 max_retries: Optional[int] = None,
+                                 use_cache: bool = CACHE_ENABLED,
+                                 offline: Optional[bool] = None,
+                                 only_missing: bool = False,
+                                 periods: Optional[List[Tuple[str, str]]] = None,
+                                 progress_callback: Optional[Callable[[dict], bool]] = None) -> Tuple[bool, str, dict]:
         """
         Основная функция загрузки исторических данных
         
+        Архивы скачиваются конвейером: пул загрузчиков с общей HTTP сессией,
+        пул разбора ZIP и единственный writer в БД (текущий поток), который
+        получает готовые периоды из очереди. Архивы берутся из локального
+        кэша, если они уже скачивались.
+        
         Args:
             symbol: Символ
             timeframe: Таймфрейм
-            period: 'daily' или 'monthly'
+            period: 'daily', 'monthly' или 'auto' (месячные архивы + дневные по краям)
             start_date: Дата начала
             end_date: Дата конца
+            concurrency: Количество параллельных загрузок (по умолчанию BINANCE_DOWNLOAD_CONCURRENCY)
+            max_retries: Количество повторов запроса (по умолчанию BINANCE_MAX_RETRIES)
+            use_cache: Использовать локальный кэш архивов
+            offline: Работать только из кэша, без сети (по умолчанию BINANCE_OFFLINE)
+            only_missing: Загружать только периоды, которых нет в candles или они неполные
+            periods: Готовый список (тип периода, дата) вместо планирования по датам
+            progress_callback: Вызывается writer'ом после каждого периода со статистикой
+                периода; если возвращает False, загрузка отменяется
             
         Returns:
             Tuple[bool, str, dict]: (успех, сообщение, статистика)
         """
         try:
+            concurrency = max(1, int(concurrency or DOWNLOAD_CONCURRENCY))
+            max_retries = MAX_RETRIES if max_retries is None else max(0, int(max_retries))
+            offline = OFFLINE if offline is None else bool(offline)
+            
             logger.info(f"🔄 Начало загрузки {symbol} {timeframe} ({period}): {start_date} - {end_date}")
             
-            # Генерируем список дат
-            dates = self.generate_date_range(start_date, end_date, period)
-            logger.info(f"📅 Найдено {len(dates)} периодов для загрузки")
+            # Генерируем список архивов
+            skipped = 0
+            if periods is None:
+                periods, skipped = self.plan_download(symbol, timeframe, period, start_date, end_date, only_missing)
+            periods = [tuple(p) for p in periods]
+            
+            logger.info(f"📅 Найдено {len(periods)} периодов для загрузки (потоков: {concurrency})")
             
             total_inserted = 0
             total_duplicates = 0
             successful_downloads = 0
             failed_downloads = 0
+            cancelled = False
+            periods_stats = []
+            started = time.monotonic()
+            
+            results = queue.Queue()
+            # Ограничиваем число периодов "в полете", чтобы не держать в памяти весь диапазон
+            window = threading.Semaphore(concurrency * 2)
+            abort = threading.Event()
             
-            # Загружаем данные для каждой даты
-            for date in dates:
-                # Формируем URL
-                period_type = 'daily' if period == 'daily' else 'monthly'
-                url = f"{self.base_url}/{period_type}/klines/{symbol}/{timeframe}/{symbol}-{timeframe}-{date}.zip"
+            with self.create_session(concurrency) as session, \
+                    ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='binance-parse') as parse_pool, \
+                    ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='binance-fetch') as fetch_pool:
                 
-                # Скачиваем и парсим
-                success, data_rows = self.download_and_parse_zip(url)
+                for period_type, date in periods:
+                    url = self.build_url(symbol, timeframe, period_type, date)
+                    fetch_pool.submit(self._fetch_and_parse, url, period_type, date, session, max_retries,
+                                      use_cache, offline, parse_pool, window, results, abort)
                 
-                if success and data_rows:
-                    # Сохраняем в БД
-                    success, inserted, duplicates = self.save_to_database(symbol, timeframe, data_rows)
-                    if success:
-                        total_inserted += inserted
-                        total_duplicates += duplicates
-                        successful_downloads += 1
-                    else:
-                        failed_downloads += 1
-                else:
-                    failed_downloads += 1
+                # Writer: единственный поток, который пишет в БД
+                try:
+                    for _ in periods:
+                        period_stats, klines = results.get()
+                        try:
+                            if klines is not None and len(klines):
+                                write_started = time.monotonic()
+                                success, inserted, duplicates = self.save_to_database(symbol, timeframe, klines)
+                                period_stats['write_time'] = round(time.monotonic() - write_started, 3)
+                                period_stats['inserted'] = inserted
+                                period_stats['duplicates'] = duplicates
+                                if success:
+                                    total_inserted += inserted
+                                    total_duplicates += duplicates
+                                    successful_downloads += 1
+                                else:
+                                    period_stats['status'] = 'failed'
+                                    failed_downloads += 1
+                            else:
+                                failed_downloads += 1
+                        finally:
+                            window.release()
+                        
+                        periods_stats.append(period_stats)
+                        
+                        if progress_callback and progress_callback(period_stats) is False:
+                            logger.warning(f"🛑 Загрузка {symbol} {timeframe} отменена")
+                            cancelled = True
+                            abort.set()
+                            fetch_pool.shutdown(wait=False, cancel_futures=True)
+                            break
+                except BaseException:
+                    # Останавливаем загрузчики, чтобы выход из пулов не завис
+                    abort.set()
+                    fetch_pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+            
+            if use_cache and not offline:
+                self.archive_cache.evict()
+            
+            elapsed = time.monotonic() - started
+            periods_stats.sort(key=lambda p: p['period'])
             
             # Формируем итоговое сообщение
             stats = {
-                'total_periods': len(dates),
+                'total_periods': len(periods) + skipped,
+                'skipped_complete': skipped,
                 'successful': successful_downloads,
                 'failed': failed_downloads,
                 'inserted': total_inserted,
-                'duplicates': total_duplicates
+                'duplicates': total_duplicates,
+                'elapsed': round(elapsed, 3),
+                'concurrency': concurrency,
+                'cache_hits': sum(1 for p in periods_stats if p.get('source') == 'cache' and p.get('status') == 'ok'),
+                'offline': offline,
+                'cancelled': cancelled,
+                'periods': periods_stats
             }
             
-            message = f"Загрузка завершена: {successful_downloads}/{len(dates)} периодов, добавлено {total_inserted} свечей"
+            status = 'отменена' if cancelled else 'завершена'
+            message = f"Загрузка {status}: {successful_downloads}/{len(periods)} периодов, добавлено {total_inserted} свечей за {elapsed:.1f}с"
+            if skipped:
+                message += f", пропущено полных периодов: {skipped}"
             logger.info(f"✅ {message}")
             
             return True, message, stats
@@ -293,4 +762,39 @@ class BinanceDataLoader:
             return False, error_msg, {}
 
 # Создаем глобальный экземпляр
-binance_data_loader = BinanceDataLoader()
\ No newline at end of file
+binance_data_loader = BinanceDataLoader()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    
+    parser = argparse.ArgumentParser(description='Загрузка исторических данных Binance в candles')
+    parser.add_argument('symbol')
+    parser.add_argument('timeframe')
+    parser.add_argument('--period', default='monthly', choices=['daily', 'monthly', 'auto'])
+    parser.add_argument('--start', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--offline', action='store_true', help='Только из локального кэша архивов')
+    parser.add_argument('--no-cache', action='store_true', help='Не использовать кэш архивов')
+    parser.add_argument('--only-missing', action='store_true', help='Загружать только отсутствующие периоды')
+    args = parser.parse_args()
+    
+    success, message, stats = binance_data_loader.download_historical_data(
+        symbol=args.symbol,
+        timeframe=args.timeframe,
+        period=args.period,
+        start_date=args.start,
+        end_date=args.end,
+        concurrency=args.concurrency,
+        use_cache=not args.no_cache,
+        offline=args.offline or None,
+        only_missing=args.only_missing
+    )
+    stats.pop('periods', None)
+    print(message)
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+    raise SystemExit(0 if success else 1)
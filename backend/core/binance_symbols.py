@@ -5,24 +5,15 @@ import requests
 import psycopg2
 import psycopg2.extras
 import logging
-import os
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, List, Optional
 from dotenv import load_dotenv
+from .db import db
 from decimal import Decimal
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Настройки подключения к PostgreSQL
-DB_CONFIG = {
-    'host': os.getenv('POSTGRES_HOST', 'localhost'),
-    'port': int(os.getenv('POSTGRES_PORT', 5432)),
-    'database': os.getenv('POSTGRES_DATABASE', 'backtrader'),
-    'user': os.getenv('POSTGRES_USER'),
-    'password': os.getenv('POSTGRES_PASSWORD')
-}
-
 class BinanceSymbolsManager:
     """Класс для управления списком символов Binance"""
     
@@ -30,13 +21,8 @@ class BinanceSymbolsManager:
         self.base_url = "https://fapi.binance.com"
     
     def get_connection(self):
-        """Создает подключение к PostgreSQL"""
-        try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            return conn
-        except Exception as e:
-            logger.error(f"❌ Ошибка подключения к PostgreSQL: {e}")
-            raise
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
     
     def clear_table(self):
         """Очищает таблицу binance_symbols"""
@@ -135,17 +121,34 @@ class BinanceSymbolsManager:
             logger.error(f"❌ {error_msg}")
             return False, error_msg
     
-    def get_symbols_list(self) -> List[str]:
+    def get_symbols_list(self, pattern: Optional[str] = None,
+                         filters: Optional[Dict[str, str]] = None) -> List[str]:
         """
         Получает список всех символов из базы данных
         
+        Args:
+            pattern: Шаблон символа для LIKE (например '%USDT')
+            filters: Фильтр по полям msg_data из exchangeInfo
+                (например {'contractType': 'PERPETUAL', 'status': 'TRADING'})
+        
         Returns:
             List[str]: Список символов, отсортированный по алфавиту
         """
         try:
+            conditions = []
+            params = []
+            if pattern:
+                conditions.append("symbol LIKE %s")
+                params.append(pattern)
+            for key, value in (filters or {}).items():
+                conditions.append("msg_data->>%s = %s")
+                params.extend([key, str(value)])
+            
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT symbol FROM binance_symbols ORDER BY symbol")
+                cursor.execute(f"SELECT symbol FROM binance_symbols {where} ORDER BY symbol", params)
                 symbols = [row[0] for row in cursor.fetchall()]
                 
             logger.info(f"📋 Получено {len(symbols)} символов из базы данных")
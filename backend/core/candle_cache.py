@@ -0,0 +1,245 @@
+"""
+Модуль локального колоночного кэша свечей (Parquet) перед таблицей candles
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+import importlib.util
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable, List, Optional
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# pyarrow (а через него и pandas) импортируется при первом обращении к кэшу, а не при старте приложения
+PYARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+# Настройки кэша свечей
+PARQUET_CACHE_DIR = os.getenv('CANDLE_CACHE_DIR', os.path.join('cache', 'parquet'))
+PARQUET_CACHE_ENABLED = os.getenv('CANDLE_CACHE_ENABLED', '1') == '1'
+# Размер row group: чем меньше, тем точнее отсечение по времени при чтении
+PARQUET_ROW_GROUP_SIZE = int(os.getenv('CANDLE_CACHE_ROW_GROUP_SIZE', 65536))
+
+CANDLE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def month_start(value: datetime) -> datetime:
+    """Возвращает начало месяца"""
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(value: datetime) -> datetime:
+    """Возвращает начало следующего месяца"""
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+class CandleCache:
+    """
+    Кэш свечей в Parquet файлах {symbol}/{timeframe}/{YYYY-MM}.parquet
+
+    Месяц заполняется из БД при первом чтении целиком, а при загрузке новых
+    свечей соответствующие месяцы удаляются через хук загрузчика. Чтение идет
+    через pyarrow.dataset с фильтром по времени, поэтому с диска читаются
+    только нужные row group. Файлы пишутся атомарно и общие для всех воркеров.
+    """
+
+    def __init__(self, root: str = PARQUET_CACHE_DIR, enabled: bool = PARQUET_CACHE_ENABLED):
+        self.root = root
+        self.enabled = enabled and PYARROW_AVAILABLE
+        if enabled and not PYARROW_AVAILABLE:
+            logger.warning("⚠️ pyarrow не установлен, кэш свечей Parquet отключен")
+
+    def _series_dir(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, symbol, timeframe)
+
+    def _partition_path(self, symbol: str, timeframe: str, month: datetime) -> str:
+        return os.path.join(self._series_dir(symbol, timeframe), f"{month:%Y-%m}.parquet")
+
+    def _version_path(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self._series_dir(symbol, timeframe), '_invalidated')
+
+    def _read_version(self, symbol: str, timeframe: str) -> str:
+        try:
+            with open(self._version_path(symbol, timeframe), 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ''
+
+    def _write_partition(self, path: str, table: 'pa.Table'):
+        """Записывает месяц через временный файл в той же директории"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            import pyarrow.parquet as pq
+            pq.write_table(table, tmp_path, row_group_size=PARQUET_ROW_GROUP_SIZE)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _fill(self, symbol: str, timeframe: str, months: List[datetime],
+              fetch: Callable[[str, str, datetime, datetime], 'pd.DataFrame']):
+        """Заполняет отсутствующие месяцы одним запросом к БД"""
+        version = self._read_version(symbol, timeframe)
+        range_start = months[0]
+        range_end = next_month(months[-1])
+        df = fetch(symbol, timeframe, range_start, range_end)
+
+        if df is None or df.empty:
+            return
+
+        import pyarrow as pa
+        month_keys = df.index.tz_convert('UTC').strftime('%Y-%m') if df.index.tz is not None \
+            else df.index.strftime('%Y-%m')
+        written = []
+        for month in months:
+            part = df.loc[month_keys == f"{month:%Y-%m}", CANDLE_COLUMNS].astype('float64')
+            if part.empty:
+                continue
+            table = pa.Table.from_pandas(part, preserve_index=True)
+            path = self._partition_path(symbol, timeframe, month)
+            self._write_partition(path, table)
+            written.append(path)
+
+        # Если во время чтения из БД пришли новые свечи, записанные месяцы могут быть устаревшими
+        if self._read_version(symbol, timeframe) != version:
+            for path in written:
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.info(f"🔁 {symbol} {timeframe}: кэш изменился во время заполнения, месяцы не сохранены")
+            return
+
+        if written:
+            logger.info(f"🗃️ {symbol} {timeframe}: закэшировано месяцев: {len(written)}")
+
+    def load(self, symbol: str, timeframe: str, start: datetime, end: datetime,
+             fetch: Callable[[str, str, datetime, datetime], 'pd.DataFrame']) -> Optional['pd.DataFrame']:
+        """
+        Возвращает свечи в интервале [start, end) из кэша, дозаполняя его из БД
+
+        Args:
+            symbol: Символ
+            timeframe: Таймфрейм
+            start: Начало интервала (UTC)
+            end: Конец интервала (UTC, не включительно)
+            fetch: Функция чтения свечей из БД (symbol, timeframe, start, end) -> DataFrame
+
+        Returns:
+            Optional[pd.DataFrame]: DataFrame с индексом datetime или None, если свечей нет
+        """
+        months = []
+        month = month_start(start)
+        while month < end:
+            months.append(month)
+            month = next_month(month)
+
+        missing = [m for m in months if not os.path.exists(self._partition_path(symbol, timeframe, m))]
+        if missing:
+            self._fill(symbol, timeframe, missing, fetch)
+
+        paths = [p for p in (self._partition_path(symbol, timeframe, m) for m in months) if os.path.exists(p)]
+        if not paths:
+            return None
+
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        time_type = pa.timestamp('us', tz='UTC')
+        start_utc = start.replace(tzinfo=timezone.utc) if start.tzinfo is None else start
+        end_utc = end.replace(tzinfo=timezone.utc) if end.tzinfo is None else end
+
+        dataset = ds.dataset(paths, format='parquet')
+        time_field = ds.field('datetime')
+        table = dataset.to_table(filter=(time_field >= pa.scalar(start_utc, type=time_type)) &
+                                        (time_field < pa.scalar(end_utc, type=time_type)))
+        if table.num_rows == 0:
+            return None
+
+        df = table.to_pandas()
+        if 'datetime' in df.columns:
+            df.set_index('datetime', inplace=True)
+        return df.sort_index()
+
+    def invalidate(self, symbol: str, timeframe: str, start_ms: int, end_ms: int, inserted: int = 0):
+        """
+        Удаляет месяцы, затронутые новыми свечами (хук загрузчика)
+
+        Args:
+            symbol: Символ
+            timeframe: Таймфрейм
+            start_ms: Время открытия первой новой свечи, мс
+            end_ms: Время открытия последней новой свечи, мс
+            inserted: Количество новых свечей
+        """
+        # Версию обновляем всегда, даже без файлов: параллельное заполнение увидит изменение
+        os.makedirs(self._series_dir(symbol, timeframe), exist_ok=True)
+        with open(self._version_path(symbol, timeframe), 'w') as f:
+            f.write(str(time.time_ns()))
+
+        epoch = datetime(1970, 1, 1)
+        month = month_start(epoch + timedelta(milliseconds=int(start_ms)))
+        last = month_start(epoch + timedelta(milliseconds=int(end_ms)))
+        removed = 0
+        while month <= last:
+            path = self._partition_path(symbol, timeframe, month)
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+            month = next_month(month)
+
+        if removed:
+            logger.info(f"🧹 {symbol} {timeframe}: сброшено месяцев кэша: {removed}")
+
+    def clear(self, symbol: Optional[str] = None, timeframe: Optional[str] = None):
+        """Удаляет кэш целиком, по символу или по ряду"""
+        if symbol and timeframe:
+            path = self._series_dir(symbol, timeframe)
+        elif symbol:
+            path = os.path.join(self.root, symbol)
+        else:
+            path = self.root
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# Создаем глобальный экземпляр
+candle_cache = CandleCache()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='Управление кэшем свечей Parquet')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    warm_parser = subparsers.add_parser('warm', help='Заполнить кэш для ряда')
+    warm_parser.add_argument('symbol')
+    warm_parser.add_argument('timeframe')
+    warm_parser.add_argument('--start', required=True, help='YYYY-MM-DD')
+    warm_parser.add_argument('--end', required=True, help='YYYY-MM-DD')
+
+    clear_parser = subparsers.add_parser('clear', help='Очистить кэш')
+    clear_parser.add_argument('symbol', nargs='?')
+    clear_parser.add_argument('timeframe', nargs='?')
+
+    args = parser.parse_args()
+
+    if args.command == 'warm':
+        from .binance_data_loader import binance_data_loader
+        df = binance_data_loader.load_data_for_backtest(args.symbol, args.timeframe, args.start, args.end)
+        print(f"{args.symbol} {args.timeframe}: {0 if df is None else len(df)} свечей в кэше")
+    else:
+        candle_cache.clear(args.symbol, args.timeframe)
+        print("Кэш свечей очищен")
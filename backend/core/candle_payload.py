@@ -0,0 +1,206 @@
+"""
+Модуль ответа /api/get_candles: агрегация под ширину графика, страницы по курсору
+и форматы (строки, колоночный JSON, бинарный буфер)
+"""
+import os
+import struct
+import numpy as np
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from .db import db
+from .resampler import can_resample
+from .timeframes import TIMEFRAME_SECONDS, TIMEFRAME_OFFSETS, timeframe_seconds
+
+load_dotenv()
+
+# Бинарный формат (little-endian):
+#   заголовок 16 байт: magic b'CNDL', версия uint32, количество свечей uint32, резерв uint32
+#   time int64[count] (Unix секунды), затем open/high/low/close/volume float64[count]
+# Заголовок кратен 8 байтам, поэтому на клиенте колонки читаются Float64Array без копирования
+BINARY_MAGIC = b'CNDL'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sIII')
+BINARY_MIMETYPE = 'application/octet-stream'
+
+CANDLE_FORMATS = ('rows', 'columnar', 'binary')
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+# Сколько пикселей ширины графика приходится минимум на одну свечу (для параметра width)
+CHART_MIN_BAR_PIXELS = int(os.getenv('CHART_MIN_BAR_PIXELS', 2))
+# Ограничение размера одной страницы (limit)
+CHART_MAX_PAGE_BARS = int(os.getenv('CHART_MAX_PAGE_BARS', 50000))
+
+PAGE_DIRECTIONS = ('forward', 'backward')
+
+
+def bars_for_width(width: int) -> int:
+    """Сколько свечей имеет смысл рисовать на графике шириной width пикселей"""
+    return max(1, int(width) // CHART_MIN_BAR_PIXELS)
+
+
+def _span_seconds(start_date: str, end_date: str) -> float:
+    start = datetime.fromisoformat(start_date)
+    end = datetime.fromisoformat(end_date)
+    return max((end - start).total_seconds(), 0)
+
+
+def choose_bar_timeframe(timeframe: str, start_date: str, end_date: str, max_bars: int) -> str:
+    """
+    Выбирает таймфрейм свечей графика, при котором период укладывается в max_bars
+
+    Кандидаты - сам timeframe и таймфреймы, которые из него точно собираются
+    (can_resample), поэтому агрегированные свечи совпадают с биржевыми.
+
+    Args:
+        timeframe: Таймфрейм хранимого ряда
+        start_date: Начало периода
+        end_date: Конец периода
+        max_bars: Желаемое максимальное количество свечей
+
+    Returns:
+        str: timeframe или старший таймфрейм (самый крупный, если не укладывается ни один)
+
+    Raises:
+        ValueError: Неизвестный таймфрейм или неверный формат даты
+    """
+    timeframe_seconds(timeframe)
+    span = _span_seconds(start_date, end_date)
+    candidates = [timeframe] + [tf for tf in TIMEFRAME_SECONDS if can_resample(timeframe, tf)]
+    # 1mo (без фиксированной длины) считаем как 31 день и ставим последним
+    durations = {tf: TIMEFRAME_SECONDS[tf] or 31 * 24 * 60 * 60 for tf in candidates}
+    candidates.sort(key=durations.get)
+
+    for tf in candidates:
+        if span // durations[tf] + 1 <= max_bars:
+            return tf
+    return candidates[-1]
+
+
+def _bucket_expression(timeframe: str) -> str:
+    """SQL выражение: время открытия свечи timeframe (Unix секунды), в которую попадает строка candles"""
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    if seconds is None:
+        return "EXTRACT(EPOCH FROM date_trunc('month', time AT TIME ZONE 'UTC') AT TIME ZONE 'UTC')::bigint"
+    offset = TIMEFRAME_OFFSETS.get(timeframe, 0)
+    return f"((EXTRACT(EPOCH FROM time)::bigint - {offset}) / {seconds} * {seconds} + {offset})"
+
+
+def fetch_candle_columns(symbol: str, timeframe: str, start_date: str, end_date: str,
+                         bar_timeframe: Optional[str] = None, cursor: Optional[int] = None,
+                         direction: str = 'forward', limit: Optional[int] = None) -> Tuple[Dict[str, np.ndarray], bool]:
+    """
+    Читает свечи для графика в колонки NumPy
+
+    Если bar_timeframe старше timeframe, свечи агрегируются в БД по хранимому ряду:
+    open - первая, close - последняя, high/low - экстремумы всех свечей группы,
+    volume - сумма. Клиенту передается не больше одной строки на свечу графика.
+
+    Страницы задаются курсором (время открытия свечи графика, Unix секунды):
+    forward - свечи строго после курсора, backward - строго до него.
+
+    Args:
+        symbol: Символ
+        timeframe: Таймфрейм хранимого ряда
+        start_date: Начало периода
+        end_date: Конец периода
+        bar_timeframe: Таймфрейм свечей графика (по умолчанию timeframe)
+        cursor: Курсор страницы или None (с начала/конца периода)
+        direction: forward или backward
+        limit: Размер страницы (свечей графика) или None - весь период
+
+    Returns:
+        Tuple[Dict[str, np.ndarray], bool]: Колонки time (int64, секунды) и
+            open/high/low/close/volume (float64) по возрастанию времени; есть ли еще свечи
+    """
+    bar_timeframe = bar_timeframe or timeframe
+    bucket = _bucket_expression(bar_timeframe)
+    aggregate = bar_timeframe != timeframe
+    backward = direction == 'backward'
+
+    conditions = ["symbol = %s", "timeframe = %s", "time >= %s", "time <= %s"]
+    params = [symbol, timeframe, start_date, end_date]
+    if cursor is not None:
+        if backward:
+            # Курсор - начало свечи графика, все более ранние строки относятся к предыдущим свечам
+            conditions.append("time < to_timestamp(%s)")
+            params.append(cursor)
+        else:
+            conditions.extend(["time >= to_timestamp(%s)", f"{bucket} > %s"])
+            params.extend([cursor, cursor])
+
+    if aggregate:
+        select = f"""
+            SELECT {bucket} AS bucket,
+                   (array_agg(open ORDER BY time))[1],
+                   MAX(high),
+                   MIN(low),
+                   (array_agg(close ORDER BY time DESC))[1],
+                   SUM(volume)
+            FROM candles
+            WHERE {' AND '.join(conditions)}
+            GROUP BY bucket
+            ORDER BY bucket {'DESC' if backward else 'ASC'}
+        """
+    else:
+        select = f"""
+            SELECT
+                EXTRACT(EPOCH FROM time)::bigint as timestamp,
+                open,
+                high,
+                low,
+                close,
+                volume
+            FROM candles
+            WHERE {' AND '.join(conditions)}
+            ORDER BY time {'DESC' if backward else 'ASC'}
+        """
+    if limit is not None:
+        # Лишняя строка показывает, есть ли следующая страница
+        select += " LIMIT %s"
+        params.append(limit + 1)
+
+    with db.connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.execute(select, params)
+        rows = db_cursor.fetchall()
+
+    has_more = limit is not None and len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+    if backward:
+        rows.reverse()
+
+    values = np.array(rows, dtype=np.float64).reshape(-1, 6)
+    columns = {'time': values[:, 0].astype(np.int64)}
+    for index, name in enumerate(PRICE_COLUMNS, start=1):
+        columns[name] = np.ascontiguousarray(values[:, index])
+    return columns, has_more
+
+
+def next_cursor(columns: Dict[str, np.ndarray], has_more: bool, direction: str) -> Optional[int]:
+    """Курсор следующей страницы (None, если данных больше нет)"""
+    if not has_more or len(columns['time']) == 0:
+        return None
+    return int(columns['time'][0] if direction == 'backward' else columns['time'][-1])
+
+
+def to_rows(columns: Dict[str, np.ndarray]) -> list:
+    """Список свечей-объектов (исходный формат ответа)"""
+    names = ('time',) + PRICE_COLUMNS
+    return [dict(zip(names, row)) for row in zip(*(columns[name].tolist() for name in names))]
+
+
+def to_columnar(columns: Dict[str, np.ndarray]) -> dict:
+    """Параллельные массивы time/open/high/low/close/volume"""
+    return {name: columns[name].tolist() for name in ('time',) + PRICE_COLUMNS}
+
+
+def to_binary(columns: Dict[str, np.ndarray]) -> bytes:
+    """Бинарный little-endian буфер (см. BINARY_HEADER)"""
+    count = len(columns['time'])
+    parts = [BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, count, 0),
+             columns['time'].astype('<i8', copy=False).tobytes()]
+    for name in PRICE_COLUMNS:
+        parts.append(columns[name].astype('<f8', copy=False).tobytes())
+    return b''.join(parts)
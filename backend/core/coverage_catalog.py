@@ -0,0 +1,365 @@
+"""
+Модуль каталога покрытия candles: диапазоны, количество свечей и пропуски по каждому ряду
+"""
+import logging
+import psycopg2
+import psycopg2.extras
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from dotenv import load_dotenv
+from .db import db
+from .timeframes import TIMEFRAME_SECONDS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock первичного заполнения каталога (одно на все процессы)
+BOOTSTRAP_LOCK_KEY = 7240012
+
+# Шаг между соседними свечами 1mo плавающий, поэтому разрыв считаем по максимальной длине месяца
+MONTH_STEP_MS = 31 * 24 * 60 * 60 * 1000
+
+# Непрерывные отрезки ряда (время открытия первой и последней свечи, мс) по группам без разрывов
+RUNS_QUERY = """
+    SELECT symbol, timeframe, MIN(t), MAX(t), COUNT(*)
+    FROM (
+        SELECT symbol, timeframe, t,
+               SUM(CASE WHEN t - prev_t > step THEN 1 ELSE 0 END)
+                   OVER (PARTITION BY symbol, timeframe ORDER BY t) AS grp
+        FROM (
+            SELECT symbol, timeframe, t, step,
+                   lag(t) OVER (PARTITION BY symbol, timeframe ORDER BY t) AS prev_t
+            FROM (
+                SELECT symbol, timeframe,
+                       (EXTRACT(EPOCH FROM time) * 1000)::bigint AS t,
+                       CASE timeframe {step_cases} ELSE {month_step} END AS step
+                FROM candles
+                {where}
+            ) c
+        ) l
+    ) g
+    GROUP BY symbol, timeframe, grp
+    ORDER BY symbol, timeframe, 3
+"""
+
+
+def timeframe_step_ms(timeframe: str) -> int:
+    """Шаг между соседними свечами таймфрейма, мс"""
+    seconds = TIMEFRAME_SECONDS.get(timeframe)
+    return seconds * 1000 if seconds else MONTH_STEP_MS
+
+
+def merge_segments(segments: List[List[int]], step: int) -> List[List[int]]:
+    """Сливает пересекающиеся и соседние (через один шаг) отрезки"""
+    merged = []
+    for start, end in sorted(segments):
+        if merged and start <= merged[-1][1] + step:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def clip_segments(segments: List[List[int]], start_ms: int, end_ms: int, step: int) -> List[List[int]]:
+    """Вырезает из отрезков окно [start_ms, end_ms] (внутри отрезков свечи идут с шагом step)"""
+    clipped = []
+    for seg_start, seg_end in segments:
+        if seg_end < start_ms or seg_start > end_ms:
+            clipped.append([seg_start, seg_end])
+            continue
+        if seg_start < start_ms:
+            clipped.append([seg_start, seg_start + (start_ms - 1 - seg_start) // step * step])
+        if seg_end > end_ms:
+            clipped.append([seg_start + ((end_ms - seg_start) // step + 1) * step, seg_end])
+    return clipped
+
+
+def ms_to_datetime(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+
+
+class CoverageCatalog:
+    """
+    Класс для ведения таблицы candle_coverage
+
+    Для каждого ряда (symbol, timeframe) хранятся первая и последняя свеча,
+    количество свечей и список непрерывных отрезков. Каталог обновляется
+    хуком загрузчика после каждой записи: пересчитывается только окно новых
+    свечей, поэтому стоимость не зависит от размера candles.
+    """
+
+    def __init__(self):
+        self._schema_ready = False
+
+    def get_connection(self):
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
+
+    def ensure_schema(self, bootstrap: bool = True):
+        """
+        Создает таблицу candle_coverage, если ее нет
+
+        Args:
+            bootstrap: Заполнить только что созданный каталог по candles (recompute),
+                чтобы ряды, загруженные до его появления, не пропали из списка
+        """
+        if self._schema_ready:
+            return
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Проверка и создание под блокировкой - заполнение запускает только создавший таблицу процесс
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (BOOTSTRAP_LOCK_KEY,))
+            cursor.execute("SELECT to_regclass('public.candle_coverage')")
+            created = cursor.fetchone()[0] is None
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS candle_coverage (
+                    symbol TEXT NOT NULL,
+                    timeframe TEXT NOT NULL,
+                    first_time TIMESTAMPTZ,
+                    last_time TIMESTAMPTZ,
+                    candles_count BIGINT NOT NULL DEFAULT 0,
+                    segments JSONB NOT NULL DEFAULT '[]',
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (symbol, timeframe)
+                )
+            """)
+            conn.commit()
+
+        self._schema_ready = True
+        if created and bootstrap:
+            self.recompute()
+
+    def _runs(self, cursor, symbol: Optional[str] = None, timeframe: Optional[str] = None,
+              start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> Dict[Tuple[str, str], list]:
+        """Находит непрерывные отрезки в candles (по всему ряду или внутри окна)"""
+        conditions = []
+        params = []
+        if symbol:
+            conditions.append("symbol = %s")
+            params.append(symbol)
+        if timeframe:
+            conditions.append("timeframe = %s")
+            params.append(timeframe)
+        if start_ms is not None:
+            conditions.append("time >= to_timestamp(%s / 1000.0)")
+            params.append(start_ms)
+        if end_ms is not None:
+            conditions.append("time <= to_timestamp(%s / 1000.0)")
+            params.append(end_ms)
+
+        step_cases = ' '.join(f"WHEN '{tf}' THEN {seconds * 1000}"
+                              for tf, seconds in TIMEFRAME_SECONDS.items() if seconds)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        cursor.execute(RUNS_QUERY.format(step_cases=step_cases, month_step=MONTH_STEP_MS, where=where), params)
+
+        runs = {}
+        for row_symbol, row_timeframe, run_start, run_end, count in cursor.fetchall():
+            runs.setdefault((row_symbol, row_timeframe), []).append((run_start, run_end, count))
+        return runs
+
+    def _save(self, cursor, symbol: str, timeframe: str, segments: List[List[int]], candles_count: int):
+        cursor.execute("""
+            INSERT INTO candle_coverage (symbol, timeframe, first_time, last_time, candles_count, segments, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, now())
+            ON CONFLICT (symbol, timeframe) DO UPDATE
+            SET first_time = EXCLUDED.first_time,
+                last_time = EXCLUDED.last_time,
+                candles_count = EXCLUDED.candles_count,
+                segments = EXCLUDED.segments,
+                updated_at = now()
+        """, (
+            symbol, timeframe,
+            ms_to_datetime(segments[0][0]) if segments else None,
+            ms_to_datetime(segments[-1][1]) if segments else None,
+            candles_count,
+            psycopg2.extras.Json(segments)
+        ))
+
+    def on_ingest(self, symbol: str, timeframe: str, start_ms: int, end_ms: int, inserted: int = 0):
+        """
+        Обновляет покрытие ряда после записи новых свечей (хук загрузчика)
+
+        Args:
+            symbol: Символ
+            timeframe: Таймфрейм
+            start_ms: Время открытия первой записанной свечи, мс
+            end_ms: Время открытия последней записанной свечи, мс
+            inserted: Количество новых свечей
+        """
+        self.ensure_schema()
+        step = timeframe_step_ms(timeframe)
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Блокируем строку ряда, чтобы параллельные загрузки не затерли отрезки друг друга
+            cursor.execute("""
+                INSERT INTO candle_coverage (symbol, timeframe) VALUES (%s, %s)
+                ON CONFLICT (symbol, timeframe) DO NOTHING
+                RETURNING symbol
+            """, (symbol, timeframe))
+            created = cursor.fetchone() is not None
+            cursor.execute("""
+                SELECT segments, candles_count FROM candle_coverage
+                WHERE symbol = %s AND timeframe = %s
+                FOR UPDATE
+            """, (symbol, timeframe))
+            segments, candles_count = cursor.fetchone()
+
+            # Ряда не было в каталоге - в candles могут быть и свечи вне окна, считаем его целиком.
+            # У месячных свечей шаг плавающий - ряд короткий, его тоже пересчитываем целиком
+            if created or TIMEFRAME_SECONDS.get(timeframe) is None:
+                runs = self._runs(cursor, symbol, timeframe).get((symbol, timeframe), [])
+                segments = [[run_start, run_end] for run_start, run_end, _ in runs]
+                candles_count = sum(count for _, _, count in runs)
+            else:
+                runs = self._runs(cursor, symbol, timeframe, start_ms, end_ms).get((symbol, timeframe), [])
+                segments = merge_segments(
+                    clip_segments(segments, start_ms, end_ms, step) +
+                    [[run_start, run_end] for run_start, run_end, _ in runs],
+                    step
+                )
+                candles_count += inserted
+
+            self._save(cursor, symbol, timeframe, segments, candles_count)
+            conn.commit()
+
+    def recompute(self, symbol: Optional[str] = None, timeframe: Optional[str] = None) -> int:
+        """
+        Пересчитывает каталог по candles (обслуживание: первичное заполнение или сверка)
+
+        Без аргументов выполняет один проход по всей таблице, с symbol/timeframe
+        использует индекс и затрагивает только нужные ряды.
+
+        Returns:
+            int: Количество пересчитанных рядов
+        """
+        self.ensure_schema(bootstrap=False)
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            runs = self._runs(cursor, symbol, timeframe)
+
+            conditions = []
+            params = []
+            if symbol:
+                conditions.append("symbol = %s")
+                params.append(symbol)
+            if timeframe:
+                conditions.append("timeframe = %s")
+                params.append(timeframe)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            cursor.execute(f"DELETE FROM candle_coverage {where}", params)
+
+            for (row_symbol, row_timeframe), series_runs in runs.items():
+                segments = [[run_start, run_end] for run_start, run_end, _ in series_runs]
+                self._save(cursor, row_symbol, row_timeframe, segments,
+                           sum(count for _, _, count in series_runs))
+            conn.commit()
+
+        logger.info(f"🗂️ Каталог покрытия пересчитан: {len(runs)} рядов")
+        return len(runs)
+
+    def series_version(self, symbol: str, timeframe: str) -> Optional[Tuple]:
+        """
+        Версия ряда для HTTP валидаторов (меняется при каждой записи свечей)
+
+        Returns:
+            Optional[Tuple]: (updated_at, last_time, candles_count) или None, если ряда нет
+        """
+        self.ensure_schema()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT updated_at, last_time, candles_count FROM candle_coverage
+                WHERE symbol = %s AND timeframe = %s
+            """, (symbol, timeframe))
+            return cursor.fetchone()
+
+    def catalog_version(self) -> Tuple:
+        """
+        Версия всего каталога для HTTP валидаторов
+
+        Returns:
+            Tuple: (последнее updated_at, количество рядов, сумма candles_count)
+        """
+        self.ensure_schema()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT MAX(updated_at), COUNT(*), COALESCE(SUM(candles_count), 0)
+                FROM candle_coverage
+                WHERE candles_count > 0
+            """)
+            return cursor.fetchone()
+
+    def get_coverage(self) -> List[Dict[str, Any]]:
+        """
+        Возвращает покрытие всех рядов
+
+        Returns:
+            List[Dict[str, Any]]: symbol, timeframe, start_date, end_date, candles_count, gaps
+        """
+        self.ensure_schema()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT symbol, timeframe, first_time, last_time, candles_count, segments
+                FROM candle_coverage
+                WHERE candles_count > 0
+                ORDER BY symbol, timeframe
+            """)
+            rows = cursor.fetchall()
+
+        data = []
+        for symbol, timeframe, first_time, last_time, candles_count, segments in rows:
+            step = timeframe_step_ms(timeframe)
+            gaps = [
+                {
+                    'start': ms_to_datetime(prev[1] + step).strftime('%Y-%m-%d %H:%M'),
+                    'end': ms_to_datetime(current[0] - step).strftime('%Y-%m-%d %H:%M')
+                }
+                for prev, current in zip(segments, segments[1:])
+            ]
+            data.append({
+                'symbol': symbol,
+                'timeframe': timeframe,
+                'start_date': first_time.strftime('%Y-%m-%d'),
+                'end_date': last_time.strftime('%Y-%m-%d'),
+                'candles_count': candles_count,
+                'gaps': gaps
+            })
+        return data
+
+
+# Создаем глобальный экземпляр
+coverage_catalog = CoverageCatalog()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='Обслуживание каталога покрытия candle_coverage')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    recompute_parser = subparsers.add_parser('recompute', help='Пересчитать каталог по candles')
+    recompute_parser.add_argument('--symbol', default=None)
+    recompute_parser.add_argument('--timeframe', default=None)
+
+    subparsers.add_parser('show', help='Показать каталог')
+
+    args = parser.parse_args()
+
+    if args.command == 'recompute':
+        count = coverage_catalog.recompute(args.symbol, args.timeframe)
+        print(f"Пересчитано рядов: {count}")
+    else:
+        for item in coverage_catalog.get_coverage():
+            print(f"{item['symbol']:<16} {item['timeframe']:<4} {item['start_date']} - {item['end_date']} "
+                  f"{item['candles_count']:>10} свечей, пропусков: {len(item['gaps'])}")
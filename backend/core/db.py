@@ -0,0 +1,252 @@
+"""
+Модуль общего пула подключений к PostgreSQL
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+import psycopg2
+from psycopg2.pool import PoolError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Настройки подключения к PostgreSQL
+DB_CONFIG = {
+    'host': os.getenv('POSTGRES_HOST', 'localhost'),
+    'port': int(os.getenv('POSTGRES_PORT', 5432)),
+    'database': os.getenv('POSTGRES_DATABASE', 'backtrader'),
+    'user': os.getenv('POSTGRES_USER'),
+    'password': os.getenv('POSTGRES_PASSWORD')
+}
+
+# Размер пула на процесс (воркер gunicorn)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+# Сколько ждать свободного подключения, прежде чем вернуть ошибку
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# Подключение, простоявшее дольше этого времени, проверяется SELECT 1 перед выдачей
+DB_POOL_HEALTHCHECK_SECONDS = float(os.getenv('DB_POOL_HEALTHCHECK_SECONDS', 30))
+
+# Подключения родительского процесса, унаследованные через fork. Ссылки держим до конца
+# процесса и никогда не закрываем: закрытие отправило бы Terminate по общему сокету
+# и оборвало бы сессию родителя
+_inherited_connections = []
+
+
+class Database:
+    """
+    Класс общего пула подключений
+
+    Пул создается лениво и заново в каждом процессе: после fork (gunicorn,
+    пул бэктестов) подключения родителя остаются в _inherited_connections и
+    не используются и не закрываются в дочернем процессе. Подключение
+    выдается через контекстный менеджер connection(): при выходе транзакция
+    фиксируется (или откатывается при ошибке), а подключение возвращается в
+    пул. Возвращенные подключения остаются открытыми (не больше maxconn).
+    """
+
+    def __init__(self, config: Dict[str, Any] = None, minconn: int = DB_POOL_MIN, maxconn: int = DB_POOL_MAX):
+        self.config = config or DB_CONFIG
+        self.minconn = minconn
+        self.maxconn = max(maxconn, minconn, 1)
+        self._pid = None
+        self._idle = []
+        self._connections = set()
+        self._slots = None
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._reset_metrics()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _reset_metrics(self):
+        self.metrics = {
+            'acquired': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'in_use': 0,
+        }
+
+    def _after_fork(self):
+        """Забывает пул родителя в дочернем процессе (вызывается сразу после fork)"""
+        _inherited_connections.extend(self._connections)
+        self._pid = None
+        self._idle = []
+        self._connections = set()
+        self._last_used = {}
+        # Блокировки могли быть захвачены потоками родителя, которых в дочернем процессе нет
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.config)
+        self._count('created')
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def _close(self, conn):
+        self._last_used.pop(id(conn), None)
+        with self._lock:
+            self._connections.discard(conn)
+        if not conn.closed:
+            conn.close()
+
+    def _ensure_pool(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+            # Первое обращение в процессе; подключения родителя, если fork прошел без _after_fork, не закрываем
+            _inherited_connections.extend(self._connections)
+            self._idle = []
+            self._connections = set()
+            self._last_used = {}
+            self._slots = threading.BoundedSemaphore(self.maxconn)
+            self._reset_metrics()
+            self._pid = pid
+
+        for _ in range(self.minconn):
+            conn = self._connect()
+            with self._lock:
+                self._idle.append(conn)
+        logger.info(f"🔌 Пул подключений PostgreSQL создан (pid {pid}, {self.minconn}-{self.maxconn})")
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < DB_POOL_HEALTHCHECK_SECONDS:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _count(self, name: str, value: float = 1):
+        with self._metrics_lock:
+            self.metrics[name] += value
+
+    def _acquire(self):
+        self._ensure_pool()
+        started = time.monotonic()
+        # Семафор ограничивает выдачу maxconn подключениями и дает ждать, а не падать с PoolError
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            self._count('timeouts')
+            raise PoolError(f"Нет свободных подключений за {DB_POOL_TIMEOUT} сек (пул {self.maxconn})")
+
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                # Свободных нет - открываем новое подключение (семафор держит общее число в maxconn)
+                if conn is None:
+                    conn = self._connect()
+                if self._is_healthy(conn):
+                    break
+                logger.warning("⚠️ Подключение к PostgreSQL не прошло проверку, пересоздаем")
+                self._count('discarded')
+                self._close(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - started
+        with self._metrics_lock:
+            self.metrics['acquired'] += 1
+            self.metrics['in_use'] += 1
+            self.metrics['wait_seconds'] += waited
+            self.metrics['max_wait_seconds'] = max(self.metrics['max_wait_seconds'], waited)
+        return conn
+
+    def _release(self, conn):
+        pid = self._pid
+        try:
+            broken = conn.closed != 0
+            if not broken:
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+                # Возвращаем настройки сессии, которые мог поменять вызывающий код
+                if conn.autocommit or conn.readonly is not None or conn.isolation_level is not None:
+                    conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT', autocommit=False)
+            if pid != os.getpid() or conn not in self._connections:
+                # Подключение выдано до fork - в этом процессе его не трогаем
+                pass
+            elif broken:
+                self._count('discarded')
+                self._close(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._count('in_use', -1)
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Выдает подключение из пула
+
+        Пример:
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                ...
+                conn.commit()
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            self._release(conn)
+
+    def healthcheck(self) -> Dict[str, Any]:
+        """Проверяет доступность БД и возвращает метрики пула"""
+        started = time.monotonic()
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        return {'ok': True, 'latency_ms': round((time.monotonic() - started) * 1000, 2), **self.stats()}
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики пула текущего процесса"""
+        current = self._pid == os.getpid()
+        acquired = self.metrics['acquired']
+        return {
+            'pid': os.getpid(),
+            'min': self.minconn,
+            'max': self.maxconn,
+            'open': len(self._connections) if current else 0,
+            'idle': len(self._idle) if current else 0,
+            **self.metrics,
+            'wait_seconds': round(self.metrics['wait_seconds'], 4),
+            'avg_wait_ms': round(self.metrics['wait_seconds'] / acquired * 1000, 3) if acquired else 0.0,
+        }
+
+
+# Создаем глобальный экземпляр
+db = Database()
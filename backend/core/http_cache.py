@@ -0,0 +1,152 @@
+"""
+Модуль условного HTTP кэширования ответов API (ETag / Last-Modified, 304 Not Modified)
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Optional, Dict, Any
+from flask import request, Response
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Объем кэша готовых ответов на процесс (воркер gunicorn)
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+HTTP_CACHE_ENABLED = os.getenv('HTTP_CACHE_ENABLED', '1') == '1'
+# Ответы крупнее этой доли объема не кэшируются, чтобы один запрос не вытеснял все остальные
+HTTP_CACHE_MAX_ENTRY_FRACTION = 0.25
+
+
+class HttpCache:
+    """
+    Класс условных ответов для редко меняющихся данных
+
+    Эндпоинт передает дешевый валидатор (версию данных: время обновления
+    каталога покрытия, mtime файлов и т.п.) и функцию построения ответа.
+    По валидатору и параметрам запроса считается ETag: если он совпал с
+    If-None-Match клиента, отдается 304 без тела, иначе ответ берется из LRU
+    (ограниченного по байтам) или строится заново.
+    """
+
+    def __init__(self, max_bytes: int = HTTP_CACHE_MAX_BYTES, enabled: bool = HTTP_CACHE_ENABLED):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def make_etag(*parts) -> str:
+        """Слабый ETag по параметрам запроса и версии данных (тело может сжиматься gzip)"""
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:32]
+        return f'W/"{digest}"'
+
+    def _is_not_modified(self, etag: str, last_modified: Optional[datetime]) -> bool:
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            # Сравнение ETag слабое: W/"x" и "x" считаются одинаковыми
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            return '*' in tags or etag.removeprefix('W/') in tags
+
+        if last_modified is not None and request.if_modified_since is not None:
+            return last_modified.replace(microsecond=0) <= request.if_modified_since
+        return False
+
+    def _get(self, etag: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is not None:
+                self._entries.move_to_end(etag)
+            return entry
+
+    def _put(self, etag: str, response: Response):
+        body = response.get_data()
+        if len(body) > self.max_bytes * HTTP_CACHE_MAX_ENTRY_FRACTION:
+            return
+
+        entry = {
+            'body': body,
+            'mimetype': response.mimetype,
+            'headers': [(key, value) for key, value in response.headers.items()
+                        if key.lower() not in ('content-length', 'content-type')]
+        }
+        with self._lock:
+            previous = self._entries.pop(etag, None)
+            if previous is not None:
+                self._size -= len(previous['body'])
+            self._entries[etag] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted['body'])
+
+    def respond(self, key: tuple, validator, build: Callable[[], Any],
+                last_modified: Optional[datetime] = None):
+        """
+        Возвращает 304, ответ из кэша или новый ответ с ETag/Last-Modified
+
+        Args:
+            key: Эндпоинт и параметры запроса, от которых зависит тело
+            validator: Версия данных (любое значение с repr)
+            build: Функция, строящая ответ (Response или (Response, status))
+            last_modified: Время последнего изменения данных (UTC) или None
+
+        Returns:
+            Ответ Flask
+        """
+        etag = self.make_etag(key, validator)
+        if last_modified is not None and last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+        if self._is_not_modified(etag, last_modified):
+            self.not_modified += 1
+            response = Response(status=304)
+        else:
+            entry = self._get(etag) if self.enabled else None
+            if entry is not None:
+                self.hits += 1
+                response = Response(entry['body'], mimetype=entry['mimetype'], headers=entry['headers'])
+            else:
+                self.misses += 1
+                response = build()
+                if isinstance(response, tuple) or response.status_code != 200:
+                    # Ошибки не кэшируются и не получают валидаторов
+                    return response
+                if self.enabled:
+                    self._put(etag, response)
+
+        response.set_etag(etag.removeprefix('W/').strip('"'), weak=etag.startswith('W/'))
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # Браузер хранит ответ, но перед использованием проверяет его условным запросом
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша текущего процесса"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+            }
+
+
+# Создаем глобальный экземпляр
+http_cache = HttpCache()
@@ -0,0 +1,465 @@
+"""
+Модуль фоновых задач загрузки исторических данных
+"""
+import os
+import uuid
+import logging
+import threading
+import psycopg2
+import psycopg2.extras
+from typing import Dict, Any, Optional, List
+from dotenv import load_dotenv
+from .db import db
+from .binance_data_loader import binance_data_loader
+from .batch_ingestion import batch_ingestor
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Сколько задач одновременно выполняет один процесс
+MAX_RUNNING_JOBS = int(os.getenv('INGESTION_MAX_RUNNING_JOBS', 1))
+# Задача в статусе running без heartbeat дольше этого времени считается брошенной
+JOB_STALE_SECONDS = int(os.getenv('INGESTION_JOB_STALE_SECONDS', 180))
+# Как часто проверять брошенные и ожидающие задачи
+WATCHDOG_INTERVAL = int(os.getenv('INGESTION_WATCHDOG_INTERVAL', 60))
+# Как часто выполняющаяся задача обновляет heartbeat (независимо от длительности периода)
+HEARTBEAT_INTERVAL = int(os.getenv('INGESTION_HEARTBEAT_INTERVAL', 30))
+
+JOB_PARAMS = ('kind', 'symbol', 'timeframe', 'period', 'start_date', 'end_date',
+              'only_missing', 'offline', 'concurrency',
+              'symbols', 'symbol_pattern', 'symbol_filters', 'timeframes', 'workers')
+
+
+class IngestionJobManager:
+    """
+    Класс для управления фоновыми задачами загрузки
+
+    Состояние задач хранится в таблице ingestion_jobs, поэтому статус
+    доступен из любого воркера, а после перезапуска задача продолжается
+    с последнего завершенного периода.
+    """
+
+    def __init__(self):
+        self._slots = threading.BoundedSemaphore(MAX_RUNNING_JOBS)
+        self._schema_ready = False
+        self._watchdog = None
+        self._lock = threading.Lock()
+        # Задачи, для которых в этом процессе уже есть поток (выполняется или ждет слот)
+        self._active = set()
+
+    def get_connection(self):
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
+
+    def ensure_schema(self):
+        """Создает таблицу ingestion_jobs, если ее нет"""
+        if self._schema_ready:
+            return
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                    id BIGSERIAL PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    params JSONB NOT NULL,
+                    periods JSONB,
+                    completed JSONB NOT NULL DEFAULT '[]',
+                    total_periods INTEGER NOT NULL DEFAULT 0,
+                    completed_periods INTEGER NOT NULL DEFAULT 0,
+                    failed_periods INTEGER NOT NULL DEFAULT 0,
+                    skipped_periods INTEGER NOT NULL DEFAULT 0,
+                    inserted BIGINT NOT NULL DEFAULT 0,
+                    duplicates BIGINT NOT NULL DEFAULT 0,
+                    message TEXT,
+                    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    started_at TIMESTAMPTZ,
+                    finished_at TIMESTAMPTZ,
+                    heartbeat_at TIMESTAMPTZ
+                )
+            """)
+            cursor.execute("ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS result JSONB")
+            cursor.execute("ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS claim_token TEXT")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ingestion_jobs_status_idx
+                ON ingestion_jobs (status, heartbeat_at)
+            """)
+            conn.commit()
+
+        self._schema_ready = True
+
+    def submit(self, params: Dict[str, Any]) -> int:
+        """
+        Ставит задачу загрузки в очередь и запускает ее в фоне
+
+        Args:
+            params: Параметры download_historical_data (symbol, timeframe, period, ...);
+                для kind='batch' - symbols или symbol_pattern/symbol_filters и timeframes
+
+        Returns:
+            int: ID задачи
+        """
+        self.ensure_schema()
+        job_params = {key: params.get(key) for key in JOB_PARAMS if params.get(key) is not None}
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO ingestion_jobs (params) VALUES (%s) RETURNING id",
+                (psycopg2.extras.Json(job_params),)
+            )
+            job_id = cursor.fetchone()[0]
+            conn.commit()
+
+        logger.info(f"📨 Задача загрузки #{job_id} поставлена в очередь: {job_params}")
+        self._start(job_id)
+        self.start_watchdog()
+        return job_id
+
+    def _start(self, job_id: int):
+        with self._lock:
+            if job_id in self._active:
+                return
+            self._active.add(job_id)
+        thread = threading.Thread(target=self._run, args=(job_id,),
+                                  name=f'ingestion-job-{job_id}', daemon=True)
+        thread.start()
+
+    def _claim(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Атомарно переводит задачу в running
+
+        Забрать можно задачу в очереди или брошенную (без heartbeat). Каждый
+        захват выдает новый claim_token: прогресс и итог пишет только его
+        владелец, поэтому вытесненный прогон останавливается, а одну задачу
+        никогда не выполняют два воркера одновременно.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("""
+                UPDATE ingestion_jobs
+                SET status = 'running',
+                    started_at = COALESCE(started_at, now()),
+                    heartbeat_at = now(),
+                    claim_token = %s
+                WHERE id = %s
+                    AND NOT cancel_requested
+                    AND (status = 'queued'
+                         OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => %s)))
+                RETURNING params, periods, completed, skipped_periods, claim_token
+            """, (uuid.uuid4().hex, job_id, JOB_STALE_SECONDS))
+            job = cursor.fetchone()
+            conn.commit()
+        return job
+
+    def _run(self, job_id: int):
+        """Выполняет задачу в фоновом потоке"""
+        try:
+            with self._slots:
+                job = self._claim(job_id)
+                if job is None:
+                    return
+                token = job['claim_token']
+
+                # heartbeat идет по таймеру: длинный архив или повторы с backoff не делают задачу брошенной
+                stop = threading.Event()
+                heartbeat = threading.Thread(target=self._heartbeat_loop, args=(job_id, token, stop),
+                                             name=f'ingestion-heartbeat-{job_id}', daemon=True)
+                heartbeat.start()
+                try:
+                    self._execute(job_id, job)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка задачи загрузки #{job_id}: {e}")
+                    self._finish(job_id, token, 'failed', str(e))
+                finally:
+                    stop.set()
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска задачи загрузки #{job_id}: {e}")
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _heartbeat_loop(self, job_id: int, token: str, stop: threading.Event):
+        """Обновляет heartbeat задачи, пока она выполняется и принадлежит этому прогону"""
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                with self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("""
+                        UPDATE ingestion_jobs SET heartbeat_at = now()
+                        WHERE id = %s AND claim_token = %s AND status = 'running'
+                    """, (job_id, token))
+                    owned = cursor.rowcount > 0
+                    conn.commit()
+                if not owned:
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось обновить heartbeat задачи загрузки #{job_id}: {e}")
+
+    def _save_plan(self, job_id: int, token: str, periods: List[list], skipped: int):
+        """Фиксирует план задачи, чтобы при возобновлении он не менялся"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE ingestion_jobs
+                SET periods = %s, total_periods = %s, skipped_periods = %s
+                WHERE id = %s AND claim_token = %s
+            """, (psycopg2.extras.Json(periods), len(periods), skipped, job_id, token))
+            conn.commit()
+
+    def _execute(self, job_id: int, job: Dict[str, Any]):
+        if job['params'].get('kind') == 'batch':
+            self._execute_batch(job_id, job)
+            return
+
+        params = job['params']
+        periods = job['periods']
+        token = job['claim_token']
+
+        if periods is None:
+            planned, skipped = binance_data_loader.plan_download(
+                params['symbol'], params['timeframe'], params['period'],
+                params['start_date'], params['end_date'], params.get('only_missing', False)
+            )
+            periods = [list(p) for p in planned]
+            self._save_plan(job_id, token, periods, skipped)
+
+        completed = set(job['completed'] or [])
+        remaining = [p for p in periods if f"{p[0]}/{p[1]}" not in completed]
+        if completed:
+            logger.info(f"⏯️ Задача #{job_id}: возобновление, осталось {len(remaining)} из {len(periods)} периодов")
+
+        def on_period(period_stats: dict) -> bool:
+            key = f"{period_stats['type']}/{period_stats['period']}"
+            return self._record_progress(job_id, token, key, period_stats)
+
+        success, message, stats = binance_data_loader.download_historical_data(
+            symbol=params['symbol'],
+            timeframe=params['timeframe'],
+            period=params['period'],
+            start_date=params['start_date'],
+            end_date=params['end_date'],
+            concurrency=params.get('concurrency'),
+            offline=params.get('offline'),
+            periods=remaining,
+            progress_callback=on_period
+        )
+
+        stats.pop('periods', None)
+        self._finish_with_stats(job_id, token, success, message, stats)
+
+    def _execute_batch(self, job_id: int, job: Dict[str, Any]):
+        """Выполняет пакетную задачу по нескольким символам и таймфреймам"""
+        params = job['params']
+        periods = job['periods']
+        token = job['claim_token']
+
+        if periods is None:
+            symbols = batch_ingestor.resolve_symbols(params.get('symbols'), params.get('symbol_pattern'),
+                                                     params.get('symbol_filters'))
+            series_plan, skipped = batch_ingestor.plan(
+                symbols, params['timeframes'], params['period'],
+                params['start_date'], params['end_date'], params.get('only_missing', True)
+            )
+            periods = [[symbol, timeframe, period_type, date]
+                       for symbol, timeframe, series_periods in series_plan
+                       for period_type, date in series_periods]
+            self._save_plan(job_id, token, periods, skipped)
+
+        completed = set(job['completed'] or [])
+        series = {}
+        for symbol, timeframe, period_type, date in periods:
+            if f"{symbol}/{timeframe}/{period_type}/{date}" not in completed:
+                series.setdefault((symbol, timeframe), []).append((period_type, date))
+        series_plan = [(symbol, timeframe, series_periods)
+                       for (symbol, timeframe), series_periods in series.items()]
+
+        def on_period(symbol: str, timeframe: str, period_stats: dict) -> bool:
+            key = f"{symbol}/{timeframe}/{period_stats['type']}/{period_stats['period']}"
+            return self._record_progress(job_id, token, key, period_stats)
+
+        success, message, stats = batch_ingestor.run(
+            series_plan, params['period'], params['start_date'], params['end_date'],
+            workers=params.get('workers'),
+            concurrency=params.get('concurrency'),
+            offline=params.get('offline'),
+            progress_callback=on_period
+        )
+        self._finish_with_stats(job_id, token, success, message, stats)
+
+    def _finish_with_stats(self, job_id: int, token: str, success: bool, message: str, stats: dict):
+        if not success:
+            self._finish(job_id, token, 'failed', message, stats)
+        elif stats.get('cancelled'):
+            self._finish(job_id, token, 'cancelled', message, stats)
+        else:
+            self._finish(job_id, token, 'done', message, stats)
+
+    def _record_progress(self, job_id: int, token: str, key: str, period_stats: dict) -> bool:
+        """
+        Сохраняет результат периода и обновляет heartbeat
+
+        Returns:
+            bool: False, если задачу попросили отменить или ее забрал другой прогон
+        """
+        ok = period_stats.get('status') == 'ok'
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE ingestion_jobs
+                SET completed_periods = completed_periods + %s,
+                    failed_periods = failed_periods + %s,
+                    inserted = inserted + %s,
+                    duplicates = duplicates + %s,
+                    completed = CASE WHEN %s THEN completed || %s ELSE completed END,
+                    heartbeat_at = now()
+                WHERE id = %s AND claim_token = %s
+                RETURNING cancel_requested
+            """, (
+                1 if ok else 0,
+                0 if ok else 1,
+                period_stats.get('inserted', 0),
+                period_stats.get('duplicates', 0),
+                ok,
+                psycopg2.extras.Json([key]),
+                job_id,
+                token
+            ))
+            row = cursor.fetchone()
+            conn.commit()
+
+        if row is None:
+            logger.warning(f"⚠️ Задачу загрузки #{job_id} забрал другой прогон - останавливаемся")
+            return False
+        return not row[0]
+
+    def _finish(self, job_id: int, token: str, status: str, message: str, result: Optional[dict] = None):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE ingestion_jobs
+                SET status = %s, message = %s, result = %s, finished_at = now(), heartbeat_at = now()
+                WHERE id = %s AND claim_token = %s
+            """, (status, message, psycopg2.extras.Json(result) if result is not None else None, job_id, token))
+            owned = cursor.rowcount > 0
+            conn.commit()
+        if not owned:
+            logger.warning(f"⚠️ Задача загрузки #{job_id}: итог прогона не сохранен - задачу забрал другой прогон")
+            return
+        logger.info(f"🏁 Задача загрузки #{job_id}: {status} - {message}")
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Запрашивает отмену задачи
+
+        Задача в очереди отменяется сразу, выполняющаяся - после текущего периода.
+
+        Returns:
+            bool: True, если задача найдена и еще не завершена
+        """
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE ingestion_jobs
+                SET cancel_requested = TRUE,
+                    status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                    finished_at = CASE WHEN status = 'queued' THEN now() ELSE finished_at END
+                WHERE id = %s AND status IN ('queued', 'running')
+                RETURNING id
+            """, (job_id,))
+            found = cursor.fetchone() is not None
+            conn.commit()
+        return found
+
+    def _serialize(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        job = dict(row)
+        for key in ('created_at', 'started_at', 'finished_at', 'heartbeat_at'):
+            if job.get(key) is not None:
+                job[key] = job[key].isoformat()
+        total = job.get('total_periods') or 0
+        done = (job.get('completed_periods') or 0) + (job.get('failed_periods') or 0)
+        job['progress'] = round(100.0 * done / total, 1) if total else (100.0 if job['status'] == 'done' else 0.0)
+        return job
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает состояние задачи"""
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("""
+                SELECT id, status, params, total_periods, completed_periods, failed_periods,
+                       skipped_periods, inserted, duplicates, message, result, cancel_requested,
+                       created_at, started_at, finished_at, heartbeat_at
+                FROM ingestion_jobs
+                WHERE id = %s
+            """, (job_id,))
+            row = cursor.fetchone()
+        return self._serialize(row) if row else None
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Возвращает последние задачи"""
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("""
+                SELECT id, status, params, total_periods, completed_periods, failed_periods,
+                       skipped_periods, inserted, duplicates, message, cancel_requested,
+                       created_at, started_at, finished_at, heartbeat_at
+                FROM ingestion_jobs
+                ORDER BY id DESC
+                LIMIT %s
+            """, (limit,))
+            rows = cursor.fetchall()
+        return [self._serialize(row) for row in rows]
+
+    def resume_pending(self) -> int:
+        """
+        Запускает задачи из очереди и брошенные задачи (например, после рестарта)
+
+        Задачи, для которых в этом процессе уже есть поток, повторно не запускаются.
+
+        Returns:
+            int: Количество найденных задач
+        """
+        self.ensure_schema()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id FROM ingestion_jobs
+                WHERE NOT cancel_requested
+                    AND (status = 'queued'
+                         OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => %s)))
+                ORDER BY id
+            """, (JOB_STALE_SECONDS,))
+            job_ids = [row[0] for row in cursor.fetchall()]
+
+        for job_id in job_ids:
+            self._start(job_id)
+        return len(job_ids)
+
+    def start_watchdog(self):
+        """Запускает фоновую проверку брошенных задач (один раз на процесс)"""
+        with self._lock:
+            if self._watchdog is not None and self._watchdog.is_alive():
+                return
+            self._watchdog = threading.Thread(target=self._watchdog_loop,
+                                              name='ingestion-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def _watchdog_loop(self):
+        stop = threading.Event()
+        while not stop.wait(WATCHDOG_INTERVAL):
+            try:
+                found = self.resume_pending()
+                if found:
+                    logger.info(f"🔁 Найдено задач загрузки для возобновления: {found}")
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка проверки задач загрузки: {e}")
+
+
+# Создаем глобальный экземпляр
+ingestion_job_manager = IngestionJobManager()
@@ -0,0 +1,96 @@
+"""
+Модуль общих настроек Numba: дисковый кэш компиляции, типы записей и прогрев ядер
+
+Запуск: python -m backend.core.jit (компилирует ядра в кэш, например при сборке образа)
+"""
+import os
+import time
+import logging
+import numpy as np
+import numba
+from typing import Dict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Кэш скомпилированных ядер (cache=True); образ Docker запекает его в /opt/numba-cache (Dockerfile)
+NUMBA_CACHE_DIR = os.getenv('NUMBA_CACHE_DIR') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'cache', 'numba'
+)
+# Прогревать ядра при старте воркера (gunicorn.conf.py)
+NUMBA_WARMUP = os.getenv('NUMBA_WARMUP', '1') == '1'
+
+# numba читает NUMBA_CACHE_DIR при импорте, а путь кэша вычисляет при декорировании функции
+if not numba.config.CACHE_DIR:
+    numba.config.CACHE_DIR = NUMBA_CACHE_DIR
+
+# Запись сделки симулятора (индексы - номера баров)
+TRADE_DTYPE = np.dtype([
+    ('entry_idx', np.int64),
+    ('exit_idx', np.int64),
+    ('side', np.int64),          # 1 = long, -1 = short
+    ('size', np.float64),        # размер позиции в базовой валюте
+    ('entry_price', np.float64),
+    ('exit_price', np.float64),
+    ('entry_fees', np.float64),
+    ('exit_fees', np.float64),
+    ('pnl', np.float64),
+    ('exit_reason', np.int64),
+])
+TRADE_RECORD = numba.from_dtype(TRADE_DTYPE)
+
+# Типы аргументов для сигнатур ядер. Входные массивы объявлены только для чтения: такой
+# тип принимает и обычные массивы, и memory-mapped колонки из array_store, а layout 'A' -
+# и срезы блока DataFrame с шагом. Массивы записей из Python numba видит невыровненными
+FLOAT_ARRAY = numba.types.Array(numba.types.float64, 1, 'A', readonly=True)
+TRADE_RECORDS = numba.types.Array(TRADE_RECORD, 1, 'A', aligned=False)
+
+
+def warmup(parallel: bool = True) -> Dict[str, float]:
+    """
+    Загружает ядра из кэша (или компилирует их) и один раз вызывает на малых данных
+
+    Ядра объявлены с сигнатурами, поэтому компилируются уже при импорте;
+    вызов дополнительно поднимает пул потоков parallel ядер, чтобы первый
+    запрос пользователя не ждал ни LLVM, ни инициализации.
+
+    Args:
+        parallel: Вызывать parallel ядра. Процессу, который потом делает fork
+            (воркер gunicorn с пулом бэктестов), пул потоков Numba поднимать нельзя
+
+    Returns:
+        Dict[str, float]: Секунды на импорт и на первый вызов
+    """
+    started = time.perf_counter()
+    from . import trade_simulator
+    from .metrics_nb import compute_metrics
+    imported = time.perf_counter()
+
+    n = 16
+    close = np.linspace(100.0, 110.0, n)
+    signals = np.zeros(n)
+    signals[::4] = 1.0
+    exits = np.array([0.01, 0.02])
+    records = trade_simulator.simulate_trade_records_nb(signals, close, close * 1.01, close * 0.99, close,
+                                                        0.01, 0.002, 0.02, 100.0, 0.001, 1000.0)
+    compute_metrics(records, close, 1000.0, '1h')
+    trade_simulator.simulate_trades_nb(signals, close, close * 1.01, close * 0.99, close,
+                                       0.01, 0.0, 0.02, 100.0, 0.001, 1000.0)
+    if parallel:
+        trade_simulator.simulate_trades_batch_nb(signals, close, close * 1.01, close * 0.99, close,
+                                                 exits, exits, exits, 100.0, 0.001, 1000.0)
+        trade_simulator.simulate_metrics_batch_nb(signals, close, close * 1.01, close * 0.99, close,
+                                                  exits, exits, exits, 100.0, 0.001, 1000.0, 8760.0, True)
+    finished = time.perf_counter()
+
+    timings = {'import_seconds': round(imported - started, 3), 'first_call_seconds': round(finished - imported, 3)}
+    logger.info(f"🔥 Ядра Numba готовы (pid {os.getpid()}): импорт {timings['import_seconds']} сек, "
+                f"первый вызов {timings['first_call_seconds']} сек, кэш {numba.config.CACHE_DIR}")
+    return timings
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    print(warmup())
@@ -0,0 +1,132 @@
+"""
+Numba-расчет метрик бэктеста по записям сделок симулятора (без vectorbt)
+"""
+import math
+import numpy as np
+from numba import njit, types
+from typing import Dict, Iterable, Optional
+from .timeframes import TIMEFRAME_SECONDS
+from .jit import TRADE_RECORDS, FLOAT_ARRAY
+
+# Порядок метрик в строке результата trade_metrics_nb
+METRIC_NAMES = ('total_return', 'profit', 'final_value', 'win_rate', 'trades_count',
+                'sharpe_ratio', 'max_drawdown')
+# Метрики, которым нужна кривая капитала по барам (остальные считаются только по сделкам)
+EQUITY_METRICS = {'sharpe_ratio', 'max_drawdown'}
+
+M_TOTAL_RETURN = 0
+M_PROFIT = 1
+M_FINAL_VALUE = 2
+M_WIN_RATE = 3
+M_TRADES_COUNT = 4
+M_SHARPE_RATIO = 5
+M_MAX_DRAWDOWN = 6
+
+
+def periods_per_year(timeframe: str) -> float:
+    """Количество свечей таймфрейма в году (для годового Sharpe)"""
+    seconds = TIMEFRAME_SECONDS.get(timeframe)
+    return 365 * 24 * 60 * 60 / seconds if seconds else 12
+
+
+@njit(types.void(TRADE_RECORDS, types.int64, FLOAT_ARRAY, types.float64, types.float64,
+                 types.boolean, types.float64[:]), cache=True)
+def trade_metrics_nb(records, count, close_arr, initial_cash, annual_periods, with_equity, out):
+    """
+    Считает метрики по первым count записям сделок в out (порядок METRIC_NAMES)
+
+    PnL, доходность и win rate берутся из сделок (открытая сделка уже
+    оценена по последнему close и в win rate не входит). Sharpe и просадка
+    требуют прохода по барам: капитал = кэш + позиция * close; считаются
+    только при with_equity. Размер сделок уже ограничен кэшем симулятором.
+    """
+    total_pnl = 0.0
+    closed = 0
+    wins = 0
+    for k in range(count):
+        total_pnl += records[k].pnl
+        if records[k].exit_reason != 0:
+            closed += 1
+            if records[k].pnl > 0:
+                wins += 1
+
+    final_value = initial_cash + total_pnl
+    out[M_TOTAL_RETURN] = (final_value / initial_cash - 1) * 100
+    out[M_PROFIT] = total_pnl
+    out[M_FINAL_VALUE] = final_value
+    out[M_WIN_RATE] = wins / closed * 100 if closed > 0 else 0.0
+    out[M_TRADES_COUNT] = count
+    out[M_SHARPE_RATIO] = 0.0
+    out[M_MAX_DRAWDOWN] = 0.0
+    if not with_equity:
+        return
+
+    n = len(close_arr)
+    cash = initial_cash
+    position = 0.0
+    prev_equity = initial_cash
+    peak = -np.inf
+    max_drawdown = 0.0
+    # Доходности по барам - онлайн среднее и дисперсия (Welford)
+    mean = 0.0
+    m2 = 0.0
+    j = 0
+    for i in range(n):
+        if j < count:
+            record = records[j]
+            if position != 0.0 and record.exit_idx == i and record.exit_reason != 0:
+                cash += record.side * record.size * record.exit_price - record.exit_fees
+                position = 0.0
+                j += 1
+                if j < count:
+                    record = records[j]
+            if position == 0.0 and j < count and record.entry_idx == i:
+                cash -= record.side * record.size * record.entry_price + record.entry_fees
+                position = record.side * record.size
+
+        equity = cash + position * close_arr[i]
+        if equity > peak:
+            peak = equity
+        drawdown = 1 - equity / peak
+        if drawdown > max_drawdown:
+            max_drawdown = drawdown
+
+        # Доходность первого бара считается от начального капитала (как в vectorbt)
+        ret = equity / prev_equity - 1
+        prev_equity = equity
+        delta = ret - mean
+        mean += delta / (i + 1)
+        m2 += delta * (ret - mean)
+
+    if n > 1 and m2 > 0:
+        sharpe = mean / math.sqrt(m2 / (n - 1)) * math.sqrt(annual_periods)
+        out[M_SHARPE_RATIO] = sharpe if math.isfinite(sharpe) else 0.0
+    out[M_MAX_DRAWDOWN] = max_drawdown * 100 if math.isfinite(max_drawdown) else 0.0
+
+
+def compute_metrics(records: np.ndarray, close: np.ndarray, initial_cash: float, timeframe: str,
+                    metrics: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """
+    Возвращает запрошенные метрики по записям сделок
+
+    Args:
+        records: Записи сделок (simulate_trade_records_nb)
+        close: Цены закрытия по барам
+        initial_cash: Начальный капитал
+        timeframe: Таймфрейм (для годового Sharpe)
+        metrics: Имена метрик из METRIC_NAMES (по умолчанию все)
+
+    Returns:
+        Dict[str, float]: Метрика -> значение
+    """
+    names = list(metrics) if metrics is not None else list(METRIC_NAMES)
+    unknown = set(names) - set(METRIC_NAMES)
+    if unknown:
+        raise ValueError(f"Неизвестные метрики: {', '.join(sorted(unknown))}")
+
+    out = np.zeros(len(METRIC_NAMES))
+    trade_metrics_nb(records, len(records), np.asarray(close, dtype=np.float64), float(initial_cash),
+                     periods_per_year(timeframe), bool(EQUITY_METRICS & set(names)), out)
+    values = dict(zip(METRIC_NAMES, out.tolist()))
+    values['trades_count'] = int(values['trades_count'])
+    return {name: values[name] for name in names}
@@ -0,0 +1,296 @@
+"""
+Модуль перебора параметров стратегии на пуле процессов
+
+Запуск: python -m backend.core.param_sweep --symbol BTCUSDT --timeframe 1h --start 2024-01-01 --end 2024-06-01
+        --strategy-module str.my_strategy --strategy-class MyStrategy --grid '{"take_profit": [0.01, 0.02]}'
+"""
+import os
+import math
+import time
+import itertools
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+from dotenv import load_dotenv
+from .metrics_nb import periods_per_year, METRIC_NAMES
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Процессов в пуле (по умолчанию - все ядра)
+SWEEP_WORKERS = int(os.getenv('SWEEP_WORKERS', 0)) or os.cpu_count() or 1
+# Ограничение размера сетки за один запрос
+SWEEP_MAX_COMBINATIONS = int(os.getenv('SWEEP_MAX_COMBINATIONS', 100000))
+# Сколько лучших комбинаций возвращать по умолчанию
+SWEEP_TOP = int(os.getenv('SWEEP_TOP', 100))
+
+# Метрики, по которым можно ранжировать; для просадки лучше меньшее значение
+RANK_METRICS = ('total_return', 'profit', 'sharpe_ratio', 'win_rate', 'max_drawdown', 'trades_count')
+RANK_ASCENDING = {'max_drawdown'}
+
+# Данные, переданные в процесс пула один раз через initializer
+_worker_data = {}
+
+
+def expand_grid(grid: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Раскрывает сетку параметров в список комбинаций
+
+    Args:
+        grid: {имя: [значения]} или {имя: {'start': a, 'stop': b, 'step': c}} (stop включительно)
+
+    Returns:
+        List[Dict[str, Any]]: Все комбинации
+
+    Raises:
+        ValueError: Неверное описание диапазона или слишком большая сетка
+    """
+    names = []
+    values = []
+    for name, spec in grid.items():
+        if isinstance(spec, dict):
+            start, stop, step = float(spec['start']), float(spec['stop']), float(spec['step'])
+            if step <= 0 or stop < start:
+                raise ValueError(f"Неверный диапазон {name}: {spec}")
+            count = int(math.floor((stop - start) / step + 1e-9)) + 1
+            # Округление убирает хвосты float (0.1 + 0.2 = 0.30000000000000004)
+            spec = [round(start + i * step, 10) for i in range(count)]
+            if all(isinstance(spec_value, int) for spec_value in (grid[name]['start'], grid[name]['step'])):
+                spec = [int(value) for value in spec]
+        elif not isinstance(spec, (list, tuple)):
+            spec = [spec]
+        if not spec:
+            raise ValueError(f"Пустой список значений {name}")
+        names.append(name)
+        values.append(list(spec))
+
+    total = math.prod(len(v) for v in values)
+    if total > SWEEP_MAX_COMBINATIONS:
+        raise ValueError(f"Слишком много комбинаций: {total} (максимум {SWEEP_MAX_COMBINATIONS})")
+
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def _init_worker(data: Dict[str, Any]):
+    """Сохраняет свечи в процессе пула (передаются один раз, а не с каждой задачей)"""
+    _worker_data.clear()
+    _worker_data.update(data)
+    if data.get('numba_threads'):
+        # Параллелизм уже дают процессы пула - ядра не делим повторно потоками numba
+        import numba
+        numba.set_num_threads(data['numba_threads'])
+
+
+def _run_chunk(combos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Прогоняет пачку комбинаций с общими сигнальными параметрами в процессе пула
+
+    Сигналы считаются один раз, а параметры выхода всех комбинаций
+    симулируются пакетным ядром simulate_metrics_batch_nb сразу в метрики.
+    """
+    from strategies import get_strategy_class
+    from .trade_simulator import simulate_metrics_batch
+
+    data = _worker_data
+    df = data['df']
+    StrategyClass = get_strategy_class(data['strategy_module'], data['strategy_class'])
+    open_arr = df['open'].values
+    high_arr = df['high'].values
+    low_arr = df['low'].values
+    close_arr = df['close'].values
+
+    params = {**data['base_params'], **combos[0]}
+    try:
+        df_sar = data['sar_frames'].get(params.get('sar_timeframe', ''))
+        signals = StrategyClass(**params).generate_signals(df, df_sar).values.astype(np.float64)
+        exits = np.empty((len(combos), 3))
+        for k, combo in enumerate(combos):
+            exit_params = StrategyClass(**{**data['base_params'], **combo}).get_exit_params()
+            exits[k] = (exit_params['take_profit'], exit_params.get('trail_offset', 0), exit_params['stop_loss'])
+    except Exception as e:
+        return [{'params': combo, 'error': str(e)} for combo in combos]
+
+    metrics = simulate_metrics_batch(
+        signals, open_arr, high_arr, low_arr, close_arr,
+        exits[:, 0], exits[:, 1], exits[:, 2],
+        params.get('quote', data['initial_cash']), data['commission'],
+        data['initial_cash'], data['annual_periods'], True
+    )
+    results = []
+    for combo, row in zip(combos, metrics.tolist()):
+        values = dict(zip(METRIC_NAMES, row))
+        values['trades_count'] = int(values['trades_count'])
+        results.append({'params': combo, **{name: values[name] for name in RANK_METRICS}})
+    return results
+
+
+def _signal_key(combo: Dict[str, Any], exit_names) -> tuple:
+    """Ключ сигнальных параметров комбинации (без параметров выхода)"""
+    return tuple(sorted((name, repr(value)) for name, value in combo.items() if name not in exit_names))
+
+
+class ParamSweep:
+    """
+    Класс перебора параметров стратегии
+
+    Свечи (и SAR таймфреймы всех комбинаций) загружаются один раз в текущем
+    процессе и передаются процессам пула при их запуске. Комбинации
+    группируются по сигнальным параметрам (все, кроме EXIT_PARAMS стратегии):
+    задача пула считает сигналы группы один раз и прогоняет все ее параметры
+    выхода пакетным симулятором.
+    """
+
+    def run(self, symbol: str, timeframe: str, start_date: str, end_date: str,
+            strategy_module: str, strategy_class: str, grid: Dict[str, Any],
+            base_params: Optional[Dict[str, Any]] = None, initial_cash: float = 100.0,
+            commission: float = 0.0005, workers: Optional[int] = None,
+            rank_by: str = 'total_return', top: Optional[int] = None,
+            numba_threads: Optional[int] = None,
+            cancel_check: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        """
+        Перебирает сетку параметров и возвращает таблицу метрик, отсортированную по rank_by
+
+        Args:
+            symbol: Символ
+            timeframe: Таймфрейм
+            start_date: Дата начала
+            end_date: Дата конца
+            strategy_module: Модуль стратегии (как в /api/backtest)
+            strategy_class: Класс стратегии
+            grid: Сетка параметров (см. expand_grid)
+            base_params: Фиксированные параметры стратегии
+            initial_cash: Начальный капитал
+            commission: Комиссия в долях
+            workers: Процессов в пуле (по умолчанию SWEEP_WORKERS)
+            rank_by: Метрика ранжирования (RANK_METRICS)
+            top: Сколько лучших комбинаций вернуть (по умолчанию SWEEP_TOP)
+            numba_threads: Потоков Numba при workers=1 (по умолчанию - все ядра)
+            cancel_check: Флаг отмены (очередь бэктестов), проверяется между пачками при workers=1
+
+        Returns:
+            Dict[str, Any]: success, results (или error) и статистика перебора
+        """
+        from strategies import get_strategy_class
+        from .binance_data_loader import binance_data_loader
+        from .backtest_runner import backtest_runner
+
+        if rank_by not in RANK_METRICS:
+            return {'success': False, 'error': f'Неизвестная метрика ранжирования: {rank_by}'}
+        try:
+            combos = expand_grid(grid)
+        except (KeyError, TypeError, ValueError) as e:
+            return {'success': False, 'error': f'Неверная сетка параметров: {e}'}
+        StrategyClass = get_strategy_class(strategy_module, strategy_class)
+        if not StrategyClass:
+            return {'success': False, 'error': f'Стратегия {strategy_class} не найдена'}
+
+        started = time.monotonic()
+        base_params = base_params or {}
+
+        df = binance_data_loader.load_data_for_backtest(symbol, timeframe, start_date, end_date)
+        if df is None or df.empty:
+            return {'success': False, 'error': 'Нет данных для указанного периода'}
+
+        # SAR таймфреймы всех комбинаций загружаем заранее
+        sar_frames = {}
+        for sar_timeframe in {combo.get('sar_timeframe', base_params.get('sar_timeframe', '')) for combo in combos}:
+            df_sar = backtest_runner.load_sar_data(df, symbol, timeframe, sar_timeframe, start_date, end_date)
+            if df_sar is not None:
+                sar_frames[sar_timeframe] = df_sar
+
+        data = {
+            'df': df,
+            'sar_frames': sar_frames,
+            'strategy_module': strategy_module,
+            'strategy_class': strategy_class,
+            'base_params': base_params,
+            'initial_cash': float(initial_cash),
+            'commission': float(commission),
+            'annual_periods': periods_per_year(timeframe),
+        }
+
+        # Комбинации, отличающиеся только параметрами выхода, делят одни сигналы
+        exit_names = set(getattr(StrategyClass, 'EXIT_PARAMS', ()))
+        groups = {}
+        for combo in combos:
+            groups.setdefault(_signal_key(combo, exit_names), []).append(combo)
+
+        workers = max(1, min(int(workers or SWEEP_WORKERS), len(combos)))
+        # По несколько пачек на процесс, чтобы медленные комбинации не держали весь пул
+        chunk_size = max(1, math.ceil(len(combos) / (workers * 4)))
+        chunks = [group[i:i + chunk_size] for group in groups.values() for i in range(0, len(group), chunk_size)]
+        workers = min(workers, len(chunks))
+        data['numba_threads'] = 1 if workers > 1 else numba_threads
+        logger.info(f"🔎 Перебор {len(combos)} комбинаций ({len(groups)} наборов сигналов): "
+                    f"{symbol} {timeframe}, {len(df)} свечей, процессов: {workers}")
+
+        if workers == 1:
+            _init_worker(data)
+            results = []
+            last_check = time.monotonic()
+            for chunk in chunks:
+                # Флаг отмены читается из БД - не чаще раза в секунду
+                if cancel_check and time.monotonic() - last_check >= 1:
+                    last_check = time.monotonic()
+                    if cancel_check():
+                        logger.info("⏹️ Перебор отменен")
+                        return {'success': False, 'cancelled': True, 'error': 'Перебор отменен'}
+                results.extend(_run_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as pool:
+                results = [row for chunk_results in pool.map(_run_chunk, chunks) for row in chunk_results]
+
+        failed = [row for row in results if 'error' in row]
+        ranked = sorted((row for row in results if 'error' not in row),
+                        key=lambda row: row[rank_by], reverse=rank_by not in RANK_ASCENDING)
+        elapsed = time.monotonic() - started
+        logger.info(f"✅ Перебор завершен за {elapsed:.1f} сек, ошибок: {len(failed)}")
+
+        return {
+            'success': True,
+            'combinations': len(combos),
+            'failed': len(failed),
+            'errors': failed[:10],
+            'rank_by': rank_by,
+            'candles': len(df),
+            'workers': workers,
+            'elapsed_seconds': round(elapsed, 3),
+            'results': ranked[:top or SWEEP_TOP],
+        }
+
+
+# Создаем глобальный экземпляр
+param_sweep = ParamSweep()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='Перебор параметров стратегии')
+    parser.add_argument('--symbol', required=True)
+    parser.add_argument('--timeframe', required=True)
+    parser.add_argument('--start', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--strategy-module', required=True, help='Например str.my_strategy')
+    parser.add_argument('--strategy-class', required=True)
+    parser.add_argument('--grid', required=True, help='JSON сетки: {"take_profit": [0.01, 0.02], ...}')
+    parser.add_argument('--params', default='{}', help='JSON фиксированных параметров')
+    parser.add_argument('--cash', type=float, default=100.0)
+    parser.add_argument('--commission', type=float, default=0.0005, help='Комиссия в долях')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--rank-by', default='total_return', choices=RANK_METRICS)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    result = param_sweep.run(args.symbol, args.timeframe, args.start, args.end,
+                             args.strategy_module, args.strategy_class, json.loads(args.grid),
+                             base_params=json.loads(args.params), initial_cash=args.cash,
+                             commission=args.commission, workers=args.workers,
+                             rank_by=args.rank_by, top=args.top)
+    print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+    raise SystemExit(0 if result['success'] else 1)
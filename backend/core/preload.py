@@ -0,0 +1,69 @@
+"""
+Модуль предзагрузки тяжелых модулей в мастере gunicorn (preload_app)
+
+Модули, импортированные в мастере до fork, воркеры получают готовыми:
+страницы памяти общие (copy-on-write), а воркер стартует без импорта.
+Эндпоинты авторизации, страниц и символов эти модули не импортируют,
+поэтому без preload они загружаются только при первом бэктесте.
+"""
+import os
+import time
+import logging
+import importlib
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Тяжелые модули в порядке загрузки; ядра Numba берутся из дискового кэша (backend.core.jit)
+HEAVY_MODULES = (
+    'pandas',
+    'backend.core.trade_simulator',
+    'backend.core.metrics_nb',
+    'backend.core.backtest_runner',
+    'backend.core.param_sweep',
+    'pandas_ta',
+    'vectorbt',
+)
+# Модули, без которых приложение работает: индикаторы для стратегий и движок vectorbt
+OPTIONAL_MODULES = {'pandas_ta', 'vectorbt'}
+
+
+def heavy_modules():
+    """Список модулей для предзагрузки (vectorbt - только если его использует BACKTEST_ENGINE)"""
+    engine = os.getenv('BACKTEST_ENGINE', 'native')
+    return [name for name in HEAVY_MODULES if name != 'vectorbt' or engine in ('vectorbt', 'both')]
+
+
+def preload_modules(modules=None) -> Dict[str, Optional[float]]:
+    """
+    Импортирует модули и замеряет время импорта каждого
+
+    Args:
+        modules: Имена модулей (по умолчанию heavy_modules())
+
+    Returns:
+        Dict[str, Optional[float]]: Модуль -> секунды на импорт (None - не установлен)
+    """
+    timings = {}
+    for name in modules if modules is not None else heavy_modules():
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            if name not in OPTIONAL_MODULES:
+                raise
+            logger.info(f"ℹ️ {name} не установлен, пропускаем: {e}")
+            timings[name] = None
+            continue
+        timings[name] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+def format_timings(timings: Dict[str, Optional[float]]) -> str:
+    """Строка отчета: общее время и время каждого модуля"""
+    total = sum(seconds for seconds in timings.values() if seconds)
+    parts = ', '.join(f"{name} {'-' if seconds is None else seconds}" for name, seconds in timings.items())
+    return f"{round(total, 3)} сек ({parts})"
@@ -0,0 +1,56 @@
+"""
+Модуль ограничения частоты запросов к Binance
+"""
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Общий лимит запросов к data.binance.vision на все воркеры gunicorn. Ограничитель живет
+# в каждом процессе, поэтому процесс получает долю лимита (gunicorn.conf.py выставляет
+# GUNICORN_WORKERS); отдельный процесс (CLI batch_ingestion) использует лимит целиком
+GUNICORN_WORKERS = max(1, int(os.getenv('GUNICORN_WORKERS', 1)))
+REQUESTS_PER_SECOND = float(os.getenv('BINANCE_REQUESTS_PER_SECOND', 20)) / GUNICORN_WORKERS
+BURST = max(1, int(os.getenv('BINANCE_REQUESTS_BURST', 40)) // GUNICORN_WORKERS)
+
+
+class RateLimiter:
+    """Потокобезопасный token bucket: rate запросов в секунду с запасом burst"""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, burst: int = BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.total_acquired = 0
+        self.total_wait = 0.0
+
+    def acquire(self):
+        """Блокирует поток, пока не появится свободный токен"""
+        if self.rate <= 0:
+            return
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.total_acquired += 1
+                    self.total_wait += waited
+                    return
+
+                delay = (1 - self._tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+
+# Создаем глобальный экземпляр (общий для всех загрузок процесса, доля общего лимита)
+binance_rate_limiter = RateLimiter()
@@ -0,0 +1,192 @@
+"""
+Модуль агрегации свечей в старшие таймфреймы на NumPy
+"""
+import os
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from .timeframes import TIMEFRAME_SECONDS, TIMEFRAME_OFFSETS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Сколько агрегированных рядов держать в памяти процесса
+RESAMPLE_CACHE_SIZE = int(os.getenv('RESAMPLE_CACHE_SIZE', 32))
+
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+
+def can_resample(source_tf: str, target_tf: str) -> bool:
+    """
+    Проверяет, можно ли собрать target_tf из свечей source_tf
+
+    Границы свечей source_tf должны совпадать с границами target_tf:
+    длительность делится нацело, а 1mo собирается из таймфреймов не старше 1d.
+    """
+    if source_tf not in TIMEFRAME_SECONDS or target_tf not in TIMEFRAME_SECONDS or source_tf == target_tf:
+        return False
+
+    source_seconds = TIMEFRAME_SECONDS[source_tf]
+    target_seconds = TIMEFRAME_SECONDS[target_tf]
+    if source_seconds is None:
+        return False
+    if target_seconds is None:
+        return 86400 % source_seconds == 0
+
+    offset_delta = TIMEFRAME_OFFSETS.get(target_tf, 0) - TIMEFRAME_OFFSETS.get(source_tf, 0)
+    return (target_seconds > source_seconds and target_seconds % source_seconds == 0
+            and offset_delta % source_seconds == 0)
+
+
+def source_timeframes(target_tf: str) -> List[str]:
+    """Таймфреймы, из которых можно собрать target_tf, от старшего к младшему"""
+    candidates = [tf for tf in TIMEFRAME_SECONDS if can_resample(tf, target_tf)]
+    return sorted(candidates, key=lambda tf: TIMEFRAME_SECONDS[tf], reverse=True)
+
+
+def bucket_starts(time_ms: np.ndarray, target_tf: str) -> np.ndarray:
+    """Возвращает время открытия свечи target_tf (мс) для каждой исходной свечи"""
+    seconds = TIMEFRAME_SECONDS[target_tf]
+    if seconds is None:
+        months = time_ms.astype('datetime64[ms]').astype('datetime64[M]')
+        return months.astype('datetime64[ms]').astype(np.int64)
+
+    period_ms = seconds * 1000
+    offset_ms = TIMEFRAME_OFFSETS.get(target_tf, 0) * 1000
+    return (time_ms - offset_ms) // period_ms * period_ms + offset_ms
+
+
+def bucket_ends(buckets: np.ndarray, target_tf: str) -> np.ndarray:
+    """Возвращает время открытия следующей свечи target_tf (мс) для времени открытия buckets"""
+    seconds = TIMEFRAME_SECONDS[target_tf]
+    if seconds is None:
+        months = buckets.astype('datetime64[ms]').astype('datetime64[M]') + 1
+        return months.astype('datetime64[ms]').astype(np.int64)
+    return buckets + seconds * 1000
+
+
+def resample_arrays(time_ms: np.ndarray, open_arr: np.ndarray, high_arr: np.ndarray,
+                    low_arr: np.ndarray, close_arr: np.ndarray, volume_arr: np.ndarray,
+                    target_tf: str, source_tf: Optional[str] = None) -> Tuple[np.ndarray, ...]:
+    """
+    Агрегирует отсортированные по времени свечи в target_tf за один проход
+
+    Границы групп находятся по изменению номера свечи target_tf, а OHLCV
+    считаются через reduceat: open - первая, close - последняя, high/low -
+    экстремумы группы, volume - сумма.
+
+    Если задан source_tf, неполные крайние свечи отбрасываются: первая, если
+    ряд начинается не с ее открытия (неделя с середины), и последняя, если ряд
+    заканчивается раньше ее закрытия. Таких свечей нет среди хранимых.
+
+    Returns:
+        Tuple[np.ndarray, ...]: (time_ms, open, high, low, close, volume)
+    """
+    empty = np.empty(0, dtype=np.float64)
+    if len(time_ms) == 0:
+        return np.empty(0, dtype=np.int64), empty, empty, empty, empty, empty
+
+    time_ms = np.asarray(time_ms, dtype=np.int64)
+    buckets = bucket_starts(time_ms, target_tf)
+    starts = np.concatenate(([0], np.flatnonzero(buckets[1:] != buckets[:-1]) + 1))
+    ends = np.concatenate((starts[1:], [len(buckets)])) - 1
+
+    if source_tf is not None:
+        first = 0 if time_ms[0] == buckets[0] else 1
+        source_ms = TIMEFRAME_SECONDS[source_tf] * 1000
+        last = len(starts) if time_ms[-1] + source_ms >= bucket_ends(buckets[-1:], target_tf)[0] \
+            else len(starts) - 1
+        starts, ends = starts[first:last], ends[first:last]
+        if len(starts) == 0:
+            return np.empty(0, dtype=np.int64), empty, empty, empty, empty, empty
+
+    # reduceat сворачивает последнюю группу до конца массива - отрезаем отброшенный хвост
+    stop = ends[-1] + 1
+    return (
+        buckets[starts],
+        np.asarray(open_arr, dtype=np.float64)[starts],
+        np.maximum.reduceat(np.asarray(high_arr[:stop], dtype=np.float64), starts),
+        np.minimum.reduceat(np.asarray(low_arr[:stop], dtype=np.float64), starts),
+        np.asarray(close_arr, dtype=np.float64)[ends],
+        np.add.reduceat(np.asarray(volume_arr[:stop], dtype=np.float64), starts),
+    )
+
+
+class Resampler:
+    """
+    Класс для получения старших таймфреймов из уже загруженных свечей
+
+    Результаты кэшируются (LRU) по (symbol, исходный tf, целевой tf, период)
+    вместе с отпечатком исходного ряда. Свечи в candles только добавляются,
+    поэтому количество строк и границы ряда однозначно определяют его содержимое.
+    """
+
+    def __init__(self, max_entries: int = RESAMPLE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resample_df(self, df, source_tf: str, target_tf: str, symbol: Optional[str] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None):
+        """
+        Агрегирует DataFrame свечей (индекс datetime, колонки OHLCV) в target_tf
+
+        Args:
+            df: Свечи source_tf
+            source_tf: Исходный таймфрейм
+            target_tf: Целевой таймфрейм
+            symbol, start_date, end_date: Ключ кэша (без symbol результат не кэшируется)
+
+        Returns:
+            pd.DataFrame: Свечи target_tf с индексом datetime (UTC)
+        """
+        import pandas as pd
+
+        if not can_resample(source_tf, target_tf):
+            raise ValueError(f"Нельзя собрать {target_tf} из {source_tf}")
+
+        index = df.index if df.index.tz is not None else df.index.tz_localize('UTC')
+        time_ms = np.asarray(index.as_unit('ms').asi8, dtype=np.int64)
+
+        key = None
+        if symbol and len(time_ms):
+            key = (symbol, source_tf, target_tf, start_date, end_date,
+                   len(time_ms), int(time_ms[0]), int(time_ms[-1]))
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return cached.copy()
+                self.misses += 1
+
+        columns = resample_arrays(time_ms, *(df[name].values for name in PRICE_COLUMNS), target_tf, source_tf)
+        result = pd.DataFrame(
+            dict(zip(PRICE_COLUMNS, columns[1:])),
+            index=pd.DatetimeIndex(pd.to_datetime(columns[0], unit='ms', utc=True), name='datetime')
+        )
+        logger.info(f"🧮 Агрегировано {len(df)} свечей {source_tf} в {len(result)} свечей {target_tf}")
+
+        if key is not None:
+            with self._lock:
+                self._cache[key] = result
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            return result.copy()
+        return result
+
+    def clear(self):
+        """Очищает кэш агрегированных рядов"""
+        with self._lock:
+            self._cache.clear()
+
+
+# Создаем глобальный экземпляр
+resampler = Resampler()
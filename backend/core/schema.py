@@ -0,0 +1,242 @@
+"""
+Модуль создания и настройки схемы БД (candles как гипертаблица TimescaleDB)
+
+Запуск: python -m backend.core.schema [--status]
+"""
+import os
+import logging
+from typing import Dict, Any, List
+from dotenv import load_dotenv
+from .db import db
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Размер чанка гипертаблицы candles
+CANDLES_CHUNK_INTERVAL = os.getenv('CANDLES_CHUNK_INTERVAL', '7 days')
+# Чанки старше этого возраста сжимаются политикой TimescaleDB
+CANDLES_COMPRESS_AFTER = os.getenv('CANDLES_COMPRESS_AFTER', '30 days')
+CANDLES_COMPRESSION_ENABLED = os.getenv('CANDLES_COMPRESSION_ENABLED', '1') == '1'
+
+# Индекс под WHERE symbol = ? AND timeframe = ? AND time BETWEEN ... ORDER BY time
+# (он же нужен для ON CONFLICT (symbol, timeframe, time) в загрузчике)
+CANDLES_KEY_COLUMNS = ['symbol', 'timeframe', 'time']
+
+
+class SchemaManager:
+    """Класс для создания таблиц и настройки TimescaleDB"""
+
+    def get_connection(self):
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
+
+    def _timescale_available(self, cursor) -> bool:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb'")
+        return cursor.fetchone() is not None
+
+    def _timescale_installed(self, cursor) -> bool:
+        """Расширение создано в БД (до migrate схемы timescaledb_information еще нет)"""
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")
+        return cursor.fetchone() is not None
+
+    def _is_hypertable(self, cursor) -> bool:
+        cursor.execute("""
+            SELECT 1 FROM timescaledb_information.hypertables
+            WHERE hypertable_schema = 'public' AND hypertable_name = 'candles'
+        """)
+        return cursor.fetchone() is not None
+
+    def _compression_enabled(self, cursor) -> bool:
+        cursor.execute("""
+            SELECT compression_enabled FROM timescaledb_information.hypertables
+            WHERE hypertable_schema = 'public' AND hypertable_name = 'candles'
+        """)
+        row = cursor.fetchone()
+        return bool(row and row[0])
+
+    def _unique_indexes(self, cursor) -> List[List[str]]:
+        """Возвращает колонки всех уникальных индексов candles"""
+        cursor.execute("""
+            SELECT array_agg(a.attname ORDER BY k.ord)
+            FROM pg_index i
+            CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            WHERE i.indrelid = 'public.candles'::regclass AND i.indisunique
+            GROUP BY i.indexrelid
+        """)
+        return [list(row[0]) for row in cursor.fetchall()]
+
+    def create_base_tables(self, cursor):
+        """Создает таблицы приложения, если их нет"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS candles (
+                time TIMESTAMPTZ NOT NULL,
+                symbol TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                open DOUBLE PRECISION,
+                high DOUBLE PRECISION,
+                low DOUBLE PRECISION,
+                close DOUBLE PRECISION,
+                volume DOUBLE PRECISION
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS binance_symbols (
+                symbol TEXT PRIMARY KEY,
+                notional NUMERIC,
+                msg_data JSONB
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS current_trades (
+                id SERIAL PRIMARY KEY,
+                run_id BIGINT,
+                entry_date TIMESTAMPTZ,
+                entry_price DOUBLE PRECISION,
+                entry_size DOUBLE PRECISION,
+                side TEXT,
+                exit_date TIMESTAMPTZ,
+                exit_price DOUBLE PRECISION,
+                pnl DOUBLE PRECISION,
+                pnl_percent DOUBLE PRECISION,
+                commission DOUBLE PRECISION,
+                bars_held INTEGER,
+                mae DOUBLE PRECISION,
+                mfe DOUBLE PRECISION,
+                trade_history JSONB
+            )
+        """)
+
+    def ensure_candles_index(self, cursor):
+        """Создает составной уникальный индекс (symbol, timeframe, time), если его еще нет"""
+        if CANDLES_KEY_COLUMNS in self._unique_indexes(cursor):
+            return
+        logger.info("🔧 Создание индекса candles (symbol, timeframe, time)")
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS candles_symbol_timeframe_time_idx
+            ON candles (symbol, timeframe, time DESC)
+        """)
+
+    def ensure_hypertable(self, cursor):
+        """Переводит candles в гипертаблицу, разбитую на чанки по времени"""
+        if not self._is_hypertable(cursor):
+            logger.info(f"🔧 Создание гипертаблицы candles (чанк {CANDLES_CHUNK_INTERVAL})")
+            cursor.execute("""
+                SELECT create_hypertable('candles', 'time',
+                                         chunk_time_interval => %s::interval,
+                                         create_default_indexes => FALSE,
+                                         if_not_exists => TRUE,
+                                         migrate_data => TRUE)
+            """, (CANDLES_CHUNK_INTERVAL,))
+        else:
+            # Применяется к новым чанкам
+            cursor.execute("SELECT set_chunk_time_interval('candles', %s::interval)", (CANDLES_CHUNK_INTERVAL,))
+
+    def ensure_compression(self, cursor):
+        """
+        Включает нативное сжатие: сегменты по (symbol, timeframe), порядок по time
+
+        Запрос одного ряда за период распаковывает только его сегмент в нужных
+        чанках, а политика сжимает чанки старше CANDLES_COMPRESS_AFTER.
+        """
+        if not self._compression_enabled(cursor):
+            logger.info("🔧 Включение сжатия candles (segmentby symbol, timeframe)")
+            cursor.execute("""
+                ALTER TABLE candles SET (
+                    timescaledb.compress,
+                    timescaledb.compress_segmentby = 'symbol, timeframe',
+                    timescaledb.compress_orderby = 'time DESC'
+                )
+            """)
+        cursor.execute("SELECT add_compression_policy('candles', %s::interval, if_not_exists => TRUE)",
+                       (CANDLES_COMPRESS_AFTER,))
+
+    def migrate(self) -> Dict[str, Any]:
+        """
+        Приводит схему БД к актуальному виду (идемпотентно)
+
+        Returns:
+            Dict[str, Any]: Что было настроено
+        """
+        result = {'timescaledb': False, 'hypertable': False, 'compression': False}
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self.create_base_tables(cursor)
+            self.ensure_candles_index(cursor)
+
+            if self._timescale_available(cursor):
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS timescaledb")
+                result['timescaledb'] = True
+                self.ensure_hypertable(cursor)
+                result['hypertable'] = True
+                if CANDLES_COMPRESSION_ENABLED:
+                    self.ensure_compression(cursor)
+                    result['compression'] = True
+            else:
+                logger.warning("⚠️ Расширение timescaledb недоступно, candles остается обычной таблицей")
+
+            conn.commit()
+
+        # Таблицы остальных модулей
+        from .ingestion_jobs import ingestion_job_manager
+        from .coverage_catalog import coverage_catalog
+        from .backtest_jobs import backtest_job_manager
+        from .backtest_results import backtest_results_manager
+        from .backtest_memo import backtest_memo
+        ingestion_job_manager.ensure_schema()
+        backtest_job_manager.ensure_schema()
+        backtest_results_manager.ensure_schema()
+        backtest_memo.ensure_schema()
+        # Сверка каталога покрытия с candles (в том числе после загрузок до его заполнения)
+        result['coverage_series'] = coverage_catalog.recompute()
+
+        logger.info(f"✅ Схема БД актуальна: {result}")
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        """Возвращает состояние гипертаблицы candles: чанки и степень сжатия"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            status = {'unique_indexes': self._unique_indexes(cursor)}
+
+            if not self._timescale_installed(cursor) or not self._is_hypertable(cursor):
+                status['hypertable'] = False
+                return status
+
+            status['hypertable'] = True
+            status['compression_enabled'] = self._compression_enabled(cursor)
+            cursor.execute("""
+                SELECT COUNT(*), COUNT(*) FILTER (WHERE is_compressed)
+                FROM timescaledb_information.chunks
+                WHERE hypertable_name = 'candles'
+            """)
+            status['chunks'], status['compressed_chunks'] = cursor.fetchone()
+            cursor.execute("""
+                SELECT before_compression_total_bytes, after_compression_total_bytes
+                FROM hypertable_compression_stats('candles')
+            """)
+            row = cursor.fetchone()
+            if row and row[0]:
+                status['before_compression_bytes'], status['after_compression_bytes'] = row
+            return status
+
+
+# Создаем глобальный экземпляр
+schema_manager = SchemaManager()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='Создание и настройка схемы БД')
+    parser.add_argument('--status', action='store_true', help='Только показать состояние candles')
+    args = parser.parse_args()
+
+    if not args.status:
+        schema_manager.migrate()
+    for key, value in schema_manager.status().items():
+        print(f"{key}: {value}")
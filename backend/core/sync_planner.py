@@ -0,0 +1,125 @@
+"""
+Модуль планирования инкрементальной загрузки: определяет, каких периодов не хватает в candles
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from .db import db
+from .timeframes import expected_bars
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class SyncPlanner:
+    """Класс для поиска отсутствующих и неполных периодов в таблице candles"""
+
+    def get_connection(self):
+        """Выдает подключение из общего пула (with ... as conn)"""
+        return db.connection()
+
+    def period_bounds(self, period_type: str, date: str) -> Tuple[datetime, datetime]:
+        """
+        Возвращает границы периода архива [начало, конец)
+
+        Args:
+            period_type: 'daily' или 'monthly'
+            date: 'YYYY-MM-DD' или 'YYYY-MM'
+        """
+        if period_type == 'daily':
+            start = datetime.strptime(date, '%Y-%m-%d')
+            return start, start + timedelta(days=1)
+
+        start = datetime.strptime(date, '%Y-%m')
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        return start, start.replace(month=start.month + 1)
+
+    def get_daily_counts(self, symbol: str, timeframe: str,
+                         start: datetime, end: datetime) -> Dict[str, int]:
+        """
+        Считает количество свечей по UTC дням в интервале [start, end)
+
+        Args:
+            start: Начало интервала (наивная UTC дата)
+            end: Конец интервала, не включительно (наивная UTC дата)
+
+        Returns:
+            Dict[str, int]: {'YYYY-MM-DD': количество свечей}
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Наивные даты сравнивались бы с timestamptz в часовом поясе сессии,
+            # поэтому передаем границы явно в UTC
+            cursor.execute("""
+                SELECT
+                    floor(EXTRACT(EPOCH FROM time) / 86400)::bigint AS day,
+                    COUNT(*)
+                FROM candles
+                WHERE symbol = %s
+                    AND timeframe = %s
+                    AND time >= %s
+                    AND time < %s
+                GROUP BY day
+            """, (symbol, timeframe,
+                  start.replace(tzinfo=timezone.utc), end.replace(tzinfo=timezone.utc)))
+            rows = cursor.fetchall()
+
+        epoch = datetime(1970, 1, 1)
+        return {
+            (epoch + timedelta(days=int(day))).strftime('%Y-%m-%d'): count
+            for day, count in rows
+        }
+
+    def plan(self, symbol: str, timeframe: str,
+             periods: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], Dict[str, dict]]:
+        """
+        Оставляет только периоды, для которых в candles нет полного набора свечей
+
+        Период считается полным, если количество свечей в нем не меньше
+        ожидаемого по таймфрейму. Незавершенные периоды (текущий день или месяц)
+        всегда считаются неполными.
+
+        Args:
+            symbol: Символ
+            timeframe: Таймфрейм
+            periods: Список (тип периода 'daily'/'monthly', дата) из generate_download_plan
+
+        Returns:
+            Tuple[List[Tuple[str, str]], Dict[str, dict]]: (периоды к загрузке, покрытие по каждому периоду)
+        """
+        if not periods:
+            return [], {}
+
+        bounds = {date: self.period_bounds(period_type, date) for period_type, date in periods}
+        range_start = min(start for start, _ in bounds.values())
+        range_end = max(end for _, end in bounds.values())
+
+        daily_counts = self.get_daily_counts(symbol, timeframe, range_start, range_end)
+        now = datetime.utcnow()
+
+        missing = []
+        coverage = {}
+        for period_type, date in periods:
+            start, end = bounds[date]
+
+            if period_type == 'daily':
+                existing = daily_counts.get(date, 0)
+            else:
+                existing = sum(count for day, count in daily_counts.items() if day.startswith(date))
+
+            expected = expected_bars(timeframe, start, end)
+            complete = end <= now and existing >= expected
+
+            coverage[date] = {'existing': existing, 'expected': expected, 'complete': complete}
+            if not complete:
+                missing.append((period_type, date))
+
+        logger.info(f"🧭 {symbol} {timeframe}: к загрузке {len(missing)} из {len(periods)} периодов")
+        return missing, coverage
+
+
+# Создаем глобальный экземпляр
+sync_planner = SyncPlanner()
@@ -0,0 +1,82 @@
+"""
+Вспомогательные функции для таймфреймов Binance
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+# Длительность свечи в секундах (1mo - календарный месяц, фиксированной длины нет)
+TIMEFRAME_SECONDS = {
+    '1m': 60,
+    '3m': 3 * 60,
+    '5m': 5 * 60,
+    '15m': 15 * 60,
+    '30m': 30 * 60,
+    '1h': 60 * 60,
+    '2h': 2 * 60 * 60,
+    '4h': 4 * 60 * 60,
+    '6h': 6 * 60 * 60,
+    '8h': 8 * 60 * 60,
+    '12h': 12 * 60 * 60,
+    '1d': 24 * 60 * 60,
+    '3d': 3 * 24 * 60 * 60,
+    '1w': 7 * 24 * 60 * 60,
+    '1mo': None,
+}
+
+# Смещение начала свечи относительно Unix epoch (недельные свечи Binance открываются в понедельник,
+# а 1970-01-01 - четверг)
+TIMEFRAME_OFFSETS = {
+    '1w': 4 * 24 * 60 * 60,
+}
+
+
+def timeframe_seconds(timeframe: str) -> Optional[int]:
+    """
+    Возвращает длительность свечи в секундах
+
+    Raises:
+        ValueError: Неизвестный таймфрейм
+    """
+    if timeframe not in TIMEFRAME_SECONDS:
+        raise ValueError(f"Неизвестный таймфрейм: {timeframe}")
+    return TIMEFRAME_SECONDS[timeframe]
+
+
+def to_epoch(dt: datetime) -> int:
+    """Переводит наивную UTC дату в Unix время (секунды)"""
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def expected_bars(timeframe: str, start: datetime, end: datetime) -> int:
+    """
+    Считает, сколько свечей открывается в интервале [start, end)
+
+    Args:
+        timeframe: Таймфрейм
+        start: Начало интервала (наивная UTC дата)
+        end: Конец интервала, не включительно (наивная UTC дата)
+
+    Returns:
+        int: Ожидаемое количество свечей
+    """
+    if end <= start:
+        return 0
+
+    seconds = timeframe_seconds(timeframe)
+
+    if seconds is None:
+        # Календарные месяцы: считаем начала месяцев внутри интервала
+        year, month = start.year, start.month
+        if start != datetime(year, month, 1):
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        count = 0
+        while datetime(year, month, 1) < end:
+            count += 1
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return count
+
+    offset = TIMEFRAME_OFFSETS.get(timeframe, 0)
+    start_ts = to_epoch(start) - offset
+    end_ts = to_epoch(end) - offset
+    # Количество кратных seconds значений в [start_ts, end_ts)
+    return (end_ts - 1) // seconds - (start_ts - 1) // seconds
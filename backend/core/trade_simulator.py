@@ -1,126 +1,366 @@
 """
 Numba-симулятор сделок с trailing take profit
+
+Ядра (*_nb) скомпилированы по сигнатурам только под float64: сигналы int или
+OHLC float32 они не принимают. Вызывающий код использует обертки без
+суффикса _nb - они приводят массивы и числа к float64.
 """
 import numpy as np
-from numba import njit
+from numba import njit, prange, types
+from .jit import TRADE_DTYPE, TRADE_RECORD, FLOAT_ARRAY
+from .metrics_nb import trade_metrics_nb, METRIC_NAMES
 
+# Причины выхода (открытая позиция оценивается по close последнего бара)
+EXIT_OPEN = 0
+EXIT_TAKE_PROFIT = 1
+EXIT_TRAILING_STOP = 2
+EXIT_STOP_LOSS = 3
+EXIT_REASONS = {
+    EXIT_OPEN: 'open',
+    EXIT_TAKE_PROFIT: 'take_profit',
+    EXIT_TRAILING_STOP: 'trailing_stop',
+    EXIT_STOP_LOSS: 'stop_loss',
+}
 
-@njit
-def simulate_trades_nb(direction_signals, open_arr, high_arr, low_arr, close_arr,
-                       tp_pct, trail_pct, sl_pct, quote_size):
+# Сигнатуры ядер: компиляция (или загрузка из кэша) при импорте, а не на первом запросе
+_OHLC = (FLOAT_ARRAY,) * 5
+_EXIT = (types.float64,) * 3
+_EXIT_ARRAYS = (FLOAT_ARRAY,) * 3
+
+# На сколько блоков делить комбинации в simulate_metrics_batch_nb. Константа, а не
+# numba.get_num_threads(): вызов внутри ядра запрещает его дисковый кэш. Буфер сделок
+# живет только внутри блока, поэтому память растет с числом потоков, а не блоков
+METRICS_BATCH_BLOCKS = 256
+
+
+@njit(cache=True)
+def _close_record(record, exit_idx, exit_price, fee_rate, exit_reason):
+    record.exit_idx = exit_idx
+    record.exit_price = exit_price
+    record.exit_fees = record.size * exit_price * fee_rate if exit_reason != EXIT_OPEN else 0.0
+    record.pnl = (record.side * record.size * (exit_price - record.entry_price)
+                  - record.entry_fees - record.exit_fees)
+    record.exit_reason = exit_reason
+
+
+@njit(cache=True)
+def _simulate_records_into(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                           tp_pct, trail_pct, sl_pct, quote_size, fee_rate, initial_cash, records):
     """
-    Симуляция торговли с точными ценами входа/выхода.
-    
-    Args:
-        direction_signals: 1=long, -1=short, 0=нет сигнала
-        open_arr, high_arr, low_arr, close_arr: OHLC данные
-        tp_pct: Take Profit в долях (0.07 = 7%)
-        trail_pct: Trail offset в долях (0.002 = 0.2%)
-        sl_pct: Stop Loss в долях (0.14 = 14%)
-        quote_size: Размер позиции в USDT
-        
+    Цикл симуляции: записывает сделки в records (емкость не меньше len // 2 + 1)
+
+    Общий для всех вариантов симулятора. Размер входа ограничен кэшем
+    (initial_cash + PnL закрытых сделок) с учетом комиссии, как частичное
+    исполнение в vbt.Portfolio.from_orders; без кэша сигнал пропускается.
+
     Returns:
-        order_size: массив размеров ордеров (+ buy, - sell)
-        order_price: массив цен исполнения
+        int: Количество записанных сделок (последняя может быть открытой)
     """
     n = len(close_arr)
-    
-    order_size = np.zeros(n)
-    order_price = np.full(n, np.nan)
-    
+    count = 0
+    cash = initial_cash
+
     in_position = False
     position_side = 0  # 1 = long, -1 = short
-    position_size = 0.0
     entry_price = 0.0
     max_price = 0.0
     min_price = 999999999.0
     trail_active = False
-    
+
     for i in range(n):
         # Проверяем выход (если в позиции)
         if in_position:
             exit_price = 0.0
-            
+            exit_reason = EXIT_OPEN
+
             if position_side == 1:  # Long
                 # Обновляем максимум
                 if high_arr[i] > max_price:
                     max_price = high_arr[i]
-                
+
                 tp_level = entry_price * (1 + tp_pct)
                 sl_level = entry_price * (1 - sl_pct)
-                
+
                 # Проверяем TP/Trailing
                 if trail_pct > 0:
                     # Trailing режим
                     if not trail_active and max_price >= tp_level:
                         trail_active = True
-                    
+
                     if trail_active:
                         trail_stop = max_price * (1 - trail_pct)
                         if low_arr[i] <= trail_stop:
                             exit_price = trail_stop
+                            exit_reason = EXIT_TRAILING_STOP
                 else:
                     # Обычный TP (без trailing)
                     if high_arr[i] >= tp_level:
                         exit_price = tp_level
-                
+                        exit_reason = EXIT_TAKE_PROFIT
+
                 # Проверяем SL
                 if exit_price == 0.0 and low_arr[i] <= sl_level:
                     exit_price = sl_level
-                    
+                    exit_reason = EXIT_STOP_LOSS
+
             else:  # Short
                 # Обновляем минимум
                 if low_arr[i] < min_price:
                     min_price = low_arr[i]
-                
+
                 tp_level = entry_price * (1 - tp_pct)
                 sl_level = entry_price * (1 + sl_pct)
-                
+
                 # Проверяем TP/Trailing
                 if trail_pct > 0:
                     # Trailing режим
                     if not trail_active and min_price <= tp_level:
                         trail_active = True
-                    
+
                     if trail_active:
                         trail_stop = min_price * (1 + trail_pct)
                         if high_arr[i] >= trail_stop:
                             exit_price = trail_stop
+                            exit_reason = EXIT_TRAILING_STOP
                 else:
                     # Обычный TP (без trailing)
                     if low_arr[i] <= tp_level:
                         exit_price = tp_level
-                
+                        exit_reason = EXIT_TAKE_PROFIT
+
                 # Проверяем SL
                 if exit_price == 0.0 and high_arr[i] >= sl_level:
                     exit_price = sl_level
-            
+                    exit_reason = EXIT_STOP_LOSS
+
             # Выход
             if exit_price > 0:
-                if position_side == 1:
-                    order_size[i] = -position_size  # Sell
-                else:
-                    order_size[i] = position_size   # Buy to cover
-                order_price[i] = exit_price
-                
+                _close_record(records[count], i, exit_price, fee_rate, exit_reason)
+                cash += records[count].pnl
+                count += 1
+
                 in_position = False
                 trail_active = False
                 continue  # Не входим на том же баре
-        
+
         # Проверяем вход
         if not in_position and direction_signals[i] != 0:
+            entry_value = min(quote_size, cash / (1 + fee_rate))
+            if entry_value <= 0:
+                continue
+
             in_position = True
-            position_side = direction_signals[i]
+            position_side = 1 if direction_signals[i] > 0 else -1
             entry_price = close_arr[i]
-            position_size = quote_size / entry_price
             max_price = high_arr[i]
             min_price = low_arr[i]
             trail_active = False
-            
-            if position_side == 1:
-                order_size[i] = position_size   # Buy
-            else:
-                order_size[i] = -position_size  # Sell short
-            order_price[i] = entry_price
-    
-    return order_size, order_price
\ No newline at end of file
+
+            record = records[count]
+            record.entry_idx = i
+            record.side = position_side
+            record.size = entry_value / entry_price
+            record.entry_price = entry_price
+            record.entry_fees = record.size * entry_price * fee_rate
+
+    # Незакрытая позиция - оцениваем по последнему close
+    if in_position:
+        _close_record(records[count], n - 1, close_arr[n - 1], fee_rate, EXIT_OPEN)
+        count += 1
+
+    return count
+
+
+@njit(TRADE_RECORD[::1](*_OHLC, *_EXIT, types.float64, types.float64, types.float64), cache=True)
+def simulate_trade_records_nb(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                              tp_pct, trail_pct, sl_pct, quote_size, fee_rate, initial_cash):
+    """
+    Симуляция торговли, возвращающая записи сделок.
+
+    Args:
+        direction_signals: 1=long, -1=short, 0=нет сигнала
+        open_arr, high_arr, low_arr, close_arr: OHLC данные
+        tp_pct: Take Profit в долях (0.07 = 7%)
+        trail_pct: Trail offset в долях (0.002 = 0.2%)
+        sl_pct: Stop Loss в долях (0.14 = 14%)
+        quote_size: Размер позиции в USDT
+        fee_rate: Комиссия в долях от объема сделки
+        initial_cash: Начальный капитал (ограничивает размер позиции)
+
+    Returns:
+        records: массив TRADE_DTYPE (вход/выход, цены, размер, комиссии, PnL, причина выхода)
+    """
+    records = np.empty(len(close_arr) // 2 + 1, dtype=TRADE_DTYPE)
+    count = _simulate_records_into(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                                   tp_pct, trail_pct, sl_pct, quote_size, fee_rate, initial_cash, records)
+    return records[:count].copy()
+
+
+@njit(cache=True)
+def _records_to_orders(records, count, order_size, order_price):
+    """Раскладывает сделки в ордера по барам (формат vbt.Portfolio.from_orders)"""
+    for k in range(count):
+        record = records[k]
+        order_size[record.entry_idx] = record.side * record.size
+        order_price[record.entry_idx] = record.entry_price
+        if record.exit_reason != EXIT_OPEN:
+            order_size[record.exit_idx] = -record.side * record.size
+            order_price[record.exit_idx] = record.exit_price
+
+
+@njit(types.UniTuple(types.float64[::1], 2)(*_OHLC, *_EXIT, types.float64, types.float64, types.float64),
+      cache=True)
+def simulate_trades_nb(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                       tp_pct, trail_pct, sl_pct, quote_size, fee_rate, initial_cash):
+    """
+    Симуляция торговли с точными ценами входа/выхода.
+
+    Args:
+        direction_signals: 1=long, -1=short, 0=нет сигнала
+        open_arr, high_arr, low_arr, close_arr: OHLC данные
+        tp_pct: Take Profit в долях (0.07 = 7%)
+        trail_pct: Trail offset в долях (0.002 = 0.2%)
+        sl_pct: Stop Loss в долях (0.14 = 14%)
+        quote_size: Размер позиции в USDT
+        fee_rate: Комиссия в долях (для ограничения позиции кэшем)
+        initial_cash: Начальный капитал
+
+    Returns:
+        order_size: массив размеров ордеров (+ buy, - sell)
+        order_price: массив цен исполнения
+    """
+    n = len(close_arr)
+
+    order_size = np.zeros(n)
+    order_price = np.full(n, np.nan)
+
+    records = np.empty(n // 2 + 1, dtype=TRADE_DTYPE)
+    count = _simulate_records_into(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                                   tp_pct, trail_pct, sl_pct, quote_size, fee_rate, initial_cash, records)
+    _records_to_orders(records, count, order_size, order_price)
+
+    return order_size, order_price
+
+
+@njit(types.UniTuple(types.float64[:, ::1], 2)(*_OHLC, *_EXIT_ARRAYS, types.float64, types.float64,
+                                                types.float64),
+      parallel=True, cache=True)
+def simulate_trades_batch_nb(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                             tp_arr, trail_arr, sl_arr, quote_size, fee_rate, initial_cash):
+    """
+    Пакетная симуляция: одни сигналы и OHLC, много наборов параметров выхода.
+
+    Комбинации распределяются по ядрам (prange), входные массивы общие,
+    а каждая комбинация пишет в свою строку результата.
+
+    Args:
+        direction_signals: 1=long, -1=short, 0=нет сигнала
+        open_arr, high_arr, low_arr, close_arr: OHLC данные
+        tp_arr: Take Profit каждой комбинации в долях
+        trail_arr: Trail offset каждой комбинации в долях
+        sl_arr: Stop Loss каждой комбинации в долях
+        quote_size: Размер позиции в USDT
+        fee_rate: Комиссия в долях (для ограничения позиции кэшем)
+        initial_cash: Начальный капитал
+
+    Returns:
+        order_size: матрица (комбинации x бары) размеров ордеров
+        order_price: матрица (комбинации x бары) цен исполнения
+    """
+    n_combos = len(tp_arr)
+    n = len(close_arr)
+
+    order_size = np.zeros((n_combos, n))
+    order_price = np.full((n_combos, n), np.nan)
+
+    for k in prange(n_combos):
+        records = np.empty(n // 2 + 1, dtype=TRADE_DTYPE)
+        count = _simulate_records_into(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                                       tp_arr[k], trail_arr[k], sl_arr[k], quote_size, fee_rate, initial_cash,
+                                       records)
+        _records_to_orders(records, count, order_size[k], order_price[k])
+
+    return order_size, order_price
+
+
+@njit(types.float64[:, ::1](*_OHLC, *_EXIT_ARRAYS, types.float64, types.float64,
+                            types.float64, types.float64, types.boolean),
+      parallel=True, cache=True)
+def simulate_metrics_batch_nb(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                              tp_arr, trail_arr, sl_arr, quote_size, fee_rate,
+                              initial_cash, annual_periods, with_equity):
+    """
+    Пакетная симуляция сразу в метрики (без матриц ордеров).
+
+    Комбинации делятся на блоки (METRICS_BATCH_BLOCKS), которые prange
+    распределяет по потокам; каждый блок переиспользует один буфер сделок,
+    поэтому память не зависит от размера сетки.
+
+    Args:
+        direction_signals, open_arr, high_arr, low_arr, close_arr: как в simulate_trades_batch_nb
+        tp_arr, trail_arr, sl_arr: Параметры выхода каждой комбинации в долях
+        quote_size: Размер позиции в USDT
+        fee_rate: Комиссия в долях
+        initial_cash: Начальный капитал
+        annual_periods: Баров в году (для Sharpe)
+        with_equity: Считать метрики по кривой капитала (Sharpe, просадка)
+
+    Returns:
+        metrics: матрица (комбинации x METRIC_NAMES)
+    """
+    n_combos = len(tp_arr)
+    n = len(close_arr)
+    metrics = np.zeros((n_combos, len(METRIC_NAMES)))
+
+    n_blocks = min(n_combos, METRICS_BATCH_BLOCKS)
+    for block in prange(n_blocks):
+        records = np.empty(n // 2 + 1, dtype=TRADE_DTYPE)
+        for k in range(block * n_combos // n_blocks, (block + 1) * n_combos // n_blocks):
+            count = _simulate_records_into(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                                           tp_arr[k], trail_arr[k], sl_arr[k], quote_size, fee_rate, initial_cash,
+                                           records)
+            trade_metrics_nb(records, count, close_arr, initial_cash, annual_periods, with_equity, metrics[k])
+
+    return metrics
+
+
+def _float_arrays(*arrays) -> tuple:
+    """Приводит массивы к float64 (без копии, если тип уже float64)"""
+    return tuple(np.asarray(values, dtype=np.float64) for values in arrays)
+
+
+def simulate_trade_records(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                           tp_pct, trail_pct, sl_pct, quote_size, fee_rate, initial_cash) -> np.ndarray:
+    """simulate_trade_records_nb для любых числовых массивов (Series, int, float32)"""
+    return simulate_trade_records_nb(
+        *_float_arrays(direction_signals, open_arr, high_arr, low_arr, close_arr),
+        float(tp_pct), float(trail_pct), float(sl_pct), float(quote_size), float(fee_rate), float(initial_cash)
+    )
+
+
+def simulate_trades(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                    tp_pct, trail_pct, sl_pct, quote_size, fee_rate, initial_cash) -> tuple:
+    """simulate_trades_nb для любых числовых массивов (Series, int, float32)"""
+    return simulate_trades_nb(
+        *_float_arrays(direction_signals, open_arr, high_arr, low_arr, close_arr),
+        float(tp_pct), float(trail_pct), float(sl_pct), float(quote_size), float(fee_rate), float(initial_cash)
+    )
+
+
+def simulate_trades_batch(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                          tp_arr, trail_arr, sl_arr, quote_size, fee_rate, initial_cash) -> tuple:
+    """simulate_trades_batch_nb для любых числовых массивов (Series, int, float32)"""
+    return simulate_trades_batch_nb(
+        *_float_arrays(direction_signals, open_arr, high_arr, low_arr, close_arr, tp_arr, trail_arr, sl_arr),
+        float(quote_size), float(fee_rate), float(initial_cash)
+    )
+
+
+def simulate_metrics_batch(direction_signals, open_arr, high_arr, low_arr, close_arr,
+                           tp_arr, trail_arr, sl_arr, quote_size, fee_rate,
+                           initial_cash, annual_periods, with_equity) -> np.ndarray:
+    """simulate_metrics_batch_nb для любых числовых массивов (Series, int, float32)"""
+    return simulate_metrics_batch_nb(
+        *_float_arrays(direction_signals, open_arr, high_arr, low_arr, close_arr, tp_arr, trail_arr, sl_arr),
+        float(quote_size), float(fee_rate), float(initial_cash), float(annual_periods), bool(with_equity)
+    )
@@ -318,48 +318,175 @@ document.addEventListener("DOMContentLoaded", function () {
   })
 
   // === Загрузка данных для графика ===
-  async function loadChartData(symbol, timeframe, startDate, endDate) {
-    try {
-      showMessage("Loading chart data...", "info")
+  // Бинарный ответ /api/get_candles: заголовок 16 байт ("CNDL", версия, count, резерв),
+  // затем колонки time (int64, сек) и open/high/low/close/volume (float64), little-endian
+  const CANDLES_HEADER_BYTES = 16
+  const CANDLES_BINARY_VERSION = 1
+
+  function decodeCandlesBuffer(buffer) {
+    const view = new DataView(buffer)
+    const magic = String.fromCharCode(
+      view.getUint8(0),
+      view.getUint8(1),
+      view.getUint8(2),
+      view.getUint8(3)
+    )
+    if (magic !== "CNDL" || view.getUint32(4, true) !== CANDLES_BINARY_VERSION) {
+      throw new Error("Unsupported candles format")
+    }
+
+    const count = view.getUint32(8, true)
+    const column = (index) =>
+      new Float64Array(buffer, CANDLES_HEADER_BYTES + index * count * 8, count)
+    const time = new BigInt64Array(buffer, CANDLES_HEADER_BYTES, count)
+    const open = column(1)
+    const high = column(2)
+    const low = column(3)
+    const close = column(4)
+    const volume = column(5)
+
+    const candles = new Array(count)
+    for (let i = 0; i < count; i++) {
+      candles[i] = {
+        time: Number(time[i]),
+        open: open[i],
+        high: high[i],
+        low: low[i],
+        close: close[i],
+        volume: volume[i],
+      }
+    }
+    return candles
+  }
 
-      const response = await fetch("/api/get_candles", {
-        method: "POST",
+  // Свечи графика грузятся страницами с конца периода, более ранние - при прокрутке влево.
+  // Если период длиннее CHART_MAX_TOTAL_BARS свечей, сервер агрегирует их в старший таймфрейм
+  const CHART_MAX_TOTAL_BARS = 20000
+  const CHART_MIN_BAR_PIXELS = 2
+  const CHART_PRELOAD_BARS = 50
+
+  let chartState = null
+
+  async function fetchCandlesPage(state) {
+    const container = document.getElementById("candlestick-chart")
+    const width = container ? container.clientWidth : 1000
+    const body = {
+      symbol: state.symbol,
+      timeframe: state.timeframe,
+      start_date: state.startDate,
+      end_date: state.endDate,
+      format: "binary",
+      direction: "backward",
+      // Две ширины графика, чтобы было куда прокручивать до следующей загрузки
+      limit: Math.max(500, 2 * Math.floor(width / CHART_MIN_BAR_PIXELS)),
+    }
+    if (state.barTimeframe) {
+      body.bar_timeframe = state.barTimeframe
+    } else {
+      body.max_bars = CHART_MAX_TOTAL_BARS
+    }
+    if (state.nextCursor !== null) {
+      body.cursor = state.nextCursor
+    }
+
+    // GET, чтобы браузер хранил ответ и перепроверял его по ETag (304 без тела)
+    const response = await fetch(
+      "/api/get_candles?" + new URLSearchParams(body).toString(),
+      {
         headers: {
-          "Content-Type": "application/json",
+          Accept: "application/octet-stream",
         },
-        body: JSON.stringify({
-          symbol: symbol,
-          timeframe: timeframe,
-          start_date: startDate,
-          end_date: endDate,
-        }),
-      })
+      }
+    )
 
+    const contentType = response.headers.get("Content-Type") || ""
+    if (!response.ok || !contentType.startsWith("application/octet-stream")) {
+      // Ошибки сервер возвращает в JSON
       const result = await response.json()
+      throw new Error(result.message || "Error loading chart data")
+    }
 
-      if (response.ok && result.status === "success") {
-        const candles = result.candles
+    const cursor = response.headers.get("X-Next-Cursor")
+    return {
+      candles: decodeCandlesBuffer(await response.arrayBuffer()),
+      barTimeframe: response.headers.get("X-Bar-Timeframe"),
+      nextCursor: cursor === null ? null : Number(cursor),
+    }
+  }
 
-        if (candles.length === 0) {
-          showMessage("No data available for selected parameters", "error")
-          return
-        }
+  async function loadOlderCandles() {
+    const state = chartState
+    if (!state || state.loading || state.nextCursor === null) return
 
-        console.log("Loaded candles:", candles.length)
+    state.loading = true
+    try {
+      const page = await fetchCandlesPage(state)
+      // Пока грузилось, мог быть запрошен другой график
+      if (state !== chartState) return
+
+      state.nextCursor = page.nextCursor
+      state.candles = page.candles.concat(state.candles)
+      candlestickSeries.setData(state.candles)
+      console.log("Loaded older candles:", page.candles.length)
+    } catch (error) {
+      console.error("Load older candles error:", error)
+    } finally {
+      state.loading = false
+    }
+  }
 
-        // Обновляем график свечей
-        if (candlestickSeries) {
-          candlestickSeries.setData(candles)
-          console.log("Chart updated with", candles.length, "candles")
-        }
+  if (candlestickChart) {
+    candlestickChart.timeScale().subscribeVisibleLogicalRangeChange((range) => {
+      if (range && range.from < CHART_PRELOAD_BARS) {
+        loadOlderCandles()
+      }
+    })
+  }
 
-        showMessage(
-          `Loaded ${candles.length} candles for ${symbol} (${timeframe})`,
-          "success"
-        )
-      } else {
-        showMessage(result.message || "Error loading chart data", "error")
+  async function loadChartData(symbol, timeframe, startDate, endDate) {
+    try {
+      showMessage("Loading chart data...", "info")
+
+      const state = {
+        symbol: symbol,
+        timeframe: timeframe,
+        startDate: startDate,
+        endDate: endDate,
+        barTimeframe: null,
+        nextCursor: null,
+        candles: [],
+        loading: true,
+      }
+      chartState = state
+
+      const page = await fetchCandlesPage(state)
+      state.barTimeframe = page.barTimeframe
+      state.nextCursor = page.nextCursor
+      state.candles = page.candles
+      state.loading = false
+      const candles = state.candles
+
+      if (candles.length === 0) {
+        showMessage("No data available for selected parameters", "error")
+        return
+      }
+
+      console.log("Loaded candles:", candles.length)
+
+      // Обновляем график свечей
+      if (candlestickSeries) {
+        candlestickSeries.setData(candles)
+        console.log("Chart updated with", candles.length, "candles")
       }
+
+      const barsInfo =
+        state.barTimeframe && state.barTimeframe !== timeframe
+          ? `${timeframe}, shown as ${state.barTimeframe}`
+          : timeframe
+      showMessage(
+        `Loaded ${candles.length} candles for ${symbol} (${barsInfo})`,
+        "success"
+      )
     } catch (error) {
       showMessage("Error loading chart data: " + error.message, "error")
       console.error("Load chart data error:", error)
@@ -433,7 +560,20 @@ document.addEventListener("DOMContentLoaded", function () {
           }),
         })
 
-        const result = await response.json()
+        const submitted = await response.json()
+
+        if (!submitted.success) {
+          const reason =
+            response.status === 429
+              ? `queue is full (${submitted.queue_length} waiting), try again later`
+              : submitted.error
+          showMessage("Backtest failed: " + reason, "error")
+          return
+        }
+
+        // 200 - результат из кэша, 202 - бэктест поставлен в очередь
+        const result =
+          response.status === 202 ? await pollBacktestJob(submitted.job_id) : submitted
 
         console.log("Backtest result:", result)
 
@@ -441,19 +581,9 @@ document.addEventListener("DOMContentLoaded", function () {
           showMessage("Backtest completed successfully", "success")
           displayResults(result.results)
 
-          if (result.success) {
-            showMessage("Backtest completed successfully", "success")
-            displayResults(result.results)
-
-            // Загружаем данные для графика
-            await loadChartData(symbol, timeframe, startDate, endDate)
-
-            // Добавь эту строку:
-            await loadAndDisplayTrades()
-          }
-
           // Загружаем данные для графика
           await loadChartData(symbol, timeframe, startDate, endDate)
+          await loadAndDisplayTrades(result.run_id)
         } else {
           showMessage("Backtest failed: " + result.error, "error")
         }
@@ -464,6 +594,37 @@ document.addEventListener("DOMContentLoaded", function () {
     })
   }
 
+  // === Опрос статуса бэктеста в очереди ===
+  async function pollBacktestJob(jobId) {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, 1000))
+
+      let result
+      try {
+        const response = await fetch(`/api/backtest_jobs/${jobId}`)
+        result = await response.json()
+      } catch (error) {
+        // Временная ошибка сети - продолжаем опрос
+        continue
+      }
+
+      if (!result.success) {
+        return result
+      }
+
+      const job = result.job
+      if (job.status === "queued") {
+        showMessage(`Backtest #${job.id} queued (position ${job.queue_position})...`, "info")
+      } else if (job.status === "running") {
+        showMessage(`Running backtest #${job.id}...`, "info")
+      } else if (job.status === "done") {
+        return job.result
+      } else {
+        return job.result || { success: false, error: job.message || job.status }
+      }
+    }
+  }
+
   function showMessage(text, type) {
     backtestMessage.textContent = text
     backtestMessage.className = "message message--" + type
@@ -535,9 +696,10 @@ document.addEventListener("DOMContentLoaded", function () {
     resultsContainer.style.display = "block"
   }
 
-  async function loadAndDisplayTrades() {
+  async function loadAndDisplayTrades(runId) {
     try {
-      const response = await fetch("/api/get_trades")
+      const query = runId ? `?run_id=${encodeURIComponent(runId)}` : ""
+      const response = await fetch(`/api/get_trades${query}`)
       const result = await response.json()
 
       if (result.status === "success" && result.trades.length > 0) {
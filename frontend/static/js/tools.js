@@ -7,6 +7,10 @@ document.addEventListener("DOMContentLoaded", function () {
   const downloadProgress = document.getElementById("download-progress")
   const progressBar = document.getElementById("progress-bar")
   const progressText = document.getElementById("progress-text")
+  const cancelDownloadBtn = document.getElementById("cancel-download-btn")
+
+  // ID текущей фоновой задачи загрузки
+  let currentJobId = null
 
   // === Обновление списка символов ===
   if (updateSymbolsBtn) {
@@ -87,6 +91,7 @@ document.addEventListener("DOMContentLoaded", function () {
         period: formData.get("period"),
         start_date: formData.get("start_date"),
         end_date: formData.get("end_date"),
+        only_missing: formData.get("only_missing") === "on",
       }
 
       // Скрываем предыдущие сообщения
@@ -94,7 +99,7 @@ document.addEventListener("DOMContentLoaded", function () {
       showProgress(0, "Preparing download...")
 
       try {
-        const response = await fetch("/api/download_historical_data", {
+        const response = await fetch("/api/ingestion_jobs", {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
@@ -105,14 +110,7 @@ document.addEventListener("DOMContentLoaded", function () {
         const result = await response.json()
 
         if (response.ok && result.status === "success") {
-          showProgress(100, "Download complete!")
-          setTimeout(() => {
-            hideProgress()
-            showDownloadMessage(
-              result.message || "Данные успешно загружены",
-              "success"
-            )
-          }, 1000)
+          pollIngestionJob(result.job_id)
         } else {
           hideProgress()
           showDownloadMessage(
@@ -127,6 +125,75 @@ document.addEventListener("DOMContentLoaded", function () {
     })
   }
 
+  // === Отмена текущей задачи загрузки ===
+  if (cancelDownloadBtn) {
+    cancelDownloadBtn.addEventListener("click", async function () {
+      if (!currentJobId) return
+
+      cancelDownloadBtn.disabled = true
+      try {
+        await fetch(`/api/ingestion_jobs/${currentJobId}/cancel`, {
+          method: "POST",
+        })
+      } catch (error) {
+        showDownloadMessage("Ошибка соединения с сервером", "error")
+      }
+    })
+  }
+
+  // === Опрос статуса фоновой задачи загрузки ===
+  async function pollIngestionJob(jobId) {
+    currentJobId = jobId
+    if (cancelDownloadBtn) {
+      cancelDownloadBtn.disabled = false
+      cancelDownloadBtn.style.display = "inline-flex"
+    }
+
+    while (currentJobId === jobId) {
+      try {
+        const response = await fetch(`/api/ingestion_jobs/${jobId}`)
+        const result = await response.json()
+
+        if (!response.ok || result.status !== "success") {
+          finishJob()
+          showDownloadMessage(
+            result.message || "Ошибка получения статуса загрузки",
+            "error"
+          )
+          return
+        }
+
+        const job = result.job
+        const done = job.completed_periods + job.failed_periods
+        showProgress(
+          Math.round(job.progress),
+          `Job #${job.id} ${job.status}: ${done}/${job.total_periods} periods, ${job.inserted} candles added`
+        )
+
+        if (["done", "failed", "cancelled"].includes(job.status)) {
+          finishJob()
+          showDownloadMessage(
+            job.message || `Задача #${job.id}: ${job.status}`,
+            job.status === "done" ? "success" : "error"
+          )
+          return
+        }
+      } catch (error) {
+        // Временная ошибка сети - продолжаем опрос
+      }
+
+      await new Promise((resolve) => setTimeout(resolve, 1000))
+    }
+  }
+
+  function finishJob() {
+    currentJobId = null
+    if (cancelDownloadBtn) {
+      cancelDownloadBtn.style.display = "none"
+    }
+    setTimeout(hideProgress, 1000)
+  }
+
   // === Вспомогательные функции ===
   function showSymbolsMessage(text, type) {
     symbolsMessage.textContent = text
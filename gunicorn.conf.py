@@ -0,0 +1,50 @@
+"""
+Настройки Gunicorn
+
+Запуск: gunicorn -c gunicorn.conf.py app:app
+"""
+import os
+import time
+
+_config_loaded = time.perf_counter()
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+# Воркеры делят общий лимит бэктестов (BACKTEST_WORKERS) - пул каждого берет свою долю
+os.environ['GUNICORN_WORKERS'] = str(workers)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+# Загружать приложение и тяжелые модули (pandas, ядра Numba, vectorbt) один раз в мастере:
+# воркеры получают их через fork без импорта, страницы памяти общие (copy-on-write)
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+if preload_app:
+    # Приложение импортируется в мастере - фоновые потоки запускает post_fork в каждом воркере
+    os.environ['APP_BACKGROUND_AUTOSTART'] = '0'
+
+
+def on_starting(server):
+    """Предзагружает тяжелые модули в мастере и сообщает стоимость импорта"""
+    if not preload_app:
+        return
+    server.log.info(f"📦 Приложение загружено в мастере за {round(time.perf_counter() - _config_loaded, 3)} сек")
+    from backend.core.preload import preload_modules, format_timings
+    server.log.info(f"📦 Тяжелые модули загружены в мастере за {format_timings(preload_modules())}")
+
+
+def post_fork(server, worker):
+    """Прогревает ядра Numba в воркере до приема запросов (NUMBA_WARMUP=0 - отключить)"""
+    worker.boot_started = time.perf_counter()
+    from backend.core.jit import NUMBA_WARMUP, warmup
+    if NUMBA_WARMUP:
+        # Воркер делает fork процессов пула бэктестов - parallel ядра прогревают они сами
+        timings = warmup(parallel=False)
+        worker.log.info(f"🔥 Ядра Numba прогреты (pid {worker.pid}): импорт {timings['import_seconds']} сек, "
+                        f"первый вызов {timings['first_call_seconds']} сек")
+    if preload_app:
+        from app import start_background_services
+        start_background_services()
+
+
+def post_worker_init(worker):
+    """Сообщает, за сколько воркер готов принимать запросы (с импортом приложения без preload)"""
+    worker.log.info(f"🚀 Воркер {worker.pid} готов за {round(time.perf_counter() - worker.boot_started, 3)} сек")
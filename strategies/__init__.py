@@ -36,6 +36,21 @@ def get_strategies_list() -> List[Dict[str, Any]]:
                 
     return strategies
 
+def get_strategies_version() -> tuple:
+    """
+    Версия списка стратегий: имена файлов strategies/str и их время изменения
+    """
+    str_dir = os.path.join(os.path.dirname(__file__), 'str')
+    
+    if not os.path.exists(str_dir):
+        return ()
+    
+    return tuple(sorted(
+        (entry.name, entry.stat().st_mtime_ns)
+        for entry in os.scandir(str_dir)
+        if entry.name.endswith('.py') and entry.name != '__init__.py'
+    ))
+
 def get_strategy_class(module_name: str, class_name: str):
     """
     Получить класс стратегии по имени модуля и класса
@@ -16,6 +16,11 @@ class BaseStrategy:
         'params': {}
     }
     
+    # Параметры, которые влияют только на get_exit_params, но не на generate_signals.
+    # Перебор параметров считает сигналы один раз для всех их значений;
+    # стратегия, использующая их в сигналах, должна переопределить список
+    EXIT_PARAMS = ('take_profit', 'stop_loss', 'trail_offset')
+    
     def __init__(self, **kwargs):
         """Сохраняет параметры стратегии"""
         self.params = kwargs
@@ -0,0 +1,71 @@
+"""
+Сверка native движка (Numba) с vectorbt
+
+Запуск: python -m pytest tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('vectorbt')
+
+from backend.core.backtest_runner import backtest_runner
+from backend.core.trade_simulator import simulate_trade_records_nb, simulate_metrics_batch_nb
+from backend.core.metrics_nb import METRIC_NAMES, periods_per_year
+
+COMPARED = ('final_value', 'profit', 'total_return', 'sharpe_ratio', 'max_drawdown', 'trades_count', 'win_rate')
+
+
+def _market(n=5000, seed=7):
+    """Случайные 1h свечи и сигналы (10% баров)"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.005, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.005, n))
+    df = pd.DataFrame({'open': open_, 'high': high, 'low': low, 'close': close},
+                      index=pd.date_range('2024-01-01', periods=n, freq='1h'))
+    signals = np.where(rng.random(n) < 0.1, rng.choice([-1.0, 1.0], n), 0.0)
+    return df, signals
+
+
+def _run_both(df, signals, exit_params, quote_size, initial_cash, fee_rate):
+    records = simulate_trade_records_nb(
+        signals, df['open'].values, df['high'].values, df['low'].values, df['close'].values,
+        exit_params['take_profit'], exit_params['trail_offset'], exit_params['stop_loss'],
+        quote_size, fee_rate, initial_cash
+    )
+    native = backtest_runner._native_results(records, df, initial_cash, '1h')['results']
+    pf = backtest_runner._run_vectorbt(df, signals, exit_params, quote_size, initial_cash, fee_rate, '1h')
+    reference = backtest_runner._format_results(pf, initial_cash, len(pf.trades.records))['results']
+    return native, reference
+
+
+@pytest.mark.parametrize('quote_size, initial_cash, fee_rate, exit_params', [
+    # Размер по умолчанию: quote не задан и равен начальному капиталу
+    (10000.0, 10000.0, 0.001, {'take_profit': 0.01, 'trail_offset': 0.0, 'stop_loss': 0.02}),
+    (10000.0, 10000.0, 0.001, {'take_profit': 0.02, 'trail_offset': 0.005, 'stop_loss': 0.03}),
+    # Позиция больше капитала и разорение
+    (50000.0, 10000.0, 0.002, {'take_profit': 0.05, 'trail_offset': 0.0, 'stop_loss': 0.02}),
+    (10000.0, 10000.0, 0.002, {'take_profit': 0.05, 'trail_offset': 0.0, 'stop_loss': 0.9}),
+    # Позиция меньше капитала - ограничение не срабатывает
+    (100.0, 100000.0, 0.0005, {'take_profit': 0.01, 'trail_offset': 0.002, 'stop_loss': 0.02}),
+])
+def test_native_matches_vectorbt(quote_size, initial_cash, fee_rate, exit_params):
+    df, signals = _market()
+    native, reference = _run_both(df, signals, exit_params, quote_size, initial_cash, fee_rate)
+    for name in COMPARED:
+        assert native[name] == pytest.approx(reference[name], rel=1e-9, abs=1e-9), name
+
+
+def test_metrics_batch_matches_single_run():
+    df, signals = _market()
+    exit_params = {'take_profit': 0.01, 'trail_offset': 0.0, 'stop_loss': 0.02}
+    native, _ = _run_both(df, signals, exit_params, 10000.0, 10000.0, 0.001)
+    metrics = simulate_metrics_batch_nb(
+        signals, df['open'].values, df['high'].values, df['low'].values, df['close'].values,
+        np.full(3, 0.01), np.zeros(3), np.full(3, 0.02),
+        10000.0, 0.001, 10000.0, periods_per_year('1h'), True
+    )
+    for row in metrics:
+        assert dict(zip(METRIC_NAMES, row)) == pytest.approx({name: native[name] for name in METRIC_NAMES})
@@ -0,0 +1,48 @@
+"""
+Приведение типов на входе симулятора
+
+Запуск: python -m pytest tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.core.trade_simulator import (
+    simulate_trade_records, simulate_trade_records_nb, simulate_trades, simulate_metrics_batch
+)
+
+
+def _market(n=500, seed=3):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * 1.003
+    low = np.minimum(open_, close) * 0.997
+    signals = np.where(rng.random(n) < 0.1, rng.choice([-1, 1], n), 0)
+    return signals, open_, high, low, close
+
+
+def test_kernels_accept_float64_only():
+    signals, *ohlc = _market()
+    with pytest.raises(TypeError):
+        simulate_trade_records_nb(signals, *ohlc, 0.01, 0.0, 0.02, 1000.0, 0.001, 10000.0)
+
+
+def test_wrappers_cast_inputs():
+    signals, *ohlc = _market()
+    expected = simulate_trade_records_nb(signals.astype(np.float64), *ohlc, 0.01, 0.0, 0.02, 1000.0, 0.001, 10000.0)
+    assert len(expected) > 0
+
+    # Сигналы int64, OHLC float32 и Series, целые параметры
+    ohlc32 = [values.astype(np.float32) for values in ohlc]
+    records = simulate_trade_records(signals, *ohlc32, 0.01, 0, 0.02, 1000, 0.001, 10000)
+    assert len(records) == len(expected)
+    records = simulate_trade_records(pd.Series(signals), *[pd.Series(values) for values in ohlc],
+                                     0.01, 0, 0.02, 1000, 0.001, 10000)
+    assert np.array_equal(records, expected)
+
+    order_size, _ = simulate_trades(signals, *ohlc, 0.01, 0, 0.02, 1000, 0.001, 10000)
+    assert np.count_nonzero(order_size) > 0
+    metrics = simulate_metrics_batch(signals, *ohlc32, [0.01, 0.02], [0, 0], [0.02, 0.02],
+                                     1000, 0.001, 10000, 8760, 1)
+    assert metrics.shape == (2, 7)